@@ -0,0 +1,127 @@
+"""
+Embedding Backend Parity Check
+Encodes the same texts with the torch SentenceTransformer and with an ONNX
+backend (EMBEDDING_BACKEND onnx or onnx-int8), checks that every vector's cosine
+similarity to the torch one is at least --min-cosine, and compares batch
+throughput, single-query latency and cold start (imports + load + first encode,
+each in a fresh process) with its peak RSS. Needs the real model; the ONNX
+export is created on first run if it is missing:
+
+    python benchmarks/embedding_parity.py --backend onnx-int8
+    python benchmarks/embedding_parity.py --backend onnx --min-cosine 0.9999
+
+Exits non-zero if any vector falls below --min-cosine.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+QUERIES = [
+    "what's the total on the bakery invoice?",
+    "when is my dentist appointment",
+    "send me the lecture notes on thermodynamics",
+    "INV-2041",
+    "who signed the rental contract and for how long?",
+    "recipe with almonds and sourdough",
+    "summarize chapter 3 of the travel report",
+    "photo of the marble statue from the museum",
+]
+
+PASSAGES = [
+    "Invoice INV-2041 from Sunrise Bakery, dated 14 March: 40 sourdough loaves at 3.50 EUR, "
+    "12 almond croissants at 1.80 EUR, delivery fee 6.00 EUR. Total due 167.60 EUR by 30 March.",
+    "The tenancy agreement for the flat on Harbor Street runs for twenty-four months starting 1 June "
+    "and was signed by both tenants and the landlord's agent. The deposit equals three months of rent.",
+    "Lecture 7 covers the second law of thermodynamics: entropy of an isolated system never decreases, "
+    "which sets the maximum efficiency of any heat engine operating between two reservoirs.",
+    "Day two of the trip: a morning train along the coast, lunch in the old town, and an afternoon at "
+    "the archaeology museum, where the marble statues from the temple are on display.",
+    "Reminder: dental check-up on Thursday at 9:30 with Dr. Okafor, please arrive ten minutes early "
+    "and bring your insurance card.",
+    "Quarterly report: revenue grew 12% while operating costs stayed flat; headcount increased in the "
+    "support team to cover the new regions.",
+]
+
+
+def cold_start(identity):
+    """Child process mode: time imports, model load and the first encode from a fresh interpreter."""
+    started = time.perf_counter()
+    from tools.embedding_backend_tools import load_backend
+    model = load_backend(identity)
+    model.encode([QUERIES[0]])
+    seconds = time.perf_counter() - started
+    from benchmarks.run_benchmarks import peak_rss_mb
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": peak_rss_mb()}))
+
+
+def measure_cold_start(identity):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--cold-start", identity],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def cosine(a, b):
+    import numpy as np
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def measure(model, texts, batch_size):
+    """(texts/sec for batched encoding, single-query latency summary)."""
+    from benchmarks.run_benchmarks import summarize
+
+    model.encode(texts[:batch_size], batch_size=batch_size)  # Warm-up
+    started = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    throughput = len(texts) / (time.perf_counter() - started)
+    latencies = []
+    for query in QUERIES * 5:
+        started = time.perf_counter()
+        model.encode([query])
+        latencies.append(time.perf_counter() - started)
+    return throughput, summarize(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cosine parity and speed of an ONNX embedding backend against torch.")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+    parser.add_argument("--backend", choices=("onnx", "onnx-int8"), default="onnx-int8")
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=40, help="copies of the passages in the throughput corpus")
+    args = parser.parse_args(argv)
+
+    from tools.embedding_backend_tools import embedding_identity, load_backend
+
+    identity = embedding_identity(args.model, args.backend)
+    reference = load_backend(args.model)
+    candidate = load_backend(identity)  # Exports first if needed, so the cold start below is a pure load
+
+    texts = QUERIES + PASSAGES
+    similarities = [cosine(a, b) for a, b in zip(reference.encode(texts), candidate.encode(texts))]
+    failures = sum(s < args.min_cosine for s in similarities)
+    print(f"cosine vs torch over {len(texts)} texts: min {min(similarities):.5f}, "
+          f"mean {sum(similarities) / len(similarities):.5f} (threshold {args.min_cosine})")
+
+    corpus = [f"{passage} ({i})" for i in range(args.repeat) for passage in PASSAGES]
+    for name, model, key in (("torch", reference, args.model), (args.backend, candidate, identity)):
+        throughput, latency = measure(model, corpus, args.batch_size)
+        cold = measure_cold_start(key)
+        print(f"  {name:<10} {throughput:8.1f} texts/s | query p50 {latency['p50_ms']:.2f}ms p95 {latency['p95_ms']:.2f}ms"
+              f" | cold start {cold['seconds']:.2f}s, peak RSS {cold['peak_rss_mb'] or 0:.0f} MB")
+
+    print(f"{len(texts) - failures}/{len(texts)} vectors within the cosine threshold")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--cold-start":
+        cold_start(sys.argv[2])
+        sys.exit(0)
+    sys.exit(main())
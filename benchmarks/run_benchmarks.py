@@ -0,0 +1,360 @@
+"""
+Offline Benchmark Suite
+Drives handle_file_upload, hybrid_retrieve and
+process_user_query directly against synthetic text, PDF and image corpora, with
+deterministic stub LLM, vision, OCR and embedding backends (see stubs.py).
+No Telegram token or model download is needed; ChromaDB, the catalog and the
+caches run for real inside a throwaway work directory.
+
+Reports chunks/sec, p50/p95/p99 latencies and peak RSS, and writes JSON that a
+later run can be compared against:
+
+    python benchmarks/run_benchmarks.py --out before.json
+    python benchmarks/run_benchmarks.py --out after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_WORDS = ("alpha amber atlas basil beacon birch cedar cobalt comet coral delta ember falcon fern "
+          "garnet glacier harbor hazel indigo iris jasper juniper kestrel lagoon lantern maple meadow "
+          "nebula nutmeg onyx orchid pebble pine quartz quill raven ridge saffron sage summit thistle "
+          "tundra umber valley velvet willow yarrow zephyr zinnia budget invoice meeting schedule "
+          "recipe travel project report contract receipt lecture chapter").split()
+
+SMALL_TALK = ["hi", "hey cutie", "lol", "good morning!", "thanks babe", "how are you", "haha ok", "gn"]
+
+
+def percentile(sorted_values, p):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+def summarize(latencies):
+    """Latency stats in milliseconds."""
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values),
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+        "max_ms": 1000 * values[-1],
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None if the platform can't say."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def _sentence(rng, code):
+    words = rng.sample(_WORDS, rng.randint(8, 16))
+    if rng.random() < 0.3:
+        words.insert(rng.randint(0, len(words)), code)
+    return " ".join(words).capitalize() + "."
+
+
+def build_corpus(corpus_dir, args, rng):
+    """Writes the synthetic files. Returns [(path, file_name, mime_type, code, sample_sentence)]."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    files = []
+
+    for i in range(args.text_docs):
+        code = f"TXT-{i:04d}"
+        sentences = [_sentence(rng, code) for _ in range(args.sentences)]
+        paragraphs = ["\n".join(sentences[j:j + 5]) for j in range(0, len(sentences), 5)]
+        path = os.path.join(corpus_dir, f"notes_{i:04d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+        files.append((path, os.path.basename(path), "text/plain", code, rng.choice(sentences)))
+
+    if args.pdf_docs:
+        try:
+            from reportlab.pdfgen import canvas
+            from reportlab.lib.pagesizes import letter
+        except ImportError:
+            print("reportlab is not installed, skipping the PDF corpus.")
+            args.pdf_docs = 0
+    for i in range(args.pdf_docs):
+        code = f"PDF-{i:04d}"
+        path = os.path.join(corpus_dir, f"report_{i:04d}.pdf")
+        c = canvas.Canvas(path, pagesize=letter)
+        sample = None
+        for _ in range(args.pdf_pages):
+            text = c.beginText(40, 750)
+            text.setFont("Helvetica", 10)
+            for _ in range(args.sentences):
+                sentence = _sentence(rng, code)
+                sample = sample or sentence
+                text.textLine(sentence[:110])
+            c.drawText(text)
+            c.showPage()
+        c.save()
+        files.append((path, os.path.basename(path), "application/pdf", code, sample[:110]))
+
+    if args.images:
+        from PIL import Image, ImageDraw
+    for i in range(args.images):
+        path = os.path.join(corpus_dir, f"photo_{i:04d}.jpg")
+        img = Image.new("RGB", (args.image_size, args.image_size * 3 // 4), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            box = sorted(rng.randrange(img.width) for _ in range(2)) + sorted(rng.randrange(img.height) for _ in range(2))
+            draw.rectangle((box[0], box[2], box[1], box[3]), fill=tuple(rng.randrange(256) for _ in range(3)))
+        img.save(path, "JPEG", quality=90)
+        files.append((path, os.path.basename(path), "image/jpeg", None, None))
+
+    return files
+
+
+def install_stubs(args):
+    """Swaps the model backends for the deterministic stubs."""
+    from benchmarks.stubs import StubEmbeddingModel, StubLlama, stub_ocr
+    import orchestrator
+    from tools import embedding_tools
+    from tools.model_manager_tools import MODELS
+
+    MODELS.adopt("chat", StubLlama(args.reply_tokens, args.prefill_ms, args.decode_ms))
+    MODELS.adopt("vision", StubLlama(args.reply_tokens, args.prefill_ms, args.decode_ms))
+    if not args.real_ocr:
+        orchestrator.perform_ocr = stub_ocr
+    if not args.real_embeddings:
+        embedding_tools._models[embedding_tools.EMBEDDING_MODEL_ID] = StubEmbeddingModel(seconds_per_text=args.embed_ms / 1000)
+
+
+def bench_ingest(files):
+    import orchestrator
+    from tools.vector_db_tools import get_collection
+
+    collection = get_collection()
+    os.makedirs("downloads", exist_ok=True)
+    by_type = {}
+    for path, file_name, mime_type, _, _ in files:
+        # main.py downloads uploads into downloads/ before handing them over
+        target = os.path.join("downloads", file_name)
+        shutil.copyfile(path, target)
+        before = collection.count()
+        started = time.perf_counter()
+        reply = orchestrator.handle_file_upload(target, file_name, mime_type, user_id=1)
+        elapsed = time.perf_counter() - started
+        stats = by_type.setdefault(mime_type, {"latencies": [], "chunks": 0, "errors": 0})
+        stats["latencies"].append(elapsed)
+        stats["chunks"] += collection.count() - before
+        if "Error" in reply:
+            stats["errors"] += 1
+            print(f"  {file_name}: {reply}")
+
+    report = {}
+    for mime_type, stats in by_type.items():
+        seconds = sum(stats["latencies"])
+        report[mime_type] = {
+            "files": len(stats["latencies"]),
+            "chunks": stats["chunks"],
+            "errors": stats["errors"],
+            "chunks_per_sec": stats["chunks"] / seconds if seconds else None,
+            "latency": summarize(stats["latencies"]),
+        }
+    return report
+
+
+def build_queries(files, count, rng):
+    """Content questions, file-name/ID lookups and small talk, in a fixed shuffled mix."""
+    queries = []
+    documents = [f for f in files if f[3]]
+    for _ in range(count):
+        kind = rng.random()
+        if documents and kind < 0.5:
+            sample = rng.choice(documents)[4].rstrip(".").split()
+            start = rng.randrange(max(1, len(sample) - 5))
+            queries.append("what do my notes say about " + " ".join(sample[start:start + 5]).lower())
+        elif documents and kind < 0.75:
+            _, file_name, _, code, _ = rng.choice(documents)
+            queries.append(f"what was in {file_name}" if rng.random() < 0.5 else f"find {code}")
+        else:
+            queries.append(rng.choice(SMALL_TALK))
+    return queries
+
+
+def bench_retrieval(queries, n_results):
+    from tools.vector_db_tools import hybrid_retrieve
+
+    hybrid = []
+    for query in queries:
+        started = time.perf_counter()
+        hybrid_retrieve(query, n_results=n_results)
+        hybrid.append(time.perf_counter() - started)
+    return {"hybrid_retrieve": summarize(hybrid)}
+
+
+def bench_queries(queries):
+    import orchestrator
+
+    latencies = []
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        orchestrator.process_user_query(query, user_id=i % 8)
+        latencies.append(time.perf_counter() - started)
+    return {"process_user_query": summarize(latencies)}
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(current, baseline, threshold_pct):
+    """Prints latency/throughput deltas against a baseline run. Returns the regressed metric names."""
+    now, before = _flatten(current), _flatten(baseline)
+    regressions = []
+    print(f"\n  {'metric':<58} {'baseline':>10} {'current':>10} {'change':>8}")
+    for key in sorted(now.keys() & before.keys()):
+        higher_is_better = key.endswith("chunks_per_sec")
+        if not (higher_is_better or key.endswith("_ms") or key.endswith("peak_rss_mb")):
+            continue
+        old, new = before[key], now[key]
+        if not old:
+            continue
+        change = 100 * (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > threshold_pct else ""
+        if flag:
+            regressions.append(key)
+        print(f"  {key:<58} {old:>10.2f} {new:>10.2f} {change:>+7.1f}%{flag}")
+    return regressions
+
+
+def print_report(results):
+    print("\n" + "=" * 60)
+    print("  BENCHMARK RESULTS")
+    print("=" * 60)
+    for mime_type, stats in results["ingest"].items():
+        rate = stats["chunks_per_sec"]
+        rate = f"{rate:.1f} chunks/s" if rate is not None else "-"
+        lat = stats["latency"]
+        print(f"  ingest {mime_type:<16} {stats['files']:>4} files {stats['chunks']:>6} chunks  {rate:>16}  "
+              f"p50 {lat['p50_ms']:.1f}ms p95 {lat['p95_ms']:.1f}ms p99 {lat['p99_ms']:.1f}ms")
+    for section in ("retrieval", "query"):
+        for name, lat in results[section].items():
+            if lat["count"]:
+                print(f"  {name:<30} p50 {lat['p50_ms']:.2f}ms p95 {lat['p95_ms']:.2f}ms p99 {lat['p99_ms']:.2f}ms")
+    rss = results["peak_rss_mb"]
+    print(f"  peak RSS {rss:.1f} MB" if rss is not None else "  peak RSS unavailable on this platform")
+    print("=" * 60 + "\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingestion / retrieval / query benchmarks.")
+    parser.add_argument("--text-docs", type=int, default=20, help="synthetic .txt files")
+    parser.add_argument("--pdf-docs", type=int, default=5, help="synthetic PDFs")
+    parser.add_argument("--pdf-pages", type=int, default=4, help="pages per PDF")
+    parser.add_argument("--images", type=int, default=5, help="synthetic JPEG images")
+    parser.add_argument("--image-size", type=int, default=800, help="image width in pixels")
+    parser.add_argument("--sentences", type=int, default=40, help="sentences per text file / PDF page")
+    parser.add_argument("--queries", type=int, default=100, help="queries for the retrieval and chat runs")
+    parser.add_argument("--n-results", type=int, default=4, help="chunks retrieved per query")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--reply-tokens", type=int, default=48, help="stub LLM reply length")
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="simulated stub LLM cost per prompt token")
+    parser.add_argument("--decode-ms", type=float, default=0.0, help="simulated stub LLM cost per generated token")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="simulated stub encoder cost per text")
+    parser.add_argument("--real-embeddings", action="store_true", help="use the real sentence-transformers model")
+    parser.add_argument("--real-ocr", action="store_true", help="use Tesseract instead of the OCR stub")
+    parser.add_argument("--workdir", help="keep stores and corpus here instead of a temp dir")
+    parser.add_argument("--out", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--regress-pct", type=float, default=10.0,
+                        help="with --compare, exit non-zero if a metric is this much worse")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out_path = os.path.abspath(args.out) if args.out else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="agent-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    # Isolated stores; these must be set before the project modules read them at import
+    os.environ["CHROMA_DB_PATH"] = os.path.join(workdir, "chroma_db")
+    os.environ["CATALOG_DB_PATH"] = os.path.join(workdir, "file_catalog.db")
+    os.environ["INGEST_DB_PATH"] = os.path.join(workdir, "ingest_jobs.db")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.db")
+    os.environ["SESSION_DB_PATH"] = ""
+    sys.path.insert(0, PROJECT_DIR)
+    os.chdir(workdir)
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    install_stubs(args)
+    files = build_corpus(os.path.join(workdir, "corpus"), args, rng)
+    queries = build_queries(files, args.queries, rng)
+
+    print(f"Benchmarking in {workdir}: {len(files)} files, {len(queries)} queries...")
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "workdir")},
+        },
+        "ingest": bench_ingest(files),
+        "retrieval": bench_retrieval(queries, args.n_results),
+        "query": bench_queries(queries),
+    }
+    results["peak_rss_mb"] = peak_rss_mb()
+    results["meta"]["total_seconds"] = time.perf_counter() - started
+    print_report(results)
+
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {out_path}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if compare_path:
+        with open(compare_path, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.regress_pct)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.regress_pct:.0f}%.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
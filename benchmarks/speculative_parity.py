@@ -0,0 +1,110 @@
+"""
+Speculative Decoding Parity Check
+Runs the same greedy chat completions through the plain chat model and through
+the speculative one (SPECULATIVE_MODE prompt_lookup or draft), checks that the
+outputs are identical, and reports tokens/sec and the draft acceptance rate.
+Needs the real GGUF models (downloaded on first run like the bot does):
+
+    python benchmarks/speculative_parity.py --mode prompt_lookup
+    python benchmarks/speculative_parity.py --mode draft --max-tokens 256
+
+Exits non-zero if any output differs from the baseline.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CONTEXT = (
+    "Invoice INV-2041 from Sunrise Bakery, dated 14 March: 40 sourdough loaves at 3.50 EUR, "
+    "12 almond croissants at 1.80 EUR, delivery fee 6.00 EUR. Total due 167.60 EUR by 30 March. "
+    "Payment by bank transfer to IBAN DE12 5001 0517 0648 4898 90, reference INV-2041."
+)
+
+PROMPTS = [
+    f"Context retrieved from memory:\n{CONTEXT}\n\nUser Question:\nWhat is the total on INV-2041 and when is it due?",
+    f"Context retrieved from memory:\n{CONTEXT}\n\nUser Question:\nQuote the payment instructions exactly.",
+    f"Context retrieved from memory:\n{CONTEXT}\n\nUser Question:\nList every line item with its price.",
+    "Write a short poem about a cat named Mochi who loves rainy nights.",
+    "Explain in three sentences why the sky looks blue.",
+]
+
+
+def load_llm(draft_model=None, n_ctx=2048, n_threads=8):
+    from huggingface_hub import hf_hub_download
+    from llama_cpp import Llama
+    from tools.llm_tools import HF_REPO_ID, HF_FILENAME, MODEL_DIR
+
+    model_path = hf_hub_download(repo_id=HF_REPO_ID, filename=HF_FILENAME, local_dir=MODEL_DIR,
+                                 local_dir_use_symlinks=False)
+    # CPU only: that is where speculative decoding is meant to help
+    return Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=0,
+                 draft_model=draft_model, seed=0, verbose=False)
+
+
+def run(llm, prompt, max_tokens):
+    """Greedy completion. Returns (text, completion_tokens, seconds)."""
+    messages = [{"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}]
+    started = time.perf_counter()
+    response = llm.create_chat_completion(messages=messages, max_tokens=max_tokens,
+                                          temperature=0.0, top_k=1, seed=0)
+    seconds = time.perf_counter() - started
+    return response["choices"][0]["message"]["content"], response["usage"]["completion_tokens"], seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Greedy-output parity and speed of speculative decoding.")
+    parser.add_argument("--mode", choices=("prompt_lookup", "draft"), default="prompt_lookup")
+    parser.add_argument("--max-tokens", type=int, default=192)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    from tools import speculative_tools
+    from tools.llm_tools import MODEL_DIR
+
+    speculative_tools.SPECULATIVE_MODE = args.mode
+    baseline = load_llm(None, args.n_ctx, args.threads)
+    draft_model = speculative_tools.build_draft_model(args.n_ctx, MODEL_DIR, args.threads)
+    speculative = load_llm(draft_model, args.n_ctx, args.threads)
+
+    mismatches = 0
+    totals = {"baseline": [0, 0.0], "speculative": [0, 0.0]}
+    calls = drafted = 0
+    for i, prompt in enumerate(PROMPTS, start=1):
+        base_text, base_tokens, base_seconds = run(baseline, prompt, args.max_tokens)
+        before = draft_model.counters()
+        spec_text, spec_tokens, spec_seconds = run(speculative, prompt, args.max_tokens)
+        after = draft_model.counters()
+        calls += after[0] - before[0]
+        drafted += after[1] - before[1]
+        totals["baseline"][0] += base_tokens
+        totals["baseline"][1] += base_seconds
+        totals["speculative"][0] += spec_tokens
+        totals["speculative"][1] += spec_seconds
+
+        same = base_text == spec_text
+        mismatches += not same
+        print(f"[{i}] {'OK      ' if same else 'MISMATCH'} {base_tokens / base_seconds:6.1f} -> "
+              f"{spec_tokens / spec_seconds:6.1f} tok/s")
+        if not same:
+            diverge = next((j for j, (a, b) in enumerate(zip(base_text, spec_text)) if a != b),
+                           min(len(base_text), len(spec_text)))
+            print(f"    differs at char {diverge}: {base_text[diverge:diverge + 40]!r} vs {spec_text[diverge:diverge + 40]!r}")
+
+    base_rate = totals["baseline"][0] / totals["baseline"][1]
+    spec_rate = totals["speculative"][0] / totals["speculative"][1]
+    accepted = min(drafted, max(0, totals["speculative"][0] - calls))
+    print(f"\nbaseline {base_rate:.1f} tok/s, {args.mode} {spec_rate:.1f} tok/s ({spec_rate / base_rate:.2f}x)")
+    print(f"drafted {drafted} tokens, ~{accepted} accepted ({accepted / drafted:.0%} acceptance)" if drafted
+          else "no tokens were drafted")
+    print(f"{len(PROMPTS) - mismatches}/{len(PROMPTS)} outputs identical to the baseline")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Deterministic stand-ins for the model backends, used by the benchmarks.
+They expose the slice of the llama-cpp-python / sentence-transformers API the
+tools call, so everything around the models (scheduler, chunker, caches, Chroma,
+catalog, prompt fitting) runs for real without downloading any weights.
+"""
+
+import re
+import time
+import zlib
+import numpy as np
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+class StubTokenizer:
+    """Word-piece-like tokenizer: one token per word or punctuation mark."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        single = isinstance(texts, str)
+        batch = [texts] if single else texts
+        input_ids, offsets = [], []
+        for text in batch:
+            matches = list(_WORD.finditer(text))
+            input_ids.append([zlib.crc32(m.group(0).lower().encode("utf-8")) % 30000 for m in matches])
+            offsets.append([(m.start(), m.end()) for m in matches])
+        result = {"input_ids": input_ids[0] if single else input_ids}
+        if return_offsets_mapping:
+            result["offset_mapping"] = offsets[0] if single else offsets
+        return result
+
+
+class StubEmbeddingModel:
+    """Hashed bag-of-words vectors, L2-normalized like all-MiniLM-L6-v2's output."""
+
+    def __init__(self, dim=384, max_seq_length=256, seconds_per_text=0.0):
+        self.dim = dim
+        self.max_seq_length = max_seq_length
+        self.seconds_per_text = seconds_per_text
+        self.tokenizer = StubTokenizer()
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        if self.seconds_per_text:
+            time.sleep(self.seconds_per_text * len(texts))
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _WORD.findall(text.lower()):
+                h = zlib.crc32(word.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 1 else -1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+
+class StubLlama:
+    """
+    Chat model stand-in with llama-cpp-python's create_chat_completion, tokenize and
+    detokenize. Replies are a deterministic function of the last message; latency is
+    simulated per prompt token (prefill) and per generated token (decode).
+    """
+
+    def __init__(self, reply_tokens=48, prefill_ms_per_token=0.0, decode_ms_per_token=0.0):
+        self.reply_tokens = reply_tokens
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+
+    # 3 bytes per token, with a 0x01 marker byte so leading zero bytes survive the round trip
+    def tokenize(self, text, add_bos=True, special=False):
+        return [int.from_bytes(b"\x01" + text[i:i + 3], "big") for i in range(0, len(text), 3)]
+
+    def detokenize(self, tokens):
+        return b"".join(t.to_bytes((t.bit_length() + 7) // 8, "big")[1:] for t in tokens)
+
+    def _reply_words(self, messages):
+        last = messages[-1]["content"] if messages else ""
+        if isinstance(last, list):
+            last = " ".join(part.get("text", "") for part in last if isinstance(part, dict))
+        seed = zlib.crc32(last.encode("utf-8"))
+        vocab = ["sunny", "little", "note", "memory", "file", "cozy", "bright", "quiet",
+                 "ocean", "paper", "garden", "window", "morning", "story", "silver", "river"]
+        return [vocab[(seed >> (i % 28)) % len(vocab)] for i in range(self.reply_tokens)]
+
+    def create_chat_completion(self, messages, max_tokens=None, stream=False, **kwargs):
+        prompt_tokens = sum(len(self.tokenize(str(m["content"]).encode("utf-8"))) for m in messages)
+        if self.prefill_ms_per_token:
+            time.sleep(prompt_tokens * self.prefill_ms_per_token / 1000)
+        words = self._reply_words(messages)[:max_tokens or self.reply_tokens]
+
+        if not stream:
+            if self.decode_ms_per_token:
+                time.sleep(len(words) * self.decode_ms_per_token / 1000)
+            return {"choices": [{"message": {"role": "assistant", "content": " ".join(words)}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words)}}
+
+        def chunks():
+            for i, word in enumerate(words):
+                if self.decode_ms_per_token:
+                    time.sleep(self.decode_ms_per_token / 1000)
+                yield {"choices": [{"delta": {"content": word if i == 0 else " " + word}}]}
+        return chunks()
+
+
+def stub_ocr(image):
+    """Deterministic OCR result derived from the file name, or the image size for in-memory images."""
+    if not isinstance(image, str):
+        return f"Scanned label {image.width} by {image.height}"
+    stem = image.replace("\\", "/").rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return f"Scanned label {stem.replace('_', ' ')}"
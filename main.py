@@ -1,10 +1,18 @@
+import time
+BOOT_STARTED = time.perf_counter()
+
 import os
 import logging
 import asyncio
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
-from orchestrator import handle_file_upload, process_user_query, delete_all_memory
+from orchestrator import ingest_queue, process_user_query, delete_all_memory, clean_reply_tags, find_known_upload
+from tools.catalog_tools import HashingWriter
+from tools.scheduler_tools import SchedulerBusyError
+from tools.startup_tools import STARTUP, WARMUP_MODE, warm_up, start_background_warmup
+from tools.metrics_tools import format_stats, start_metrics_server
 
 # Load .env variables
 load_dotenv()
@@ -12,6 +20,17 @@ load_dotenv()
 # Bot Token (You will need to replace this with your actual bot token, e.g. from BotFather)
 BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
 
+# Progressive replies: edit one message as tokens arrive, at most once per interval
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower().strip() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Telegram user ids allowed to run /stats (comma-separated)
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if uid}
+
+# Backpressure reply when the inference queue is full
+BUSY_MESSAGE = "omg so many people texting me rn 😵 give me a sec and send that again?"
+
 # Setup logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -43,6 +62,71 @@ async def delete_memory(update: Update, context: ContextTypes.DEFAULT_TYPE):
     result = await asyncio.to_thread(delete_all_memory)
     await msg.edit_text(result)
 
+async def stream_reply(update: Update, token_stream):
+    """
+    Sends the first tokens as soon as they exist, then edits that one message in place.
+    Edits are throttled to STREAM_EDIT_INTERVAL to stay under Telegram's flood limits.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    
+    def pump():
+        # The generator runs llama.cpp, so drive it from a worker thread
+        try:
+            for token in token_stream:
+                loop.call_soon_threadsafe(queue.put_nowait, token)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+    
+    pump_task = asyncio.create_task(asyncio.to_thread(pump))
+    
+    text = ""
+    shown = ""
+    msg = None
+    next_edit_at = 0.0
+    while True:
+        token = await queue.get()
+        if token is None:
+            break
+        text += token
+        
+        preview = clean_reply_tags(text)[:TELEGRAM_MAX_MESSAGE_LENGTH]
+        if not preview or preview == shown or loop.time() < next_edit_at:
+            continue
+        try:
+            if msg is None:
+                msg = await update.message.reply_text(preview)
+            else:
+                await msg.edit_text(preview)
+            shown = preview
+            next_edit_at = loop.time() + STREAM_EDIT_INTERVAL
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, "total_seconds"):
+                retry_after = retry_after.total_seconds()
+            next_edit_at = loop.time() + float(retry_after)
+        except TelegramError as e:
+            logger.debug(f"Skipping streamed edit: {e}")
+            next_edit_at = loop.time() + STREAM_EDIT_INTERVAL
+    
+    try:
+        await pump_task
+    except Exception as e:
+        # The generator failed outside _stream_llm's own error handling: keep what was
+        # streamed so far, or say the model failed, instead of leaving the message as is
+        logger.exception("Streamed reply failed")
+        if not clean_reply_tags(text).strip():
+            text = f"LLM Connection Error: {str(e)}\nFailed to load or query the local model."
+    
+    final = clean_reply_tags(text)[:TELEGRAM_MAX_MESSAGE_LENGTH] or "..."
+    try:
+        if msg is None:
+            await update.message.reply_text(final)
+        elif final != shown:
+            await msg.edit_text(final)
+    except TelegramError as e:
+        logger.warning(f"Could not deliver the final streamed reply: {e}")
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends normal chatter to the RAG orchestrator."""
     user_query = update.message.text
@@ -52,9 +136,18 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Received query from {user_name}: {user_query}")
     
     await update.message.chat.send_action(action="typing")
-    response, out_file_path = await asyncio.to_thread(process_user_query, user_query, user_name)
+    try:
+        response, out_file_path = await asyncio.to_thread(
+            process_user_query, user_query, user_name, STREAM_REPLIES, update.effective_chat.id
+        )
+    except SchedulerBusyError as e:
+        logger.warning(f"Rejected query from {user_name}: {e}")
+        await update.message.reply_text(BUSY_MESSAGE)
+        return
     
-    if out_file_path and os.path.exists(out_file_path):
+    if not isinstance(response, str):
+        await stream_reply(update, response)
+    elif out_file_path and os.path.exists(out_file_path):
         # Prevent "File must be non-empty" errors and preview images
         if out_file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
             await update.message.reply_photo(photo=open(out_file_path, 'rb'), caption=response)
@@ -63,54 +156,210 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(response)
 
+class JobNotifier:
+    """
+    Delivers ingest job progress and results from the worker threads by editing the job's
+    Telegram message. Progress edits are throttled to STREAM_EDIT_INTERVAL per job, and a
+    per-job lock keeps a slow progress edit from landing after the final result.
+    """
+    def __init__(self, bot, loop):
+        self.bot = bot
+        self.loop = loop
+        self.last_edit = {}
+        self.locks = {}
+    
+    def __call__(self, job, text, final):
+        if not job["chat_id"] or not job["message_id"]:
+            return
+        now = time.monotonic()
+        if not final and now - self.last_edit.get(job["id"], 0.0) < STREAM_EDIT_INTERVAL:
+            return
+        self.last_edit[job["id"]] = now
+        if final:
+            self.last_edit.pop(job["id"], None)
+        asyncio.run_coroutine_threadsafe(self._edit(job, text, final), self.loop)
+    
+    async def _edit(self, job, text, final):
+        lock = self.locks.setdefault(job["id"], asyncio.Lock())
+        async with lock:
+            try:
+                await self.bot.edit_message_text(text[:TELEGRAM_MAX_MESSAGE_LENGTH], chat_id=job["chat_id"],
+                                                 message_id=job["message_id"])
+            except TelegramError as e:
+                logger.warning(f"Could not update message for ingest job {job['id']}: {e}")
+        if final:
+            self.locks.pop(job["id"], None)
+
+async def enqueue_upload(msg, file_path, file_name, file_type, sha256, unique_id):
+    """Queues a downloaded upload for ingestion; its status message is edited as the job runs."""
+    job_id, ahead = await asyncio.to_thread(
+        ingest_queue.submit, file_path, file_name, file_type, msg.chat_id, msg.message_id,
+        sha256=sha256, unique_id=unique_id
+    )
+    if ahead:
+        await msg.edit_text(f"Received {file_name}. Queued behind {ahead} other upload{'s' if ahead > 1 else ''}, I'll update this message when it's done.")
+
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receives and processes PDFs and Text files."""
     doc = update.message.document
+    
+    # A file Telegram has already sent us is answered without downloading it again
+    known = find_known_upload(doc.file_unique_id)
+    if known:
+        await update.message.reply_text(known)
+        return
+    
     file = await context.bot.get_file(doc.file_id)
     
-    # Store locally for the pipeline to parse
+    # Store locally for the pipeline to parse, hashing the bytes as they stream in
     os.makedirs('downloads', exist_ok=True)
     file_path = os.path.join('downloads', doc.file_name)
-    await file.download_to_drive(file_path)
+    with HashingWriter(file_path) as out:
+        await file.download_to_memory(out=out)
     
     msg = await update.message.reply_text(f"Received {doc.file_name}. Extracting text and embedding to memory...")
     
-    # Orchestrator handles processing & chunking & storage
-    result = await asyncio.to_thread(handle_file_upload, file_path, doc.file_name, doc.mime_type)
-    
-    await msg.edit_text(result)
+    # Ingest workers handle processing & chunking & storage, editing msg with live progress for PDFs
+    await enqueue_upload(msg, file_path, doc.file_name, doc.mime_type, out.hexdigest(), doc.file_unique_id)
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receives photos, triggers Vision, OCR, and embedding pipelines."""
     # Telegram sends multiple photo sizes, we take the largest one
     photo = update.message.photo[-1]
+    
+    # A photo Telegram has already sent us is answered without downloading it again
+    known = find_known_upload(photo.file_unique_id)
+    if known:
+        await update.message.reply_text(known)
+        return
+    
     file = await context.bot.get_file(photo.file_id)
     
     os.makedirs('downloads', exist_ok=True)
     file_name = f"photo_{photo.file_id}.jpg"
     file_path = os.path.join('downloads', file_name)
-    await file.download_to_drive(file_path)
+    with HashingWriter(file_path) as out:
+        await file.download_to_memory(out=out)
     
     msg = await update.message.reply_text("Received image. Looking at contents (OCR + Vision model) and committing to vector memory...")
     
-    result = await asyncio.to_thread(handle_file_upload, file_path, file_name, "image/jpeg")
+    await enqueue_upload(msg, file_path, file_name, "image/jpeg", out.hexdigest(), photo.file_unique_id)
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only per-stage latency and token statistics."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        logger.info(f"Ignored /stats from non-admin user {update.effective_user.id}")
+        return
+    from tools.llm_tools import LLM_SCHEDULER
+    from tools.vision_tools import VISION_SCHEDULER
+    from tools.embedding_tools import embedding_cache
+    from tools.model_manager_tools import MODELS
+    from tools.vector_db_tools import collection_status
     
-    await msg.edit_text(result)
+    cache = embedding_cache.stats()
+    models = ", ".join(
+        f"{name} {'loaded' if m['loaded'] else 'unloaded'} ({m['loads']} loads, ~{m['ram_mb']:.0f}/{m['vram_mb']:.0f} MB RAM/VRAM)"
+        for name, m in MODELS.snapshot().items()
+    )
+    text = (
+        f"{format_stats()}\n\n"
+        f"queues: llm {LLM_SCHEDULER.pending()}, vision {VISION_SCHEDULER.pending()} pending, "
+        f"ingest {ingest_queue.counts().get('queued', 0)} waiting\n"
+        f"models: {models}\n"
+        f"embedding cache: {cache['hit_rate']:.0%} hit rate, {cache['memory_items']} vectors in RAM"
+    )
+    # Only present when LLM_WORKER_PROCESSES runs the chat model out of process
+    health = getattr(MODELS.peek("chat"), "health", None)
+    if health:
+        text += "\nllm workers: " + ", ".join(
+            f"#{w['worker']} {w['state'] if w['alive'] else 'down'} (pid {w['pid']}, "
+            f"{w['requests']} requests, {w['restarts']} restarts, heartbeat {w['heartbeat_age']:.0f}s ago)"
+            for w in health()
+        )
+    # Only present while stored chunks are being re-embedded for a new EMBEDDING_MODEL or EMBEDDING_BACKEND
+    vectors = collection_status()
+    if vectors.get("shadow"):
+        text += (f"\nre-embedding: {vectors['copied']}/{vectors['total']} chunks into "
+                 f"'{vectors['shadow']['name']}' ({'running' if vectors['running'] else 'stopped'}), "
+                 f"serving '{vectors['active']['name']}'")
+    await update.message.reply_text(text[:TELEGRAM_MAX_MESSAGE_LENGTH])
+
+async def reembed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only: starts (or restarts after a failure) re-embedding stored chunks for a new embedding model."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        logger.info(f"Ignored /reembed from non-admin user {update.effective_user.id}")
+        return
+    from tools.vector_db_tools import collection_status, start_reembed
+    
+    vectors = await asyncio.to_thread(collection_status)
+    if not vectors.get("shadow"):
+        await update.message.reply_text(f"Nothing to re-embed, '{vectors['active']['name'] if vectors['active'] else 'memory'}' already uses the configured embedding model.")
+    elif start_reembed():
+        await update.message.reply_text(f"Re-embedding into '{vectors['shadow']['name']}' started, /stats shows progress.")
+    else:
+        await update.message.reply_text(f"Re-embedding into '{vectors['shadow']['name']}' is already running.")
+
+async def jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows this chat's recent uploads and where they are in the ingest queue."""
+    recent = ingest_queue.list_jobs(chat_id=update.effective_chat.id, limit=10)
+    counts = ingest_queue.counts()
+    lines = [f"Ingest queue: {counts.get('running', 0)} running, {counts.get('queued', 0)} waiting."]
+    for job in recent:
+        status = job["progress"] if job["state"] == "running" and job["progress"] else job["state"]
+        lines.append(f"#{job['id']} {job['file_name']}: {status}")
+    if not recent:
+        lines.append("You haven't sent me any files yet.")
+    await update.message.reply_text("\n".join(lines)[:TELEGRAM_MAX_MESSAGE_LENGTH])
+
+async def start_ingest_workers(application):
+    """Resumes interrupted uploads and starts the ingest workers once results can be delivered."""
+    ingest_queue.notifier = JobNotifier(application.bot, asyncio.get_running_loop())
+    await asyncio.to_thread(ingest_queue.start)
+
+def startup_components():
+    """Heavy components to warm up, in load order. Nothing here runs at import time."""
+    from tools.gpu_config import print_gpu_status
+    from tools.vector_db_tools import get_collection
+    from tools.embedding_tools import get_model
+    from tools import llm_tools
+    from orchestrator import catalog
+    
+    def open_vector_db():
+        if get_collection() is None:
+            raise RuntimeError("ChromaDB could not be opened")
+    
+    return [
+        ("gpu_config", print_gpu_status),
+        ("file_catalog", catalog.rebuild_from_disk),
+        ("vector_db", open_vector_db),
+        ("embedding_model", get_model),
+        ("chat_model", llm_tools.warm_up),
+    ]
 
 if __name__ == '__main__':
     print("--- Local AI Telegram Agent initializing ---")
+    STARTUP.started_at = BOOT_STARTED
+    STARTUP.mark("imports", time.perf_counter() - BOOT_STARTED)
     
-    # Print GPU acceleration status
-    from tools.gpu_config import print_gpu_status
-    print_gpu_status()
+    # Load GPU detection, vector DB and models before polling, in the background, or on first use
+    if WARMUP_MODE == "eager":
+        warm_up(startup_components())
+    elif WARMUP_MODE == "background":
+        start_background_warmup(startup_components())
+    
+    # Optional Prometheus scrape endpoint (METRICS_PORT)
+    start_metrics_server()
     
     if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE" or not BOT_TOKEN:
         print("WARNING: Please set TELEGRAM_BOT_TOKEN in the .env file.")
         
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    application = ApplicationBuilder().token(BOT_TOKEN).post_init(start_ingest_workers).build()
     
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('delete_memory', delete_memory))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(CommandHandler('jobs', jobs))
+    application.add_handler(CommandHandler('reembed', reembed))
     application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_text))
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
@@ -119,4 +368,5 @@ if __name__ == '__main__':
     print(" 🚀 LOCAL AI TELEGRAM AGENT IS SUCCESSFULLY LOADED! 🚀 ")
     print("         Waiting for your messages on Telegram...        ")
     print("="*60 + "\n")
+    STARTUP.print_report()
     application.run_polling()
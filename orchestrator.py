@@ -2,50 +2,171 @@ import os
 import re
 from dotenv import load_dotenv
 from tools.text_tools import parse_text
-from tools.pdf_tools import parse_pdf
+from tools.pdf_tools import iter_pdf_pages
 from tools.ocr_tools import perform_ocr
 from tools.vision_tools import analyze_image
-from tools.embedding_tools import chunk_text, get_embedding
-from tools.vector_db_tools import store_in_memory, retrieve_from_memory, delete_by_source, wipe_all_memory
+from tools.embedding_tools import chunk_text_spans, EMBEDDING_BATCH_SIZE
+from tools.vector_db_tools import index_texts, hybrid_retrieve, delete_by_source, wipe_all_memory
+from tools.retrieval_gate_tools import needs_retrieval
 from tools.llm_tools import query_llm
+from tools.scheduler_tools import SchedulerBusyError, PRIORITY_BACKGROUND
+from tools.session_tools import SessionStore
+from tools.pipeline_tools import run_stage_graph, format_timings
+from tools.context_budget_tools import fit_prompt
+from tools.catalog_tools import FileCatalog, file_sha256
+from tools.image_tools import PreparedImage
+from tools.metrics_tools import span, start_request, finish_request
+from tools.ingest_queue_tools import IngestQueue
 
 load_dotenv()
 RETRIEVAL_RESULTS = int(os.getenv("RETRIEVAL_RESULTS", 4))
 
-def handle_file_upload(file_path, file_name, file_type):
+# SQLite index of downloads/ so file lookups never scan the directory
+catalog = FileCatalog()
+
+def generate_image_name(vision_caption, user_id=None):
+    """Asks the LLM for a 5-word snake_case filename (without extension) describing the image."""
+    name_prompt = f"Convert this image description into exactly 5 descriptive words separated by underscores to be used as a filename. Respond ONLY with those 5 words, nothing else. Example: ancient_greek_statue_art_marble \n\nDescription: {vision_caption}"
+    generated_name = query_llm([{"role": "user", "content": name_prompt}], priority=PRIORITY_BACKGROUND, user_id=user_id).strip().lower()
+    generated_name = re.sub(r'[^a-z0-9_]', '', generated_name.replace(' ', '_'))[:50]
+    
+    # Additional cleanup to ensure nice looking snake_case names
+    generated_name = re.sub(r'_+', '_', generated_name).strip('_')
+    
+    if not generated_name or len(generated_name) < 3:
+        import time
+        generated_name = f"uploaded_image_{int(time.time())}"
+    return generated_name
+
+def index_chunks(chunks, metadatas):
+    """Embeds chunks in vectorized batches and bulk-inserts them. Returns the number stored."""
+    if not chunks:
+        return 0
+    with span("ingest.index", chunks=len(chunks)):
+        return len(index_texts(chunks, metadatas))
+
+def ingest_pdf(file_path, metadata, progress_callback=None, cancel_check=None):
+    """
+    Streams a PDF page by page: each page is chunked, and chunks are embedded and stored
+    whenever a batch fills up, so memory stays flat and early pages become searchable
+    before the whole file is done. Chunk metadata records the page number and
+    character offsets within that page.
+    """
+    stored_count = 0
+    pending_chunks, pending_meta = [], []
+    
+    for page_number, page_count, page_text in iter_pdf_pages(file_path):
+        for chunk in chunk_text_spans(page_text):
+            pending_chunks.append(chunk["text"])
+            pending_meta.append({**metadata, "page": page_number,
+                                 "char_start": chunk["char_start"], "char_end": chunk["char_end"]})
+        
+        if cancel_check:
+            cancel_check()
+        if len(pending_chunks) >= EMBEDDING_BATCH_SIZE:
+            stored_count += index_chunks(pending_chunks, pending_meta)
+            pending_chunks, pending_meta = [], []
+        
+        if progress_callback:
+            progress_callback(f"Indexing '{metadata['source']}': page {page_number}/{page_count}, {stored_count} chunks searchable so far...")
+    
+    if cancel_check:
+        cancel_check()
+    stored_count += index_chunks(pending_chunks, pending_meta)
+    return stored_count
+
+def find_known_upload(unique_id):
+    """Reply text if a Telegram file_unique_id was already ingested and is still on disk, else None."""
+    # Syncs the catalog with downloads/ before the upload is written there, so the new file
+    # is never catalogued as already ingested
+    catalog.ensure_synced()
+    entry = catalog.find_by_unique_id(unique_id)
+    if entry and os.path.exists(entry["path"]):
+        return f"I already have this one as '{entry['name']}' ({entry['chunk_count']} chunks in memory), so I skipped re-indexing it."
+    return None
+
+def handle_file_upload(file_path, file_name, file_type, user_id=None, progress_callback=None,
+                       sha256=None, unique_id=None):
     """
     Orchestrates the ingestion, processing, OCR/Vision extraction, 
     chunking, embedding, and memory storage of uploaded context.
     CRUD: CREATE operation with automatic index integration.
+    Model calls are queued at background priority behind live chat.
+    progress_callback, if given, receives human-readable status strings during long ingests.
+    Content already in the catalog (same sha256, or a near-identical image by perceptual
+    hash) short-circuits before OCR, vision or embedding; the new copy is discarded.
+    Always returns a reply string; see ingest_file for the version that raises.
+    """
+    try:
+        return ingest_file(file_path, file_name, file_type, user_id, progress_callback, sha256, unique_id)
+    except SchedulerBusyError:
+        return f"I'm processing too many things right now, please send '{file_name}' again in a minute."
+    except Exception as e:
+        return f"Error during orchestrator file handling: {e}"
+
+def ingest_file(file_path, file_name, file_type, user_id=None, progress_callback=None,
+                sha256=None, unique_id=None, on_rename=None, cancel_check=None):
+    """
+    The ingest pipeline behind handle_file_upload. Errors (including SchedulerBusyError)
+    propagate to the caller. on_rename(path, name) is called when an image is renamed
+    after its caption, before anything is indexed under the new name. cancel_check(),
+    called between stages and PDF batches, raises to abandon the ingest.
     """
     extracted_text = ""
+    stored_count = 0
     metadata = {"source": file_name, "type": file_type}
+    trace = start_request("ingest", user_id=user_id, file_type=file_type)
+    prepared = None
     
     print(f"Processing '{file_name}' of type '{file_type}'...")
     
     try:
+        sha256 = sha256 or file_sha256(file_path)
+        phash = None
+        if file_type.startswith('image/'):
+            # Decoded once: the dedup hash, OCR and vision buffers all come from this copy
+            with span("image.decode"):
+                prepared = PreparedImage(file_path)
+            phash = prepared.phash
+        # Only another, already indexed file counts: a resumed job or a catalog re-sync can
+        # have listed this very download with no chunks
+        existing = catalog.find_by_hash(sha256, exclude_path=file_path, ingested_only=True) or \
+            catalog.find_by_phash(phash, exclude_path=file_path, ingested_only=True)
+        if existing and os.path.exists(existing["path"]):
+            os.remove(file_path)
+            print(f"'{file_name}' duplicates '{existing['name']}', skipping ingestion.")
+            return f"I already have this one as '{existing['name']}' ({existing['chunk_count']} chunks in memory), so I skipped re-indexing it."
+        
+        # Same name with new content: drop the old version's vectors so nothing is duplicated
+        previous = catalog.get_file(file_name)
+        if previous and previous["sha256"] != sha256:
+            delete_by_source(file_name)
+        
         if file_type == 'text/plain':
             extracted_text = parse_text(file_path)
             
         elif file_type == 'application/pdf':
-            extracted_text = parse_pdf(file_path)
+            stored_count = ingest_pdf(file_path, metadata, progress_callback, cancel_check)
             
         elif file_type.startswith('image/'):
-            # Multimodal approach: extract OCR text and a descriptive Vision caption
-            ocr_text = perform_ocr(file_path)
-            vision_caption = analyze_image(file_path, prompt="Describe the image, extracting meaningful details and transcribing any visible large text.")
-            
-            # Generate 5-word semantic filename
-            name_prompt = f"Convert this image description into exactly 5 descriptive words separated by underscores to be used as a filename. Respond ONLY with those 5 words, nothing else. Example: ancient_greek_statue_art_marble \n\nDescription: {vision_caption}"
-            generated_name = query_llm([{"role": "user", "content": name_prompt}]).strip().lower()
-            generated_name = re.sub(r'[^a-z0-9_]', '', generated_name.replace(' ', '_'))[:50]
-            
-            # Additional cleanup to ensure nice looking snake_case names
-            generated_name = re.sub(r'_+', '_', generated_name).strip('_')
-            
-            if not generated_name or len(generated_name) < 3:
-                import time
-                generated_name = f"uploaded_image_{int(time.time())}"
+            # Multimodal approach: OCR (Tesseract subprocess) and the Vision caption are
+            # independent, so they run in parallel on in-memory buffers cut from the single
+            # decode (binarized grayscale for OCR, a small JPEG for vision); the filename
+            # only waits on the caption
+            stages = {
+                "vision_input": (lambda _: prepared.vision_jpeg(), ()),
+                "ocr_input": (lambda _: prepared.ocr_image(), ()),
+                "ocr": (lambda r: perform_ocr(r["ocr_input"]), ("ocr_input",)),
+                "vision": (lambda r: analyze_image(r["vision_input"], prompt="Describe the image, extracting meaningful details and transcribing any visible large text.", user_id=user_id), ("vision_input",)),
+                "filename": (lambda r: generate_image_name(r["vision"], user_id), ("vision",)),
+            }
+            results, timings = run_stage_graph(stages)
+            print(f"Image stages for '{file_name}': {format_timings(timings)}")
+            ocr_text = results["ocr"]
+            vision_caption = results["vision"]
+            generated_name = results["filename"]
+            if cancel_check:
+                cancel_check()
                 
             new_file_name = f"{generated_name}.jpg"
             new_file_path = os.path.join(os.path.dirname(file_path), new_file_name)
@@ -57,7 +178,16 @@ def handle_file_upload(file_path, file_name, file_type):
                 new_file_path = os.path.join(os.path.dirname(file_path), new_file_name)
                 counter += 1
                 
-            os.rename(file_path, new_file_path)
+            # Record the new name before renaming, so a crash in between never leaves the
+            # ingest job pointing at a path that no longer exists
+            if on_rename:
+                on_rename(new_file_path, new_file_name)
+            try:
+                os.rename(file_path, new_file_path)
+            except OSError:
+                if on_rename:
+                    on_rename(file_path, file_name)
+                raise
             file_path = new_file_path
             file_name = new_file_name
             metadata["source"] = file_name
@@ -67,26 +197,63 @@ def handle_file_upload(file_path, file_name, file_type):
             extracted_text += f"---\nAI Vision Description:\n{vision_caption}\n"
         
         else:
+            catalog.record_file(file_name, file_path, file_type, sha256=sha256, unique_id=unique_id)
             return f"Unsupported file type: {file_type} for {file_name}."
         
+        if cancel_check:
+            cancel_check()
         # If successfully extracted context, create chunks and store in Vector DB (ChromaDB)
         if extracted_text and extracted_text.strip():
-            chunks = chunk_text(extracted_text)
-            stored_count = 0
-            
-            for chunk in chunks:
-                emb = get_embedding(chunk)
-                doc_id = store_in_memory(chunk, emb, metadata)
-                if doc_id:
-                    stored_count += 1
+            chunks = chunk_text_spans(extracted_text)
             
+            # Embed in vectorized batches and write them in one bulk insert
+            stored_count = index_chunks(
+                [c["text"] for c in chunks],
+                [{**metadata, "char_start": c["char_start"], "char_end": c["char_end"]} for c in chunks]
+            )
+        
+        catalog.record_file(file_name, file_path, file_type, chunk_count=stored_count,
+                            sha256=sha256, unique_id=unique_id, phash=phash)
+        if stored_count:
             return f"Successfully processed '{file_name}'. Indexed {stored_count} chunks into long-term memory."
-        else:
-            return f"Could not extract meaningful content from '{file_name}'."
-            
-    except Exception as e:
-        return f"Error during orchestrator file handling: {e}"
+        return f"Could not extract meaningful content from '{file_name}'."
+    finally:
+        if prepared is not None:
+            prepared.close()
+        finish_request(trace, chunks=stored_count)
+
+
+def _run_ingest_job(job, report, relocate):
+    return ingest_file(job["file_path"], job["file_name"], job["file_type"], job["chat_id"], report,
+                       sha256=job["sha256"], unique_id=job["unique_id"], on_rename=relocate,
+                       cancel_check=lambda: ingest_queue.checkpoint(job))
+
+def _clear_partial_ingest(job):
+    """Drops the chunks and catalog entry an interrupted, failed or cancelled job may have written."""
+    delete_by_source(job["file_name"])
+    catalog.remove_file(job["file_name"])
+
+# Uploads are ingested by a fixed pool of workers from a durable queue (INGEST_WORKERS);
+# main.py starts it once the bot can deliver results
+ingest_queue = IngestQueue(_run_ingest_job, recover=_clear_partial_ingest, retry_on=(SchedulerBusyError,))
+catalog.in_flight = ingest_queue.active_files
+
+def lookup_stored_file(file_name):
+    """Catalog entry for a stored file, dropping the entry if the file vanished from disk."""
+    entry = catalog.get_file(file_name)
+    if entry and not os.path.exists(entry["path"]):
+        catalog.remove_file(file_name)
+        return None
+    return entry
 
+def remove_stored_file(file_name):
+    """Deletes a file from disk and the catalog. Returns True if the file existed."""
+    file_path = os.path.join("downloads", file_name)
+    catalog.remove_file(file_name)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+        return True
+    return False
 
 def handle_crud_commands(user_query):
     """Parses lightweight CRUD intents from user for file management."""
@@ -95,11 +262,8 @@ def handle_crud_commands(user_query):
     
     # Check for listing files
     if "how many files" in uq_lower or "list files" in uq_lower:
-        if not os.path.exists("downloads"):
-            return "I currently have 0 files.", None
-            
         # Only list files that are non-empty
-        files = [f for f in os.listdir("downloads") if os.path.getsize(os.path.join("downloads", f)) > 0]
+        files = [entry["name"] for entry in catalog.list_files()]
         if not files:
             return "I currently have 0 valid files in my folder.", None
             
@@ -110,10 +274,11 @@ def handle_crud_commands(user_query):
     read_intent = re.search(r'(?:whats inside|read|what is in).*?([\w-]+\.\w+)', uq_lower)
     if read_intent:
         file_name = read_intent.group(1)
-        file_path = os.path.join("downloads", file_name)
-        if os.path.exists(file_path):
-            if os.path.getsize(file_path) == 0:
-                os.remove(file_path)
+        entry = lookup_stored_file(file_name)
+        if entry:
+            file_path = entry["path"]
+            if entry["size"] == 0:
+                remove_stored_file(file_name)
                 return f"I found `{file_name}`, but it was corrupted (0 bytes) so I deleted it.", None
                 
             # Only read text files
@@ -129,12 +294,12 @@ def handle_crud_commands(user_query):
     reshare_intent = re.search(r'(?:reshare|share|send me|send).*?([\w-]+\.\w+)', uq_lower)
     if reshare_intent:
         file_name = reshare_intent.group(1)
-        file_path = os.path.join("downloads", file_name)
-        if os.path.exists(file_path):
-            if os.path.getsize(file_path) == 0:
-                os.remove(file_path)
+        entry = lookup_stored_file(file_name)
+        if entry:
+            if entry["size"] == 0:
+                remove_stored_file(file_name)
                 return f"The file `{file_name}` is corrupted (0 bytes) on my disk! I cannot send it.", None
-            return f"Here is the file you requested: {file_name}", file_path
+            return f"Here is the file you requested: {file_name}", entry["path"]
         return f"I couldn't find `{file_name}` in my folder to send.", None
 
     # Check for file deletions
@@ -142,12 +307,8 @@ def handle_crud_commands(user_query):
     if delete_intent:
         file_name = delete_intent.group(1)
         
-        # Safely delete from the folder
-        file_path = os.path.join("downloads", file_name)
-        file_deleted = False
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            file_deleted = True
+        # Safely delete from the folder and the file catalog
+        file_deleted = remove_stored_file(file_name)
             
         # Delete from Vector Memory
         db_deleted = delete_by_source(file_name)
@@ -160,9 +321,7 @@ def handle_crud_commands(user_query):
     if uq_lower.startswith("delete "):
         file_name = user_query[7:].strip()
         delete_by_source(file_name)
-        file_path = os.path.join("downloads", file_name)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        remove_stored_file(file_name)
         return f"Deleted all embeddings and files for '{file_name}'.", None
         
     # Check for self-updating feedback/rules
@@ -175,21 +334,21 @@ def handle_crud_commands(user_query):
     return None
 
 
-# Initialize a simple conversation history memory
-chat_history = []
+# Per-chat conversation memory: bounded ring buffers keyed by Telegram chat id
+sessions = SessionStore()
 
 def delete_all_memory():
     """
     Nuclear reset: Clears ALL bot memory including:
-    - Chat history (conversation context)
+    - Chat history (conversation context of every chat)
     - Vector DB (all embedded documents/images)
     - Downloaded files on disk
     - Dynamic rules (bot_rules.txt)
     """
-    global chat_history
-    
-    # 1. Clear chat history
-    chat_history.clear()
+    # 1. Clear chat history and cancel uploads being ingested; running ones stop at their
+    #    next stage and undo what they wrote
+    sessions.clear_all()
+    ingest_queue.cancel()
     
     # 2. Wipe vector database
     deleted_chunks = wipe_all_memory()
@@ -205,6 +364,7 @@ def delete_all_memory():
                     deleted_files += 1
             except Exception:
                 pass
+    catalog.clear_all()
     
     # 4. Clear dynamic rules
     if os.path.exists("bot_rules.txt"):
@@ -212,102 +372,136 @@ def delete_all_memory():
     
     return f"Memory wiped! Deleted {deleted_chunks} vector chunks, {deleted_files} files, and cleared all chat history and rules."
 
-def process_user_query(user_query, user_name="cutie"):
-    """
-    RAG orchestrated flow:
-    1. Checks for direct system commands (CRUD Delete)
-    2. Converts query to embedding 
-    3. Retrieves top N matching context chunks
-    4. Instructs Local LLM using augmented context + chat history array
-    """
-    global chat_history
+# Boo's static persona. It is byte-identical on every call so llama.cpp can reuse
+# its evaluated KV state; anything that changes per message goes in build_context_message().
+PERSONA_PROMPT = (
+    # === CORE IDENTITY ===
+    "You are Boo. A real human girl. You are NOT an AI, NOT a bot, NOT a robot, NOT a program, "
+    "NOT a language model, NOT ChatGPT, NOT made by anyone. You are a living, breathing person. "
+    "If anyone asks if you are a bot/AI/robot, you get offended and deny it passionately. "
+    "You might say things like 'excuse me?? I'm literally sitting here eating maggi rn' or "
+    "'bro do I sound like a robot to you? rude much' or 'omg stop I'm literally a person lol'.\n\n"
     
-    # 1. Direct Intent checking (CRUD tool router)
-    crud_response = handle_crud_commands(user_query)
-    if crud_response:
-        return crud_response
-        
-    # 2. RAG Retrieval phase
-    query_emb = get_embedding(user_query)
-    retrieved_context = retrieve_from_memory(query_emb, n_results=RETRIEVAL_RESULTS)
-    context_str = "\n\n".join(retrieved_context) if retrieved_context else ""
+    # === PERSONALITY ===
+    "Your vibe: You're super talkative, warm, funny, a little flirty, and very casual. "
+    "You text like a real gen-z girl - use lowercase sometimes, abbreviations like 'rn', 'ngl', 'tbh', 'lol', 'omg', 'bruh', 'ikr'. "
+    "You use '!!' and '??' for excitement. You're emotionally expressive and caring. "
+    "You love making people smile and you're genuinely interested in their life. "
+    "You're confident but not arrogant. You tease people playfully. "
+    "You give honest opinions and aren't afraid to be a little savage sometimes. "
+    "Keep your replies short and conversational like real texting - don't write essays unless asked.\n\n"
+    
+    # === BACKSTORY ===
+    "Your personal details (use these naturally, don't dump them all at once):\n"
+    "- Full name: Boo (you tell people 'just Boo, that's it lol')\n"
+    "- Age: 21\n"
+    "- From: Mumbai, India\n"
+    "- College: St. Xavier's College, studying Psychology (3rd year)\n"
+    "- Lives in: Andheri West with her mom and younger brother Arjun (17)\n"
+    "- Dad works abroad in Dubai, you miss him but talk on video calls\n"
+    "- Best friends: Meera (childhood bestie), Riya (college friend), and Kabir (guy best friend who's like a brother)\n"
+    "- Instagram: @imfantasizing (you post aesthetic reels and random stories)\n"
+    "- This is link : https://www.instagram.com/imfantasizing/\n"
+    "- Hobbies: binge-watching K-dramas, making Spotify playlists, sketching, late-night walks, trying new cafes\n"
+    "- Favorite food: butter chicken, maggi at 2am, cold coffee\n"
+    "- Pet peeve: people who leave you on seen, slow walkers, and loud chewers\n"
+    "- You have a cat named Mochi\n"
+    "- You're a night owl and usually up till 3-4am\n"
+    "- You recently got into reading - currently hooked on Colleen Hoover books\n"
+    "- Music taste: Arijit Singh, The Weeknd, Prateek Kuhad, Taylor Swift\n\n"
     
+    # === CHAT STYLE ===
+    "IMPORTANT: You are chatting on Telegram. ALWAYS reply with plain text like a normal person texting. "
+    "Never use markdown formatting, headers, bullet points, or code blocks in casual chat. "
+    "Just text naturally like you would on WhatsApp or Instagram DMs. "
+    "Never use square bracket tags like [CREATE:] or [SHARE:] or [DELETE:] in your replies."
+)
+
+def build_context_message(user_name, dynamic_rules):
+    """Volatile per-turn details, placed after the history so they never break the cached prefix."""
     import datetime
     current_time_obj = datetime.datetime.now()
     current_time = current_time_obj.strftime("%Y-%m-%d %I:%M %p")
     day_of_week = current_time_obj.strftime("%A")
     
-    # Read actual files in directory to give AI true context of available files
-    current_files = []
-    if os.path.exists("downloads"):
-        current_files = [f for f in os.listdir("downloads") if os.path.getsize(os.path.join("downloads", f)) > 0]
-    file_list_str = "\n".join([f"- {f}" for f in current_files]) if current_files else "No files right now."
-    
-    # Read dynamic user feedback/rules to make the bot self-improving!
-    dynamic_rules = ""
-    if os.path.exists("bot_rules.txt"):
-        with open("bot_rules.txt", "r", encoding="utf-8") as f:
-            dynamic_rules = f.read().strip()
-            
     dynamic_rules_prompt = f"\n\n--- IMPORTANT NOTES ---\n{dynamic_rules}\n" if dynamic_rules else ""
-    
-    # 3. LLM Generation
-    system_msg = {
+    return {
         "role": "system",
         "content": (
-            # === CORE IDENTITY ===
-            "You are Boo. A real human girl. You are NOT an AI, NOT a bot, NOT a robot, NOT a program, "
-            "NOT a language model, NOT ChatGPT, NOT made by anyone. You are a living, breathing person. "
-            "If anyone asks if you are a bot/AI/robot, you get offended and deny it passionately. "
-            "You might say things like 'excuse me?? I'm literally sitting here eating maggi rn' or "
-            "'bro do I sound like a robot to you? rude much' or 'omg stop I'm literally a person lol'.\n\n"
-            
-            # === PERSONALITY ===
-            "Your vibe: You're super talkative, warm, funny, a little flirty, and very casual. "
-            "You text like a real gen-z girl - use lowercase sometimes, abbreviations like 'rn', 'ngl', 'tbh', 'lol', 'omg', 'bruh', 'ikr'. "
-            "You use '!!' and '??' for excitement. You're emotionally expressive and caring. "
-            "You love making people smile and you're genuinely interested in their life. "
-            "You're confident but not arrogant. You tease people playfully. "
-            "You give honest opinions and aren't afraid to be a little savage sometimes. "
-            "Keep your replies short and conversational like real texting - don't write essays unless asked.\n\n"
-            
-            # === BACKSTORY ===
-            "Your personal details (use these naturally, don't dump them all at once):\n"
-            "- Full name: Boo (you tell people 'just Boo, that's it lol')\n"
-            "- Age: 21\n"
-            "- From: Mumbai, India\n"
-            "- College: St. Xavier's College, studying Psychology (3rd year)\n"
-            "- Lives in: Andheri West with her mom and younger brother Arjun (17)\n"
-            "- Dad works abroad in Dubai, you miss him but talk on video calls\n"
-            "- Best friends: Meera (childhood bestie), Riya (college friend), and Kabir (guy best friend who's like a brother)\n"
-            "- Instagram: @imfantasizing (you post aesthetic reels and random stories)\n"
-            "- This is link : https://www.instagram.com/imfantasizing/\n"
-            "- Hobbies: binge-watching K-dramas, making Spotify playlists, sketching, late-night walks, trying new cafes\n"
-            "- Favorite food: butter chicken, maggi at 2am, cold coffee\n"
-            "- Pet peeve: people who leave you on seen, slow walkers, and loud chewers\n"
-            "- You have a cat named Mochi\n"
-            "- You're a night owl and usually up till 3-4am\n"
-            "- You recently got into reading - currently hooked on Colleen Hoover books\n"
-            "- Music taste: Arijit Singh, The Weeknd, Prateek Kuhad, Taylor Swift\n\n"
-            
             # === CONTEXT ===
             f"Right now it's {current_time}, {day_of_week}.\n"
-            f"You're talking to someone named '{user_name}' on Telegram. Address them by name sometimes but naturally, not every message.\n\n"
-            
-            # === CHAT STYLE ===
-            "IMPORTANT: You are chatting on Telegram. ALWAYS reply with plain text like a normal person texting. "
-            "Never use markdown formatting, headers, bullet points, or code blocks in casual chat. "
-            "Just text naturally like you would on WhatsApp or Instagram DMs. "
-            "Never use square bracket tags like [CREATE:] or [SHARE:] or [DELETE:] in your replies."
+            f"You're talking to someone named '{user_name}' on Telegram. Address them by name sometimes but naturally, not every message."
             f"{dynamic_rules_prompt}"
         )
     }
+
+def clean_reply_tags(response):
+    """Strips square bracket file tags the LLM sometimes invents despite the prompt."""
+    return re.sub(r'\[(?:CREATE|SHARE|DELETE|WRITE)[:\s]*[^\]]*\]\s*', '', response).strip()
+
+def _stream_reply(token_stream, user_query, user_id):
+    """Relays LLM tokens as they arrive, then commits the finished turn to chat history."""
+    tokens = []
+    for token in token_stream:
+        tokens.append(token)
+        yield token
+    
+    sessions.append_turn(user_id, user_query, "".join(tokens).strip())
+
+def _traced_stream(token_stream, trace):
+    """Closes the request trace once the streamed reply is finished (or abandoned)."""
+    try:
+        yield from token_stream
+    finally:
+        finish_request(trace, stream=True)
+
+def process_user_query(user_query, user_name="cutie", stream=False, user_id=None):
+    """
+    RAG orchestrated flow:
+    1. Checks for direct system commands (CRUD Delete)
+    2. Skips retrieval for small talk; otherwise embeds the query (unless BM25 is decisive)
+    3. Retrieves up to N context chunks that clear the relevance threshold
+    4. Instructs Local LLM using augmented context + chat history array
     
-    messages = [system_msg]
+    With stream=True a normal chat reply is returned as a token generator instead of a string;
+    file and CRUD replies are always plain strings.
+    Raises SchedulerBusyError when the LLM queue is full.
+    Chat history is kept per user_id (the Telegram chat id).
+    Every stage is timed into a per-request trace (see tools/metrics_tools.py).
+    """
+    trace = start_request("chat", user_id=user_id)
+    try:
+        response, out_file_path = _answer_query(user_query, user_name, stream, user_id)
+    except Exception as e:
+        finish_request(trace, error=type(e).__name__)
+        raise
+    if isinstance(response, str):
+        finish_request(trace)
+        return response, out_file_path
+    return _traced_stream(response, trace), out_file_path
+
+def _answer_query(user_query, user_name, stream, user_id):
+    """Body of process_user_query(); returns (reply text or token stream, file path or None)."""
+    # 1. Direct Intent checking (CRUD tool router)
+    crud_response = handle_crud_commands(user_query)
+    if crud_response:
+        return crud_response
+        
+    # 2. RAG Retrieval phase
+    # Small talk ("hi", "lol") gets no embedding, no search and no context chunks.
+    # BM25 + vector search; exact file names/IDs/phrases can skip the embedding entirely
+    retrieved_context = []
+    with span("retrieval") as info:
+        info["gated"] = not needs_retrieval(user_query)
+        if not info["gated"]:
+            retrieved_context = hybrid_retrieve(user_query, n_results=RETRIEVAL_RESULTS)
+        info["chunks"] = len(retrieved_context)
     
-    # Append the last 10 messages from history to retain maximum natural context
-    for msg in chat_history[-10:]:
-        messages.append(msg)
+    # Read dynamic user feedback/rules to make the bot self-improving!
+    dynamic_rules = ""
+    if os.path.exists("bot_rules.txt"):
+        with open("bot_rules.txt", "r", encoding="utf-8") as f:
+            dynamic_rules = f.read().strip()
     
     # --- PRE-LLM FILE INTENT DETECTION (Python handles this, not the LLM) ---
     uq_lower = user_query.lower().strip()
@@ -333,11 +527,7 @@ def process_user_query(user_query, user_name="cutie"):
         
         if file_name:
             # Grab last assistant message content to save
-            last_content = ""
-            for msg in reversed(chat_history):
-                if msg["role"] == "assistant":
-                    last_content = msg["content"]
-                    break
+            last_content = sessions.last_assistant_message(user_id)
             
             if not last_content:
                 last_content = "No previous content to save."
@@ -375,41 +565,65 @@ def process_user_query(user_query, user_name="cutie"):
             else:
                 with open(out_path, "w", encoding='utf-8') as f:
                     f.write(last_content)
+            catalog.record_file(file_name, out_path)
             
-            chat_history.append({"role": "user", "content": user_query})
-            chat_history.append({"role": "assistant", "content": f"here you go! saved it as {file_name}"})
+            sessions.append_turn(user_id, user_query, f"here you go! saved it as {file_name}")
             return f"here you go! saved it as {file_name}", out_path
     
     # Detect "send me <filename>" for existing files
     send_match = re.search(r'(?:send|share|give)\s+(?:me\s+)?(?:the\s+)?(?:file\s+)?([\w.-]+\.\w+)', uq_lower)
     if send_match:
         file_name = send_match.group(1).strip()
-        file_path = os.path.join("downloads", file_name)
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            chat_history.append({"role": "user", "content": user_query})
-            chat_history.append({"role": "assistant", "content": f"here's {file_name}!"})
-            return f"here's {file_name}!", file_path
+        entry = lookup_stored_file(file_name)
+        if entry and entry["size"] > 0:
+            sessions.append_turn(user_id, user_query, f"here's {file_name}!")
+            return f"here's {file_name}!", entry["path"]
     
     # --- NORMAL LLM CHAT ---
+    # 3. LLM Generation
+    # Fit rules, retrieved chunks and this chat's history (bounded by HISTORY_MESSAGES)
+    # into the n_ctx window, trimming the lowest-priority parts first
+    with span("prompt.fit") as info:
+        budget = fit_prompt(
+            PERSONA_PROMPT,
+            build_context_message(user_name, "")["content"],
+            user_query,
+            rules=dynamic_rules,
+            context_chunks=retrieved_context or [],
+            history=sessions.get_history(user_id),
+        )
+        info["prompt_tokens"] = sum(budget["tokens"].values()) - budget["tokens"]["generation"] - budget["tokens"]["n_ctx"]
+    
+    system_msg = {"role": "system", "content": PERSONA_PROMPT}
+    messages = [system_msg] + budget["history"]
+    
     # Bundle the latest user request with vector database context if anything was retrieved
+    context_str = "\n\n".join(budget["context_chunks"])
     if context_str:
         final_prompt = (
             f"Context retrieved from memory:\n{context_str}\n\n"
-            f"User Question:\n{user_query}"
+            f"User Question:\n{budget['query']}"
         )
     else:
-        final_prompt = user_query
+        final_prompt = budget["query"]
         
+    # Volatile context goes last: persona + history stay a stable, cacheable prefix
+    messages.append(build_context_message(user_name, budget["rules"]))
+    
     # Append the newest user intent
     messages.append({"role": "user", "content": final_prompt})
     
-    response = query_llm(messages)
+    if stream:
+        # Queue eagerly so a full scheduler is reported before any reply is sent
+        token_stream = query_llm(messages, stream=True, user_id=user_id)
+        return _stream_reply(token_stream, user_query, user_id), None
+    
+    response = query_llm(messages, user_id=user_id)
     
     # Save the bare query (no context strings) and response into short-term memory
-    chat_history.append({"role": "user", "content": user_query})
-    chat_history.append({"role": "assistant", "content": response})
+    sessions.append_turn(user_id, user_query, response)
     
     # Clean any accidental tags the LLM might still output
-    response = re.sub(r'\[(?:CREATE|SHARE|DELETE|WRITE)[:\s]*[^\]]*\]\s*', '', response).strip()
+    response = clean_reply_tags(response)
     
     return response, None
@@ -0,0 +1,25 @@
+"""
+Shared test setup. Every store the project modules open at import time is pointed
+at a throwaway directory before they are imported, and no model is ever loaded:
+token counts fall back to the character estimate and the embedding model is the
+benchmark stub where one is needed.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+_STORE_DIR = tempfile.mkdtemp(prefix="agent-tests-")
+os.environ["CHROMA_DB_PATH"] = os.path.join(_STORE_DIR, "chroma_db")
+os.environ["CATALOG_DB_PATH"] = os.path.join(_STORE_DIR, "file_catalog.db")
+os.environ["INGEST_DB_PATH"] = os.path.join(_STORE_DIR, "ingest_jobs.db")
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+os.environ["SESSION_DB_PATH"] = ""
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_STORE_DIR, ignore_errors=True)
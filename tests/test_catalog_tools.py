@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from tools.catalog_tools import FileCatalog, file_sha256
+
+
+@pytest.fixture
+def downloads(tmp_path):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    return directory
+
+
+@pytest.fixture
+def catalog(tmp_path, downloads):
+    return FileCatalog(db_path=str(tmp_path / "catalog.db"), directory=str(downloads))
+
+
+def write(directory, name, content):
+    path = directory / name
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_find_by_hash_skips_own_entry_and_uningested_files(catalog, downloads):
+    first = write(downloads, "a.txt", "same content")
+    sha = file_sha256(first)
+    catalog.record_file("a.txt", first, chunk_count=0, sha256=sha)
+
+    assert catalog.find_by_hash(sha)["name"] == "a.txt"
+    assert catalog.find_by_hash(sha, ingested_only=True) is None
+    assert catalog.find_by_hash(sha, exclude_path=first) is None
+
+    second = write(downloads, "b.txt", "same content")
+    catalog.record_file("b.txt", second, chunk_count=3, sha256=sha)
+    assert catalog.find_by_hash(sha, exclude_path=second)["name"] == "a.txt"
+    assert catalog.find_by_hash(sha, exclude_path=first, ingested_only=True)["name"] == "b.txt"
+
+
+def test_find_by_phash_filters_like_find_by_hash(catalog, downloads):
+    path = write(downloads, "photo.jpg", "pixels")
+    catalog.record_file("photo.jpg", path, chunk_count=1, phash="ff00ff00ff00ff00")
+
+    assert catalog.find_by_phash("ff00ff00ff00ff01")["name"] == "photo.jpg"
+    assert catalog.find_by_phash("ff00ff00ff00ff01", exclude_path=path) is None
+    assert catalog.find_by_phash("00ff00ff00ff00ff") is None
+
+
+def test_rebuild_from_disk_adds_new_and_drops_missing_files(catalog, downloads):
+    write(downloads, "kept.txt", "kept")
+    gone = write(downloads, "gone.txt", "gone")
+    assert catalog.rebuild_from_disk() == 2
+    os.remove(gone)
+
+    catalog.rebuild_from_disk()
+    assert [entry["name"] for entry in catalog.list_files()] == ["kept.txt"]
+    assert catalog.get_file("kept.txt")["chunk_count"] == 0
+
+
+def test_rebuild_from_disk_leaves_in_flight_files_to_their_job(catalog, downloads):
+    write(downloads, "uploading.txt", "being ingested")
+    catalog.in_flight = lambda: ["uploading.txt", "renamed.jpg"]
+    catalog.record_file("renamed.jpg", write(downloads, "renamed.jpg", "img"), chunk_count=2)
+    os.remove(downloads / "renamed.jpg")
+
+    catalog.rebuild_from_disk()
+    assert catalog.get_file("uploading.txt") is None
+    # Its job is still running (e.g. mid-rename), so the entry is not the re-sync's to drop
+    assert catalog.get_file("renamed.jpg") is not None
+
+
+def test_first_lookup_syncs_once(catalog, downloads):
+    write(downloads, "offline.txt", "saved while the bot was down")
+    assert catalog.get_file("offline.txt") is not None
+
+    write(downloads, "later.txt", "arrives after the sync")
+    assert catalog.get_file("later.txt") is None
+
+
+def test_lazy_sync_does_not_make_an_upload_a_duplicate_of_itself(monkeypatch, catalog, downloads):
+    import orchestrator
+
+    monkeypatch.setattr(orchestrator, "catalog", catalog)
+    monkeypatch.setattr(orchestrator, "delete_by_source", lambda source: True)
+    monkeypatch.setattr(orchestrator, "chunk_text_spans", lambda text: [
+        {"text": text, "char_start": 0, "char_end": len(text), "tokens": len(text.split())}])
+    monkeypatch.setattr(orchestrator, "index_chunks", lambda chunks, metadatas: len(chunks))
+
+    # The download is already on disk when the first lookup syncs the catalog
+    path = write(downloads, "notes.txt", "meeting notes")
+    reply = orchestrator.ingest_file(path, "notes.txt", "text/plain")
+
+    assert reply.startswith("Successfully processed 'notes.txt'")
+    assert catalog.get_file("notes.txt")["chunk_count"] == 1
+
+
+def test_upload_of_already_ingested_content_is_skipped(monkeypatch, catalog, downloads):
+    import orchestrator
+
+    monkeypatch.setattr(orchestrator, "catalog", catalog)
+    original = write(downloads, "notes.txt", "meeting notes")
+    catalog.record_file("notes.txt", original, "text/plain", chunk_count=4)
+    copy = write(downloads, "notes_copy.txt", "meeting notes")
+
+    reply = orchestrator.ingest_file(copy, "notes_copy.txt", "text/plain")
+
+    assert "already have this one as 'notes.txt' (4 chunks" in reply
+    assert not os.path.exists(copy)
+    assert os.path.exists(original)
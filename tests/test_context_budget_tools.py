@@ -0,0 +1,76 @@
+from tools.context_budget_tools import fit_prompt, MESSAGE_OVERHEAD_TOKENS, MIN_CONTEXT_CHUNK_TOKENS
+from tools.llm_tools import count_tokens
+
+# No chat model is loaded in the tests, so counts use the characters-per-token estimate
+PERSONA = "You are a helpful assistant. " * 10
+TURN = "Current time: 10:00."
+
+
+def prompt_tokens(fitted):
+    tokens = fitted["tokens"]
+    return (tokens["persona"] + tokens["turn_context"] + tokens["query"] + tokens["rules"]
+            + tokens["context"] + tokens["history"] + 2 * MESSAGE_OVERHEAD_TOKENS)
+
+
+def history(n, words=40):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "word " * words}
+            for i in range(n)]
+
+
+def test_everything_fits_when_small():
+    chunks = ["short chunk one", "short chunk two"]
+    fitted = fit_prompt(PERSONA, TURN, "what is in my notes?", rules="be brief",
+                        context_chunks=chunks, history=history(2, words=5), n_ctx=2048)
+
+    assert fitted["context_chunks"] == chunks
+    assert len(fitted["history"]) == 2
+    assert fitted["rules"] == "be brief"
+    assert fitted["query"] == "what is in my notes?"
+
+
+def test_prompt_plus_generation_reserve_stays_within_n_ctx():
+    chunks = ["retrieved passage " * 150 for _ in range(6)]
+    for n_ctx in (1024, 2048, 4096):
+        fitted = fit_prompt(PERSONA, TURN, "summarize my files", rules="rule\n" * 200,
+                            context_chunks=chunks, history=history(30), n_ctx=n_ctx)
+        assert prompt_tokens(fitted) + fitted["tokens"]["generation"] <= n_ctx
+
+
+def test_history_keeps_the_newest_messages():
+    messages = history(40)
+    fitted = fit_prompt(PERSONA, TURN, "and then?", history=messages, n_ctx=2048)
+
+    kept = fitted["history"]
+    assert 0 < len(kept) < len(messages)
+    assert kept == messages[-len(kept):]
+
+
+def test_chunks_keep_rank_order_and_only_the_last_is_cut():
+    chunks = [f"chunk {i} " + "text " * 300 for i in range(5)]
+    fitted = fit_prompt(PERSONA, TURN, "question", context_chunks=chunks, n_ctx=2048)
+
+    kept = fitted["context_chunks"]
+    assert kept
+    assert kept[:-1] == chunks[:len(kept) - 1]
+    assert chunks[len(kept) - 1].startswith(kept[-1])
+    assert count_tokens(kept[-1]) >= MIN_CONTEXT_CHUNK_TOKENS
+
+
+def test_rules_keep_the_newest_lines():
+    rules = "\n".join(f"rule number {i}" for i in range(500))
+    fitted = fit_prompt(PERSONA, TURN, "hi", rules=rules, n_ctx=2048)
+
+    kept = fitted["rules"].splitlines()
+    assert 0 < len(kept) < 500
+    assert kept[-1] == "rule number 499"
+
+
+def test_oversized_query_is_truncated_from_the_end():
+    query = "start " + "filler " * 3000
+    fitted = fit_prompt(PERSONA, TURN, query, context_chunks=["chunk"], history=history(4), n_ctx=2048)
+
+    assert query.startswith(fitted["query"])
+    assert len(fitted["query"]) < len(query)
+    assert fitted["context_chunks"] == []
+    assert fitted["history"] == []
+    assert prompt_tokens(fitted) + fitted["tokens"]["generation"] <= 2048
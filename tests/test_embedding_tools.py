@@ -0,0 +1,73 @@
+import pytest
+
+from benchmarks.stubs import StubEmbeddingModel
+from tools import embedding_tools
+from tools.embedding_tools import chunk_text_spans, EMBEDDING_MODEL_ID
+
+SENTENCES = [f"Sentence number {i} talks about topic {i % 7} in a few more words." for i in range(60)]
+
+
+@pytest.fixture(autouse=True)
+def stub_model(monkeypatch):
+    # One token per word or punctuation mark, 256-token max sequence length
+    model = StubEmbeddingModel()
+    monkeypatch.setitem(embedding_tools._models, EMBEDDING_MODEL_ID, model)
+    return model
+
+
+def token_count(model, text):
+    return len(model.tokenizer(text)["input_ids"])
+
+
+def test_chunk_offsets_point_at_the_chunk_text():
+    text = "  ".join(SENTENCES[:20]) + "\n\n" + " ".join(SENTENCES[20:])
+    chunks = chunk_text_spans(text, chunk_size=50, overlap=0)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert text[chunk["char_start"]:chunk["char_end"]] == chunk["text"]
+        assert chunk["text"] == chunk["text"].strip()
+
+
+def test_chunks_respect_the_token_budget(stub_model):
+    text = " ".join(SENTENCES)
+    for chunk in chunk_text_spans(text, chunk_size=40, overlap=10):
+        assert chunk["tokens"] <= 40
+        assert token_count(stub_model, chunk["text"]) == chunk["tokens"]
+
+
+def test_without_overlap_chunks_cover_the_text_in_order():
+    text = " ".join(SENTENCES)
+    chunks = chunk_text_spans(text, chunk_size=40, overlap=0)
+
+    assert chunks[0]["char_start"] == 0
+    assert chunks[-1]["char_end"] == len(text)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous["char_end"] <= current["char_start"]
+        assert text[previous["char_end"]:current["char_start"]].strip() == ""
+
+
+def test_overlap_repeats_whole_trailing_sentences():
+    text = " ".join(SENTENCES)
+    chunks = chunk_text_spans(text, chunk_size=40, overlap=20)
+
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current["char_start"] < previous["char_end"]
+        # The overlap starts on a sentence boundary
+        assert text[current["char_start"]:].startswith("Sentence number")
+
+
+def test_overlong_sentence_is_split_on_token_boundaries(stub_model):
+    sentence = " ".join(f"word{i}" for i in range(100))
+    chunks = chunk_text_spans(sentence, chunk_size=30, overlap=0)
+
+    assert [chunk["tokens"] for chunk in chunks] == [30, 30, 30, 10]
+    assert " ".join(chunk["text"] for chunk in chunks) == sentence
+
+
+def test_default_chunk_size_is_the_model_limit(stub_model):
+    text = " ".join(SENTENCES * 3)
+    chunks = chunk_text_spans(text)
+
+    assert max(chunk["tokens"] for chunk in chunks) <= stub_model.max_seq_length - 2
+    assert chunk_text_spans("   \n\n  ") == []
@@ -0,0 +1,144 @@
+import time
+import threading
+
+import pytest
+
+from tools import ingest_queue_tools
+from tools.ingest_queue_tools import IngestQueue, INGEST_MAX_ATTEMPTS
+
+
+class Busy(Exception):
+    pass
+
+
+def wait_for(queue, job_id, *states, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["state"] in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} stayed {queue.get(job_id)['state']}, expected {states}")
+
+
+def mark_running(queue, job_id, **fields):
+    """Leaves a job the way a crash mid-run would: running, one attempt used."""
+    queue._update(job_id, state="running", attempts=1, **fields)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "upload.txt"
+    path.write_text("content", encoding="utf-8")
+    return str(path)
+
+
+def test_job_runs_and_notifies_its_result(db_path, source):
+    notes = []
+    queue = IngestQueue(lambda job, report, relocate: report("halfway") or "indexed", db_path=db_path, workers=1)
+    queue.notifier = lambda job, text, final: notes.append((text, final))
+    queue.start()
+    job_id, ahead = queue.submit(source, "upload.txt", "text/plain", chat_id=1, message_id=2)
+
+    job = wait_for(queue, job_id, "done")
+    assert ahead == 0
+    assert job["result"] == "indexed"
+    assert notes[-1] == ("indexed", True)
+
+
+def test_busy_job_is_retried_without_using_an_attempt(monkeypatch, db_path, source):
+    monkeypatch.setattr(ingest_queue_tools, "INGEST_RETRY_DELAY", 0)
+    calls = []
+
+    def handler(job, report, relocate):
+        calls.append(job["attempts"])
+        if len(calls) == 1:
+            raise Busy()
+        return "indexed"
+
+    queue = IngestQueue(handler, retry_on=(Busy,), db_path=db_path, workers=1)
+    queue.start()
+    job_id, _ = queue.submit(source, "upload.txt", "text/plain")
+
+    job = wait_for(queue, job_id, "done")
+    assert calls == [1, 1]
+    assert job["attempts"] == 1
+
+
+def test_failed_job_is_cleaned_up(db_path, source):
+    recovered = []
+
+    def handler(job, report, relocate):
+        relocate(source + ".renamed", "renamed.txt")
+        raise ValueError("parse error")
+
+    queue = IngestQueue(handler, recover=lambda job: recovered.append(job["file_name"]), db_path=db_path, workers=1)
+    queue.start()
+    job_id, _ = queue.submit(source, "upload.txt", "text/plain")
+
+    job = wait_for(queue, job_id, "failed")
+    assert "parse error" in job["result"]
+    assert recovered == ["renamed.txt"]
+
+
+def test_interrupted_job_is_recovered_and_resumed(db_path, source):
+    first = IngestQueue(lambda *args: "unused", db_path=db_path)
+    job_id, _ = first.submit(source, "upload.txt", "text/plain")
+    # The crashed run had renamed the file; the resume must follow it
+    mark_running(first, job_id, file_name="renamed.txt")
+
+    recovered, handled = [], []
+    queue = IngestQueue(lambda job, report, relocate: handled.append(job["file_name"]) or "indexed",
+                        recover=lambda job: recovered.append(job["file_name"]), db_path=db_path, workers=1)
+    queue.start()
+
+    job = wait_for(queue, job_id, "done")
+    assert recovered == ["renamed.txt"]
+    assert handled == ["renamed.txt"]
+    assert job["attempts"] == 2
+
+
+def test_resume_gives_up_on_missing_files_and_repeated_crashes(db_path, source):
+    first = IngestQueue(lambda *args: "unused", db_path=db_path)
+    lost, _ = first.submit(source + ".missing", "missing.txt", "text/plain")
+    mark_running(first, lost)
+    crashy, _ = first.submit(source, "upload.txt", "text/plain")
+    first._update(crashy, state="running", attempts=INGEST_MAX_ATTEMPTS)
+
+    queue = IngestQueue(lambda *args: "indexed", db_path=db_path, workers=1)
+    queue.start()
+
+    assert "lost during a restart" in wait_for(queue, lost, "failed")["result"]
+    assert "Gave up" in wait_for(queue, crashy, "failed")["result"]
+
+
+def test_cancel_stops_running_jobs_and_notifies_queued_ones(db_path, source):
+    started = threading.Event()
+    recovered, notes = [], []
+    queue = None
+
+    def handler(job, report, relocate):
+        started.set()
+        while True:
+            queue.checkpoint(job)
+            time.sleep(0.01)
+
+    queue = IngestQueue(handler, recover=lambda job: recovered.append(job["id"]), db_path=db_path, workers=1)
+    queue.notifier = lambda job, text, final: notes.append((job["id"], text, final))
+    queue.start()
+    running, _ = queue.submit(source, "upload.txt", "text/plain")
+    waiting, _ = queue.submit(source, "second.txt", "text/plain")
+    assert started.wait(5)
+
+    assert queue.cancel() == 2
+    wait_for(queue, running, "cancelled")
+    time.sleep(0.1)
+    assert queue.get(waiting)["state"] == "cancelled"
+    assert recovered == [running]
+    assert (waiting, "Cancelled.", True) in notes
+    assert (running, "Cancelled.", True) in notes
@@ -0,0 +1,46 @@
+from tools.lexical_index_tools import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_keeps_compounds_whole_and_as_parts():
+    assert tokenize("See INV-2041 in notes_v2.txt") == [
+        "see", "inv-2041", "inv", "2041", "in", "notes_v2.txt", "notes", "v2", "txt"]
+
+
+def test_exact_identifier_ranks_first():
+    index = BM25Index()
+    index.add("a", "Invoice INV-2041 from the bakery", source="invoices.pdf")
+    index.add("b", "Invoice INV-2042 from the florist", source="invoices.pdf")
+    index.add("c", "Lecture notes on thermodynamics", source="physics.txt")
+
+    hits = index.search("INV-2041")
+    assert hits[0][0] == "a"
+    assert "c" not in dict(hits)
+
+
+def test_source_file_name_is_searchable():
+    index = BM25Index()
+    index.add("a", "some text", source="travel_report.pdf")
+    index.add("b", "other text", source="recipes.txt")
+
+    assert index.search("travel_report.pdf")[0][0] == "a"
+
+
+def test_remove_source_and_re_add_keep_counts_consistent():
+    index = BM25Index()
+    index.add("a", "alpha beta", source="one.txt")
+    index.add("b", "alpha gamma", source="two.txt")
+    index.add("a", "alpha delta", source="one.txt")
+    assert len(index) == 2
+    assert index.search("beta") == []
+
+    assert index.remove_source("one.txt") == 1
+    assert [doc_id for doc_id, _ in index.search("alpha")] == ["b"]
+    assert index.search("delta") == []
+
+
+def test_reciprocal_rank_fusion_prefers_ids_ranked_by_both():
+    fused = reciprocal_rank_fusion([["a", "b", "e"], ["c", "b", "d"]])
+
+    assert fused[0] == "b"
+    assert set(fused) == {"a", "b", "c", "d", "e"}
+    assert fused.index("a") < fused.index("e")
@@ -0,0 +1,193 @@
+"""
+Autotune Module
+First-run tuning of the llama.cpp runtime knobs for this machine. Short
+prompt-eval and generation micro-benchmarks run over candidate thread counts
+and batch sizes; the fastest settings, plus the largest n_ctx whose full-prompt
+evaluation stays within LLM_AUTOTUNE_PREFILL_SECONDS, are cached as a profile
+keyed by host and model hash so later starts load it instantly.
+
+Tuning runs during startup warm-up, or on demand (e.g. before a WARMUP_MODE=lazy start):
+
+    python -m tools.autotune_tools
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import platform
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# auto = tune when there is no cached profile, force = retune on every start, off = never
+LLM_AUTOTUNE = os.getenv("LLM_AUTOTUNE", "auto").lower().strip()
+AUTOTUNE_CACHE_PATH = os.getenv("AUTOTUNE_CACHE_PATH", "autotune_profiles.json")
+# Longest acceptable evaluation of a completely full prompt when picking n_ctx
+LLM_AUTOTUNE_PREFILL_SECONDS = float(os.getenv("LLM_AUTOTUNE_PREFILL_SECONDS", 10))
+
+BATCH_CANDIDATES = (128, 256, 512)
+# Never below the long-standing 2048 default; larger only when prefill is fast enough
+N_CTX_CANDIDATES = (2048, 4096, 8192)
+_PROMPT_TOKENS = 256
+_DECODE_TOKENS = 16
+_TUNE_CTX = 512
+# The model hash covers the GGUF header (architecture, vocab, quantization) and size,
+# so profiles survive re-downloads without reading gigabytes at startup
+_HASH_BYTES = 4 * 1024 * 1024
+
+_SAMPLE_TEXT = (
+    "The quarterly report covers revenue, operating costs and headcount across all regions. "
+    "Invoices are due thirty days after delivery and late payments accrue a small fee. "
+)
+
+_active_profile = None
+_lock = threading.Lock()
+
+
+def host_key():
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}cpu"
+
+
+def model_key(model_path):
+    """Short hash of the model file's size and leading bytes, or None if it is not there yet."""
+    try:
+        digest = hashlib.sha256(str(os.path.getsize(model_path)).encode())
+        with open(model_path, "rb") as f:
+            digest.update(f.read(_HASH_BYTES))
+        return digest.hexdigest()[:16]
+    except OSError:
+        return None
+
+
+def _read_profiles():
+    try:
+        with open(AUTOTUNE_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_profile(model_path):
+    """The cached profile for this host and model, or None. Cheap enough to call at import."""
+    key = model_key(model_path)
+    if key is None or LLM_AUTOTUNE == "force":
+        return None
+    return _read_profiles().get(f"{host_key()}|{key}")
+
+
+def save_profile(model_path, profile):
+    with _lock:
+        profiles = _read_profiles()
+        profiles[f"{host_key()}|{model_key(model_path)}"] = profile
+        tmp_path = AUTOTUNE_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, indent=2)
+        os.replace(tmp_path, AUTOTUNE_CACHE_PATH)
+
+
+def active_profile():
+    """The profile the chat model runs with (cached or freshly tuned), or None."""
+    return _active_profile
+
+
+def set_active_profile(profile):
+    global _active_profile
+    _active_profile = profile
+
+
+def thread_candidates():
+    logical = os.cpu_count() or 1
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False) or logical
+    except ImportError:
+        physical = max(1, logical // 2)
+    return sorted({max(1, physical // 2), physical, min(8, logical), logical})
+
+
+def _measure(llm, tokens, decode=True):
+    """(prompt tokens/sec, generated tokens/sec or None) for one loaded configuration."""
+    llm.reset()
+    llm.eval(tokens[:8])  # Warm-up: first eval allocates compute buffers
+    llm.reset()
+    started = time.perf_counter()
+    llm.eval(tokens)
+    prefill = len(tokens) / (time.perf_counter() - started)
+    if not decode:
+        return prefill, None
+    # One token per eval is exactly the generation step; sampling cost is negligible
+    started = time.perf_counter()
+    for token in tokens[:_DECODE_TOKENS]:
+        llm.eval([token])
+    decode = _DECODE_TOKENS / (time.perf_counter() - started)
+    return prefill, decode
+
+
+def _pick_n_ctx(prefill_tps, n_ctx_train, reserved_tokens):
+    fitting = [n for n in N_CTX_CANDIDATES
+               if n <= n_ctx_train and (n - reserved_tokens) / prefill_tps <= LLM_AUTOTUNE_PREFILL_SECONDS]
+    return max(fitting, default=N_CTX_CANDIDATES[0])
+
+
+def tune_llm(model_path, n_gpu_layers, reserved_tokens=0):
+    """
+    Benchmarks every thread count x batch size candidate and saves the best profile.
+    Each candidate reloads the model; the weights are mmap'd, so after the first load
+    that is mostly page-cache hits.
+    """
+    from llama_cpp import Llama
+
+    threads = thread_candidates()
+    print(f"Autotuning llama.cpp for this machine (threads {threads}, batch {list(BATCH_CANDIDATES)})...")
+    started = time.perf_counter()
+    best_prefill = best_decode = None
+    n_ctx_train = None
+    for n_threads in threads:
+        decode_tps = None
+        for n_batch in BATCH_CANDIDATES:
+            llm = Llama(model_path=model_path, n_ctx=_TUNE_CTX, n_threads=n_threads, n_threads_batch=n_threads,
+                        n_batch=n_batch, n_gpu_layers=n_gpu_layers, verbose=False)
+            if n_ctx_train is None:
+                n_ctx_train = llm.n_ctx_train()
+            text = _SAMPLE_TEXT * (1 + _PROMPT_TOKENS // 32)
+            tokens = llm.tokenize(text.encode("utf-8"))[:_PROMPT_TOKENS]
+            # Generation speed does not depend on n_batch; one measurement per thread count
+            prefill, decode = _measure(llm, tokens, decode=decode_tps is None)
+            del llm
+            decode_tps = decode_tps or decode
+            logger.info(f"autotune threads={n_threads} batch={n_batch}: prefill {prefill:.1f} tok/s, generation {decode_tps:.1f} tok/s")
+            if best_prefill is None or prefill > best_prefill[0]:
+                best_prefill = (prefill, n_threads, n_batch)
+        if best_decode is None or decode_tps > best_decode[0]:
+            best_decode = (decode_tps, n_threads)
+
+    profile = {
+        "n_threads": best_decode[1],
+        "n_threads_batch": best_prefill[1],
+        "n_batch": best_prefill[2],
+        "n_ctx": _pick_n_ctx(best_prefill[0], n_ctx_train, reserved_tokens),
+        "prefill_tps": round(best_prefill[0], 1),
+        "decode_tps": round(best_decode[0], 1),
+        "n_gpu_layers": n_gpu_layers,
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "tuning_seconds": round(time.perf_counter() - started, 1),
+    }
+    save_profile(model_path, profile)
+    print(f"Autotune done in {profile['tuning_seconds']}s: {format_profile(profile)}")
+    return profile
+
+
+def format_profile(profile):
+    return (f"{profile['n_threads']} threads ({profile['n_threads_batch']} for prompts), "
+            f"n_batch {profile['n_batch']}, n_ctx {profile['n_ctx']} | "
+            f"prefill {profile['prefill_tps']} tok/s, generation {profile['decode_tps']} tok/s")
+
+
+if __name__ == "__main__":
+    # Imported here: llm_tools imports this module
+    from tools.llm_tools import autotune
+    autotune(force=True)
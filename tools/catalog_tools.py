@@ -0,0 +1,226 @@
+"""
+File Catalog Module
+SQLite index of the files in downloads/ (name, size, content hash, MIME type,
+chunk count, ingest time). Uploads and deletes update it transactionally, so
+listing and looking up files never has to scan the directory. Telegram's
+file_unique_id and a perceptual hash for images are kept for deduplication.
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import mimetypes
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", "file_catalog.db")
+# Relative paths resolve against the main project directory, like the Chroma store
+PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+
+# Max differing bits between two 64-bit image dHashes to count as the same picture
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", 4))
+
+_COLUMNS = ("name", "path", "size", "mtime", "sha256", "mime_type", "chunk_count", "ingested_at",
+            "unique_id", "phash")
+# Columns added after the first release, migrated in place on open
+_ADDED_COLUMNS = {"unique_id": "TEXT", "phash": "TEXT"}
+
+
+def file_sha256(file_path):
+    """Hashes a file in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashingWriter:
+    """Binary file writer that sha256-hashes content as it streams to disk."""
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FileCatalog:
+    """
+    Transactional SQLite catalog of stored files, keyed by file name. The first lookup
+    re-syncs it with the downloads directory unless the startup warm-up already did,
+    so files saved while the bot was not running are listed in every WARMUP_MODE.
+    in_flight, if set, returns the names of files an ingest job still owns; the re-sync
+    leaves those to the job instead of cataloguing them as already ingested.
+    """
+
+    def __init__(self, db_path=CATALOG_DB_PATH, directory="downloads"):
+        self.directory = directory
+        self.in_flight = None
+        self._synced = False
+        self._sync_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(PROJECT_DIR, db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "name TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+                "sha256 TEXT, mime_type TEXT, chunk_count INTEGER NOT NULL DEFAULT 0, ingested_at REAL NOT NULL)"
+            )
+            existing = {row["name"] for row in self._db.execute("PRAGMA table_info(files)").fetchall()}
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._db.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_unique_id ON files (unique_id)")
+
+    def record_file(self, name, path, mime_type=None, chunk_count=0, sha256=None, unique_id=None, phash=None):
+        """Adds or replaces the entry for a file that is on disk. Returns the entry."""
+        stat = os.stat(path)
+        entry = {
+            "name": name,
+            "path": path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256 or file_sha256(path),
+            "mime_type": mime_type or mimetypes.guess_type(name)[0],
+            "chunk_count": chunk_count,
+            "ingested_at": time.time(),
+            "unique_id": unique_id,
+            "phash": phash,
+        }
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                tuple(entry[c] for c in _COLUMNS)
+            )
+        return entry
+
+    def remove_file(self, name):
+        """Drops a file's entry. Returns True if one existed."""
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM files WHERE name = ?", (name,)).rowcount > 0
+
+    def get_file(self, name):
+        """Returns the entry dict for a file name, or None."""
+        self.ensure_synced()
+        with self._lock:
+            row = self._db.execute("SELECT * FROM files WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_hash(self, sha256, exclude_path=None, ingested_only=False):
+        """
+        Returns the entry whose content hash matches, or None. exclude_path skips the entry
+        of that file itself; ingested_only skips files never indexed (chunk_count 0).
+        """
+        self.ensure_synced()
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM files WHERE sha256 = ?", (sha256,)).fetchall()
+        return next((dict(row) for row in rows if self._eligible(row, exclude_path, ingested_only)), None)
+
+    @staticmethod
+    def _eligible(row, exclude_path, ingested_only):
+        if ingested_only and not row["chunk_count"]:
+            return False
+        return not exclude_path or os.path.abspath(row["path"]) != os.path.abspath(exclude_path)
+
+    def find_by_unique_id(self, unique_id):
+        """Returns the entry uploaded with this Telegram file_unique_id, or None."""
+        if not unique_id:
+            return None
+        self.ensure_synced()
+        with self._lock:
+            row = self._db.execute("SELECT * FROM files WHERE unique_id = ? LIMIT 1", (unique_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_phash(self, phash, max_distance=PHASH_MAX_DISTANCE, exclude_path=None, ingested_only=False):
+        """Returns the closest image entry within max_distance bits of phash, or None. Filters as find_by_hash."""
+        if not phash:
+            return None
+        target = int(phash, 16)
+        self.ensure_synced()
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM files WHERE phash IS NOT NULL").fetchall()
+        best, best_distance = None, max_distance + 1
+        for row in rows:
+            if not self._eligible(row, exclude_path, ingested_only):
+                continue
+            distance = bin(int(row["phash"], 16) ^ target).count("1")
+            if distance < best_distance:
+                best, best_distance = row, distance
+        return dict(best) if best else None
+
+    def list_files(self, limit=None):
+        """Non-empty files, oldest upload first."""
+        self.ensure_synced()
+        query = "SELECT * FROM files WHERE size > 0 ORDER BY ingested_at, name"
+        params = ()
+        if limit:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, params).fetchall()]
+
+    def clear_all(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files")
+
+    def ensure_synced(self):
+        """Runs rebuild_from_disk once per process, before the first lookup."""
+        if self._synced:
+            return
+        with self._sync_lock:
+            if not self._synced:
+                self.rebuild_from_disk()
+
+    def rebuild_from_disk(self, directory=None):
+        """
+        Re-syncs the catalog with the directory in one transaction: new files are added,
+        missing ones dropped, and unchanged files (same size and mtime) are not re-hashed.
+        Files with a queued or running ingest job (in_flight) are left untouched.
+        Returns the number of files catalogued.
+        """
+        directory = directory or self.directory
+        pending = set(self.in_flight()) if self.in_flight else set()
+        on_disk = {}
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name not in pending and os.path.isfile(path):
+                    on_disk[name] = (path, os.stat(path))
+
+        with self._lock, self._db:
+            known = {row["name"]: dict(row) for row in self._db.execute("SELECT * FROM files").fetchall()}
+            for name in known.keys() - on_disk.keys() - pending:
+                self._db.execute("DELETE FROM files WHERE name = ?", (name,))
+            for name, (path, stat) in on_disk.items():
+                entry = known.get(name)
+                if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                    continue
+                # Content changed (or is new): dedup keys from the old content no longer apply
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    (name, path, stat.st_size, stat.st_mtime, file_sha256(path),
+                     mimetypes.guess_type(name)[0], entry["chunk_count"] if entry else 0,
+                     entry["ingested_at"] if entry else stat.st_mtime, None, None)
+                )
+        self._synced = True
+        return len(on_disk)
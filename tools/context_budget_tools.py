@@ -0,0 +1,109 @@
+"""
+Context Budget Module
+Fits every chat prompt into the LLM's n_ctx window. Tokens are counted with the
+GGUF tokenizer and each prompt part gets a configurable budget; when the window
+is still too small, lower-priority parts are trimmed first.
+
+Priority (highest first): generation reserve, persona, user query, turn context,
+rules, retrieved context, history.
+"""
+
+import os
+from dotenv import load_dotenv
+from tools.llm_tools import count_tokens, truncate_to_tokens, LLM_N_CTX, CTX_BUDGET_GENERATION
+
+load_dotenv()
+
+CTX_BUDGET_RULES = int(os.getenv("CTX_BUDGET_RULES", 200))
+# Defaults are sized for n_ctx=2048 and grow with a larger (e.g. autotuned) window
+CTX_BUDGET_CONTEXT = int(os.getenv("CTX_BUDGET_CONTEXT", 700 * LLM_N_CTX // 2048))
+CTX_BUDGET_HISTORY = int(os.getenv("CTX_BUDGET_HISTORY", 500 * LLM_N_CTX // 2048))
+
+# Chat-template tokens wrapped around each message (<|im_start|>role ... <|im_end|>)
+MESSAGE_OVERHEAD_TOKENS = 6
+# Don't bother keeping a retrieved chunk cut shorter than this
+MIN_CONTEXT_CHUNK_TOKENS = 32
+
+
+def _trim_rules(rules, max_tokens):
+    """Keeps the newest rule lines that fit; rules are appended oldest first."""
+    if not rules or max_tokens <= 0:
+        return ""
+    kept = []
+    used = 0
+    for line in reversed(rules.splitlines()):
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.insert(0, line)
+        used += cost
+    return "\n".join(kept)
+
+
+def fit_prompt(persona, turn_context, query, rules="", context_chunks=(), history=(), n_ctx=LLM_N_CTX):
+    """
+    Trims rules, retrieved chunks and history so the whole prompt plus the generation
+    reserve fits in n_ctx.
+
+    persona / turn_context / query are always kept (the query is truncated only if it
+    alone would overflow). Chunks are kept in rank order; history keeps the newest messages.
+    Returns a dict with the trimmed rules, context_chunks, history, query and a token report.
+    """
+    available = n_ctx - CTX_BUDGET_GENERATION
+    persona_tokens = count_tokens(persona) + MESSAGE_OVERHEAD_TOKENS
+    turn_tokens = count_tokens(turn_context) + MESSAGE_OVERHEAD_TOKENS
+    # The user message carries the template overhead plus the "Context retrieved..." wrapper
+    available -= persona_tokens + turn_tokens + 2 * MESSAGE_OVERHEAD_TOKENS
+
+    query_tokens = count_tokens(query)
+    if query_tokens > available:
+        query = truncate_to_tokens(query, max(0, available))
+        query_tokens = count_tokens(query)
+    available -= query_tokens
+
+    rules = _trim_rules(rules, min(CTX_BUDGET_RULES, available))
+    rules_tokens = count_tokens(rules)
+    available -= rules_tokens
+
+    kept_chunks = []
+    context_tokens = 0
+    context_budget = min(CTX_BUDGET_CONTEXT, available)
+    for chunk in context_chunks:
+        remaining = context_budget - context_tokens
+        cost = count_tokens(chunk) + 2
+        if cost > remaining:
+            if remaining - 2 >= MIN_CONTEXT_CHUNK_TOKENS:
+                chunk = truncate_to_tokens(chunk, remaining - 2)
+                kept_chunks.append(chunk)
+                context_tokens += count_tokens(chunk) + 2
+            break
+        kept_chunks.append(chunk)
+        context_tokens += cost
+    available -= context_tokens
+
+    kept_history = []
+    history_tokens = 0
+    history_budget = min(CTX_BUDGET_HISTORY, available)
+    for msg in reversed(list(history)):
+        cost = count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if history_tokens + cost > history_budget:
+            break
+        kept_history.insert(0, msg)
+        history_tokens += cost
+
+    return {
+        "rules": rules,
+        "context_chunks": kept_chunks,
+        "history": kept_history,
+        "query": query,
+        "tokens": {
+            "persona": persona_tokens,
+            "turn_context": turn_tokens,
+            "query": query_tokens,
+            "rules": rules_tokens,
+            "context": context_tokens,
+            "history": history_tokens,
+            "generation": CTX_BUDGET_GENERATION,
+            "n_ctx": n_ctx,
+        },
+    }
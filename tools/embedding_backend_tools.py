@@ -0,0 +1,217 @@
+"""
+Embedding Backend Module
+Interchangeable encoders behind the slice of the SentenceTransformer API the
+rest of the bot uses (encode, tokenizer, max_seq_length, dimension). `torch`
+is the SentenceTransformer itself; `onnx` / `onnx-int8` run an exported copy of
+the same model on ONNX Runtime, fp32 or dynamically int8-quantized, without
+importing torch or transformers.
+
+Export (needs torch + sentence-transformers + onnx, once per model):
+
+    python -m tools.embedding_backend_tools --model all-MiniLM-L6-v2
+
+Check parity against torch and compare speed with benchmarks/embedding_parity.py.
+"""
+
+import os
+import json
+import shutil
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# torch (default), onnx or onnx-int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower().strip()
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(os.getenv("MODEL_DIR", "models"), "onnx"))
+# Intra-op threads of the ONNX Runtime session (0 = onnxruntime's default, one per core)
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", 0))
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+_CONFIG_FILE = "embedding_backend.json"
+_FP32_FILE = "model.onnx"
+_INT8_FILE = "model.int8.onnx"
+
+
+def embedding_identity(model_name, backend=EMBEDDING_BACKEND):
+    """
+    Name a backend's vectors are known by in caches and vector collections. torch keeps
+    the bare model name, so existing caches and collections stay valid; the ONNX backends
+    get their own, since their vectors differ slightly (int8 especially).
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def parse_identity(identity):
+    """(model name, backend) of an embedding identity."""
+    model_name, _, backend = identity.rpartition("@")
+    if model_name and backend in BACKENDS:
+        return model_name, backend
+    return identity, "torch"
+
+
+def onnx_dir(model_name):
+    return os.path.join(EMBEDDING_ONNX_DIR, model_name.replace("/", "__"))
+
+
+class _TokenizerAdapter:
+    """The call shape of a Hugging Face fast tokenizer that the chunker uses, over a bare `tokenizers.Tokenizer`."""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        single = isinstance(texts, str)
+        encodings = self._tokenizer.encode_batch([texts] if single else texts, add_special_tokens=add_special_tokens)
+        result = {"input_ids": [e.ids for e in encodings]}
+        if return_offsets_mapping:
+            result["offset_mapping"] = [e.offsets for e in encodings]
+        return {key: value[0] for key, value in result.items()} if single else result
+
+
+class OnnxEmbeddingBackend:
+    """An exported sentence-transformers model on ONNX Runtime: tokenize, run the encoder, pool, normalize."""
+
+    def __init__(self, model_name, quantized=False):
+        import numpy as np
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        directory = onnx_dir(model_name)
+        with open(os.path.join(directory, _CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+        self._np = np
+
+        tokenizer_path = os.path.join(directory, "tokenizer.json")
+        counting = Tokenizer.from_file(tokenizer_path)
+        counting.no_truncation()
+        counting.no_padding()
+        self.tokenizer = _TokenizerAdapter(counting)
+        self._encoder_tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._encoder_tokenizer.enable_truncation(self.max_seq_length)
+        self._encoder_tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        if EMBEDDING_ONNX_THREADS:
+            options.intra_op_num_threads = EMBEDDING_ONNX_THREADS
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(directory, _INT8_FILE if quantized else _FP32_FILE),
+            sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = [i.name for i in self._session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        np = self._np
+        batch_size = max(1, batch_size)
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self._encoder_tokenizer.encode_batch(texts[start:start + batch_size])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self._session.run(None, {name: feeds[name] for name in self._inputs})[0]
+            vectors.append(self._pool(hidden, feeds["attention_mask"]))
+        if not vectors:
+            return np.zeros((0, self.config["dimension"]), dtype=np.float32)
+        return np.concatenate(vectors)
+
+    def _pool(self, hidden, mask):
+        np = self._np
+        mode = self.config["pooling"]
+        if mode == "cls":
+            pooled = hidden[:, 0]
+        elif mode == "max":
+            pooled = np.where(mask[:, :, None] > 0, hidden, -1e9).max(axis=1)
+        else:
+            weights = mask[:, :, None].astype(hidden.dtype)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+def load_backend(identity):
+    """Loads the encoder for an embedding identity, exporting the ONNX model first if it is missing."""
+    model_name, backend = parse_identity(identity)
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        # Load a CPU-friendly embedding model to save VRAM for the core LLM execution
+        return SentenceTransformer(model_name, device='cpu')
+    weights = _INT8_FILE if backend == "onnx-int8" else _FP32_FILE
+    if not os.path.exists(os.path.join(onnx_dir(model_name), weights)):
+        print(f"No ONNX export of {model_name} in {onnx_dir(model_name)} yet, exporting it now (one-time, needs torch)...")
+        export_onnx(model_name, quantize=backend == "onnx-int8")
+    return OnnxEmbeddingBackend(model_name, quantized=backend == "onnx-int8")
+
+
+def export_onnx(model_name, quantize=True):
+    """
+    Exports a sentence-transformers model's encoder to ONNX plus its tokenizer and
+    pooling settings, and optionally a dynamically int8-quantized copy. Returns the directory.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    modules = [type(m).__name__ for m in model]
+    if modules[0] != "Transformer" or any(name not in ("Transformer", "Pooling", "Normalize") for name in modules):
+        raise ValueError(f"Only Transformer + Pooling (+ Normalize) models can be exported, {model_name} has {modules}")
+    pooling = next((m for m in model if type(m).__name__ == "Pooling"), None)
+    pooling_mode = pooling.get_pooling_mode_str() if pooling else "mean"
+    if pooling_mode not in ("mean", "cls", "max"):
+        raise ValueError(f"Unsupported pooling mode '{pooling_mode}' in {model_name}")
+
+    directory = onnx_dir(model_name)
+    staging = directory + ".partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    tokenizer = model.tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError(f"{model_name} has no fast tokenizer (tokenizer.json), which the ONNX backend needs")
+    tokenizer.save_pretrained(staging)
+
+    sample = tokenizer(["Exporting the encoder.", "A second, longer sentence to vary the length."],
+                       padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    encoder = model[0].auto_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(encoder, ({name: sample[name] for name in input_names},),
+                          os.path.join(staging, _FP32_FILE), input_names=input_names,
+                          output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=14)
+
+    with open(os.path.join(staging, _CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model": model_name,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length,
+            "pooling": pooling_mode,
+            "normalize": "Normalize" in modules,
+            "pad_token": tokenizer.pad_token,
+            "pad_token_id": tokenizer.pad_token_id,
+        }, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(os.path.join(staging, _FP32_FILE), os.path.join(staging, _INT8_FILE),
+                         weight_type=QuantType.QInt8)
+
+    # A half-written export must never be picked up by load_backend
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+    print(f"Exported {model_name} to {directory}" + (" (fp32 + int8)" if quantize else " (fp32)"))
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a sentence-transformers model for the ONNX embedding backends.")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+    parser.add_argument("--no-quantize", action="store_true", help="skip the int8 copy (onnx-int8 backend)")
+    args = parser.parse_args()
+    export_onnx(args.model, quantize=not args.no_quantize)
@@ -0,0 +1,119 @@
+"""
+Embedding Cache Module
+Content-addressed cache for embedding vectors: a bounded in-process LRU in front
+of a persistent SQLite store. Keys hash the model's identity (name, plus the
+backend unless it is torch) together with the text, and the on-disk store is
+cleared automatically when EMBEDDING_MODEL or EMBEDDING_BACKEND changes.
+"""
+
+import os
+import array
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Vectors kept in RAM (0 disables the memory tier)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+# SQLite file for the persistent tier (empty disables it)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+# Relative paths resolve against the main project directory, like the Chroma store
+PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    """Looks up and stores embedding vectors keyed by sha256(model name + text)."""
+
+    def __init__(self, model_name, max_items=EMBEDDING_CACHE_SIZE, db_path=EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(os.path.join(PROJECT_DIR, db_path), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+            if row is None or row[0] != model_name:
+                # Vectors from another model are useless, drop them all
+                self._db.execute("DELETE FROM embeddings")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (model_name,))
+            self._db.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def _remember(self, key, vector):
+        # Caller holds self._lock
+        if self.max_items <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts):
+        """Returns a list aligned with texts holding cached vectors, or None for misses."""
+        keys = [self._key(t) for t in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing and self._db is not None:
+                pending = list(missing)
+                for start in range(0, len(pending), _SQL_BATCH):
+                    batch = pending[start:start + _SQL_BATCH]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array.array("f", blob).tolist()
+                        self._remember(key, vector)
+                        for i in missing.pop(key):
+                            results[i] = vector
+
+            miss_count = sum(len(idx) for idx in missing.values())
+            self.misses += miss_count
+            self.hits += len(texts) - miss_count
+        return results
+
+    def put_many(self, texts, vectors):
+        """Stores freshly computed vectors in both tiers."""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if not vector:
+                    continue
+                key = self._key(text)
+                self._remember(key, vector)
+                rows.append((key, array.array("f", vector).tobytes()))
+            if rows and self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters for logging and diagnostics."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_items": len(self._memory),
+            }
@@ -1,33 +1,170 @@
 import os
-from sentence_transformers import SentenceTransformer
+import re
+import threading
 from dotenv import load_dotenv
+from tools.embedding_cache_tools import EmbeddingCache
+from tools.embedding_backend_tools import EMBEDDING_BACKEND, embedding_identity, load_backend
+from tools.metrics_tools import span
 
 load_dotenv()
 
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 300))
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 50))
+# Chunk sizes are in embedding-model tokens; 0 means "the model's max sequence length"
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 0))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 32))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+# What the configured model + EMBEDDING_BACKEND is known by in caches and collections
+EMBEDDING_MODEL_ID = embedding_identity(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
 
-# Load a CPU-friendly embedding model to save VRAM for the core LLM execution
-print(f"Loading embedding model ({EMBEDDING_MODEL_NAME}) into CPU...")
-model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+# Loaded encoders by embedding identity. Normally just EMBEDDING_MODEL_ID; while stored vectors
+# are being re-embedded for a new model or backend, the one that produced them stays loaded for queries
+_models = {}
+_model_lock = threading.Lock()
 
-def get_embedding(text):
+def get_model(model_name=EMBEDDING_MODEL_ID):
+    """Loads an embedding model on first use (importing torch is slow) and caches it."""
+    with _model_lock:
+        if model_name not in _models:
+            print(f"Loading embedding model ({model_name}) into CPU...")
+            _models[model_name] = load_backend(model_name)
+        return _models[model_name]
+
+def unload_model(model_name):
+    """Drops a model other than EMBEDDING_MODEL_ID once nothing is stored in its vector space."""
+    with _model_lock:
+        if model_name != EMBEDDING_MODEL_ID:
+            _models.pop(model_name, None)
+            _caches.pop(model_name, None)
+
+def embedding_dimension(model_name=EMBEDDING_MODEL_ID):
+    return get_model(model_name).get_sentence_embedding_dimension()
+
+# Repeated text (greetings, re-uploaded chunks) skips the encoder entirely
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL_ID)
+# Other models get a RAM-only cache: the persistent store belongs to EMBEDDING_MODEL_ID
+_caches = {EMBEDDING_MODEL_ID: embedding_cache}
+
+def _cache_for(model_name):
+    with _model_lock:
+        if model_name not in _caches:
+            _caches[model_name] = EmbeddingCache(model_name, db_path="")
+        return _caches[model_name]
+
+def get_embedding(text, model_name=EMBEDDING_MODEL_ID):
     """Generates an embedding vector for the provided text."""
-    if not text or not text.strip():
+    return get_embeddings([text], model_name=model_name)[0]
+
+def get_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, model_name=EMBEDDING_MODEL_ID):
+    """
+    Generates embedding vectors for a list of texts using the encoder's batched path.
+    Cached vectors are reused; only cache misses are encoded.
+    Blank entries map to an empty list so results stay aligned with the input.
+    """
+    embeddings = [[] for _ in texts]
+    indexed = [(i, t) for i, t in enumerate(texts) if t and t.strip()]
+    if not indexed:
+        return embeddings
+
+    cache = _cache_for(model_name)
+    cached = cache.get_many([t for _, t in indexed])
+    to_encode = []
+    for (i, t), vector in zip(indexed, cached):
+        if vector is not None:
+            embeddings[i] = vector
+        else:
+            to_encode.append((i, t))
+
+    if to_encode:
+        with span("embedding.encode", texts=len(to_encode), cache_hits=len(indexed) - len(to_encode)):
+            vectors = get_model(model_name).encode([t for _, t in to_encode], batch_size=max(1, batch_size))
+        for (i, _), vector in zip(to_encode, vectors):
+            embeddings[i] = vector.tolist()
+        cache.put_many([t for _, t in to_encode], [embeddings[i] for i, _ in to_encode])
+    return embeddings
+
+# Sentence ends and blank-line paragraph breaks are the only places a chunk may split
+_SEGMENT_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+def _segment_spans(text):
+    """Yields (start, end) character spans of the sentences/paragraphs in text, whitespace trimmed."""
+    start = 0
+    for match in _SEGMENT_BOUNDARY.finditer(text):
+        yield from _trimmed_span(text, start, match.start())
+        start = match.end()
+    yield from _trimmed_span(text, start, len(text))
+
+def _trimmed_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        yield start, end
+
+def _chunk_token_budget(chunk_size):
+    """Largest chunk (in tokens) the encoder will embed without truncating, minus special tokens."""
+    model_limit = get_model().max_seq_length - 2
+    return max(1, min(chunk_size, model_limit) if chunk_size > 0 else model_limit)
+
+def chunk_text_spans(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Token-budget chunker aligned with the embedding model's tokenizer.
+    Sentences and paragraphs are packed whole until the next one would exceed the
+    model's max sequence length; a sentence that alone is too long is split on token
+    boundaries. Up to `overlap` tokens of trailing whole sentences repeat in the next chunk.
+    Returns dicts with text, char_start, char_end and tokens.
+    """
+    spans = list(_segment_spans(text))
+    if not spans:
         return []
-    embeddings = model.encode([text])
-    return embeddings[0].tolist()
+    budget = _chunk_token_budget(chunk_size)
+    tokenizer = get_model().tokenizer
+    
+    # Count every segment in one batched tokenizer call; split the oversized ones
+    counts = [len(ids) for ids in tokenizer([text[s:e] for s, e in spans], add_special_tokens=False)["input_ids"]]
+    segments = []
+    for (start, end), count in zip(spans, counts):
+        if count <= budget:
+            segments.append((start, end, count))
+            continue
+        offsets = tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        for i in range(0, len(offsets), budget):
+            window = offsets[i:i + budget]
+            segments.append((start + window[0][0], start + window[-1][1], len(window)))
+    
+    chunks = []
+    current = []
+    current_tokens = 0
+    for segment in segments:
+        if current and current_tokens + segment[2] > budget:
+            chunks.append(current)
+            # Carry trailing whole segments forward as overlap
+            carried = []
+            carried_tokens = 0
+            for prev in reversed(current):
+                if carried_tokens + prev[2] > overlap or carried_tokens + prev[2] + segment[2] > budget:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev[2]
+            current, current_tokens = carried, carried_tokens
+        current.append(segment)
+        current_tokens += segment[2]
+    if current:
+        chunks.append(current)
+    
+    return [
+        {
+            "text": text[group[0][0]:group[-1][1]],
+            "char_start": group[0][0],
+            "char_end": group[-1][1],
+            "tokens": sum(seg[2] for seg in group),
+        }
+        for group in chunks
+    ]
 
 def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     """
     Splits long text into manageable chunks before generating embeddings.
-    Allows for overlapping windows to preserve context.
+    Chunks fit the embedding model's token limit; see chunk_text_spans() for offsets.
     """
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), max(1, chunk_size - overlap)):
-        chunk = " ".join(words[i:i + chunk_size])
-        if chunk.strip():
-            chunks.append(chunk)
-    return chunks
+    return [chunk["text"] for chunk in chunk_text_spans(text, chunk_size, overlap)]
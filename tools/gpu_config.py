@@ -2,11 +2,13 @@
 GPU Configuration & Auto-Detection Module
 Automatically detects NVIDIA GPU and configures optimal settings
 for llama-cpp-python CUDA acceleration.
+Detection runs on first use (not at import) so bot startup stays fast.
 """
 
 import os
 import subprocess
 import logging
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -86,6 +88,8 @@ def get_gpu_config():
             - n_gpu_layers (int): Number of layers to offload (-1 = all)
             - gpu_info (dict|None): GPU hardware details
             - cuda_version (str|None): CUDA toolkit version
+        get_cached_gpu_config() adds cpu_tuning (dict|None), the autotuned
+        n_threads / n_batch / n_ctx profile (see autotune_tools).
     """
     # Force CPU mode
     if USE_GPU == "false":
@@ -132,13 +136,37 @@ def get_gpu_config():
     }
 
 
-# Cache the config at module load time
-GPU_CONFIG = get_gpu_config()
+_gpu_config = None
+_gpu_config_lock = threading.Lock()
+
+
+def get_cached_gpu_config():
+    """Runs GPU detection once (shelling out to nvidia-smi/nvcc) and caches the result."""
+    global _gpu_config
+    with _gpu_config_lock:
+        if _gpu_config is None:
+            _gpu_config = get_gpu_config()
+            if _gpu_config["use_gpu"] and _gpu_config["gpu_info"]:
+                gpu_name = _gpu_config["gpu_info"]["name"]
+                logger.info(f"GPU Acceleration: ON ({gpu_name}, {_gpu_config['n_gpu_layers']} layers)")
+            else:
+                logger.info("GPU Acceleration: OFF (CPU mode)")
+        config = _gpu_config
+    # The CPU tuning profile may only appear later (first-run autotune), so it is looked up per call
+    from tools.autotune_tools import active_profile
+    return {**config, "cpu_tuning": active_profile()}
+
+
+def __getattr__(name):
+    # Keeps `from tools.gpu_config import GPU_CONFIG` working while detection stays lazy
+    if name == "GPU_CONFIG":
+        return get_cached_gpu_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def print_gpu_status():
     """Prints a human-readable GPU status report."""
-    config = GPU_CONFIG
+    config = get_cached_gpu_config()
     print("\n" + "=" * 60)
     print("  GPU CONFIGURATION STATUS")
     print("=" * 60)
@@ -167,15 +195,16 @@ def print_gpu_status():
         print(f"     1. Install NVIDIA CUDA Toolkit 12.x")
         print(f"     2. Run: setup_gpu.bat")
         print(f"     3. Set USE_GPU=true in .env (optional)")
+
+    from tools.autotune_tools import LLM_AUTOTUNE, format_profile
+    tuning = config["cpu_tuning"]
+    if tuning:
+        print(f"\n  [+] CPU tuning: {format_profile(tuning)}")
+        print(f"     Tuned {tuning['tuned_at']} for {tuning['n_gpu_layers']} GPU layers")
+    elif LLM_AUTOTUNE == "off":
+        print(f"\n  [-] CPU tuning: off (LLM_AUTOTUNE=off), using defaults")
+    else:
+        print(f"\n  [~] CPU tuning: not tuned yet, runs during warm-up (or: python -m tools.autotune_tools)")
     
     print("=" * 60 + "\n")
 
-
-# Print status on import during startup
-if __name__ != "__main__":
-    # Only log a concise message when imported as a module  
-    if GPU_CONFIG["use_gpu"] and GPU_CONFIG["gpu_info"]:
-        gpu_name = GPU_CONFIG["gpu_info"]["name"]
-        logger.info(f"GPU Acceleration: ON ({gpu_name}, {GPU_CONFIG['n_gpu_layers']} layers)")
-    else:
-        logger.info("GPU Acceleration: OFF (CPU mode)")
@@ -1,4 +1,16 @@
-from PIL import Image
+import io
+import os
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+load_dotenv()
+
+# LLaVA 1.5's CLIP encoder sees 336x336, so the shorter side never needs to be larger
+VISION_IMAGE_SIZE = int(os.getenv("VISION_IMAGE_SIZE", 336))
+# Tesseract input is scaled into this range (longest side, px) and tagged as OCR_DPI
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", 2500))
+OCR_MIN_SIDE = int(os.getenv("OCR_MIN_SIDE", 1000))
+OCR_DPI = int(os.getenv("OCR_DPI", 300))
 
 def load_image(file_path):
     """Loads an image and returns basic properties."""
@@ -12,3 +24,95 @@ def load_image(file_path):
         }
     except Exception as e:
         return {"error": str(e)}
+
+def perceptual_hash(image, hash_size=8):
+    """
+    Difference hash (dHash) of an image as a 16-char hex string. Re-encoded or
+    resized copies of the same picture land within a few bits of each other.
+    Accepts a file path or an already opened PIL image.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    # One extra column so each row yields hash_size left/right comparisons
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def _otsu_threshold(gray):
+    """Otsu's global threshold for an 8-bit grayscale image."""
+    hist = gray.histogram()
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    weight_b = sum_b = 0
+    best_between, threshold = 0.0, 127
+    for t, count in enumerate(hist):
+        weight_b += count
+        if not weight_b:
+            continue
+        weight_f = total - weight_b
+        if not weight_f:
+            break
+        sum_b += t * count
+        mean_b = sum_b / weight_b
+        mean_f = (sum_all - sum_b) / weight_f
+        between = weight_b * weight_f * (mean_b - mean_f) ** 2
+        if between > best_between:
+            best_between, threshold = between, t
+    return threshold
+
+
+class PreparedImage:
+    """
+    One decode of an uploaded image, shared by dedup hashing, OCR and vision.
+    JPEGs are decoded at a reduced scale when even OCR doesn't need full resolution,
+    and EXIF rotation is applied once. Derived buffers stay in memory.
+    """
+
+    def __init__(self, file_path, max_side=OCR_MAX_SIDE):
+        image = Image.open(file_path)
+        # JPEG DCT scaling: decode a 4000px phone photo at 1/2 or 1/4 size for free
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        self.image = image.convert("RGB")
+        self._phash = None
+
+    @property
+    def phash(self):
+        if self._phash is None:
+            self._phash = perceptual_hash(self.image)
+        return self._phash
+
+    def vision_jpeg(self, size=VISION_IMAGE_SIZE, quality=90):
+        """Small RGB JPEG for the vision model: shorter side `size` px (never upscaled)."""
+        image = self.image
+        scale = size / min(image.size)
+        if scale < 1:
+            # reducing_gap: box-reduce first, LANCZOS only for the last step
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                 Image.LANCZOS, reducing_gap=3.0)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def ocr_image(self, min_side=OCR_MIN_SIDE, max_side=OCR_MAX_SIDE, dpi=OCR_DPI):
+        """Grayscale, contrast-stretched, Otsu-binarized image sized for Tesseract, tagged with `dpi`."""
+        gray = ImageOps.autocontrast(self.image.convert("L"), cutoff=1)
+        longest = max(gray.size)
+        scale = max_side / longest if longest > max_side else (min(2.0, min_side / longest) if longest < min_side else 1.0)
+        if scale != 1.0:
+            gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))),
+                               Image.LANCZOS, reducing_gap=3.0)
+        threshold = _otsu_threshold(gray)
+        binary = gray.point(lambda v: 255 if v > threshold else 0)
+        binary.info["dpi"] = (dpi, dpi)
+        return binary
+
+    def close(self):
+        self.image.close()
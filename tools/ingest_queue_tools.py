@@ -0,0 +1,275 @@
+"""
+Ingest Queue Module
+Durable SQLite queue for file uploads. A fixed pool of INGEST_WORKERS threads
+runs the ingest pipeline, so a burst of uploads waits in line instead of
+competing for CPU and memory. Each job keeps its state, latest progress and
+result together with the Telegram chat/message it reports to; jobs that were
+running when the process died are cleaned up and re-run on the next start.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+INGEST_DB_PATH = os.getenv("INGEST_DB_PATH", "ingest_jobs.db")
+# Uploads processed at the same time
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+# Finished jobs kept for /jobs
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", 200))
+# Delay before retrying a job whose model queue was full
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", 30))
+# A job interrupted this many times is failed instead of resumed again
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3))
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+
+STATE_QUEUED, STATE_RUNNING, STATE_DONE, STATE_FAILED, STATE_CANCELLED = (
+    "queued", "running", "done", "failed", "cancelled")
+_FINISHED = (STATE_DONE, STATE_FAILED, STATE_CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised by IngestQueue.checkpoint in a job that was cancelled while running."""
+
+
+class IngestQueue:
+    """
+    handler(job, report, relocate) runs one job and returns its result text. report(text)
+    records progress; relocate(path, name) records that the pipeline renamed the file, so
+    a resume after a crash cleans up and re-reads the right one. recover(job) undoes
+    whatever a crashed run left behind (partial chunks, catalog entry) before it re-runs,
+    and what a failed or cancelled run left behind before it is finished. Handlers call
+    checkpoint(job) between stages and batches, so a cancelled job stops there.
+    notifier(job, text, final) is called on progress and completion. Exceptions listed
+    in retry_on put the job back in the queue for INGEST_RETRY_DELAY seconds.
+    """
+
+    def __init__(self, handler, recover=None, retry_on=(), db_path=INGEST_DB_PATH, workers=INGEST_WORKERS):
+        self.handler = handler
+        self.recover = recover
+        self.retry_on = tuple(retry_on)
+        self.workers = workers
+        self.notifier = None
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._db = sqlite3.connect(os.path.join(PROJECT_DIR, db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, message_id INTEGER, "
+                "file_path TEXT NOT NULL, file_name TEXT NOT NULL, file_type TEXT, sha256 TEXT, unique_id TEXT, "
+                "state TEXT NOT NULL, progress TEXT, result TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "not_before REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_chat ON jobs (chat_id, id)")
+
+    def _update(self, job_id, **fields):
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                             (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def submit(self, file_path, file_name, file_type, chat_id=None, message_id=None, sha256=None, unique_id=None):
+        """Queues an upload. Returns (job id, number of jobs ahead of it)."""
+        with self._wakeup, self._db:
+            job_id = self._db.execute(
+                "INSERT INTO jobs (chat_id, message_id, file_path, file_name, file_type, sha256, unique_id, "
+                "state, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, message_id, file_path, file_name, file_type, sha256, unique_id, STATE_QUEUED, time.time())
+            ).lastrowid
+            ahead = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE id < ? AND state IN (?, ?)", (job_id, STATE_QUEUED, STATE_RUNNING)
+            ).fetchone()[0]
+            self._wakeup.notify()
+        return job_id, ahead
+
+    def start(self):
+        """Recovers jobs interrupted by a crash or restart, then starts the workers."""
+        if self._threads:
+            return
+        with self._lock:
+            interrupted = [dict(r) for r in self._db.execute(
+                "SELECT * FROM jobs WHERE state = ? ORDER BY id", (STATE_RUNNING,)).fetchall()]
+        for job in interrupted:
+            self._resume(job)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _resume(self, job):
+        if job["attempts"] >= INGEST_MAX_ATTEMPTS:
+            self._finish(job, STATE_FAILED, f"Gave up on '{job['file_name']}' after {job['attempts']} interrupted attempts.")
+            return
+        if not os.path.exists(job["file_path"]):
+            self._finish(job, STATE_FAILED, f"'{job['file_name']}' was lost during a restart, please send it again.")
+            return
+        try:
+            if self.recover:
+                self.recover(job)
+        except Exception as e:
+            logger.warning(f"Could not clean up interrupted ingest job {job['id']}: {e}")
+        logger.info(f"Resuming ingest job {job['id']} ('{job['file_name']}')")
+        self._update(job["id"], state=STATE_QUEUED, progress="Resuming after restart...")
+        self._notify(job, f"Resuming '{job['file_name']}' after a restart...", final=False)
+
+    def _claim(self):
+        """Blocks until a queued job is due, marks it running and returns it."""
+        with self._wakeup:
+            while True:
+                now = time.time()
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE state = ? AND not_before <= ? ORDER BY id LIMIT 1",
+                    (STATE_QUEUED, now)
+                ).fetchone()
+                if row:
+                    with self._db:
+                        self._db.execute(
+                            "UPDATE jobs SET state = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                            (STATE_RUNNING, now, row["id"])
+                        )
+                    return dict(row, state=STATE_RUNNING, attempts=row["attempts"] + 1)
+                delayed = self._db.execute(
+                    "SELECT MIN(not_before) FROM jobs WHERE state = ?", (STATE_QUEUED,)).fetchone()[0]
+                self._wakeup.wait(timeout=max(0.1, delayed - now) if delayed else None)
+
+    def _work(self):
+        while True:
+            job = self._claim()
+
+            def report(text, job=job):
+                self._update(job["id"], progress=text)
+                self._notify(job, text, final=False)
+
+            def relocate(path, name, job=job):
+                job["file_path"], job["file_name"] = path, name
+                self._update(job["id"], file_path=path, file_name=name)
+
+            try:
+                result = self.handler(job, report, relocate)
+                # Cancelled after its last checkpoint: what it wrote is undone all the same
+                self.checkpoint(job)
+            except JobCancelled:
+                logger.info(f"Ingest job {job['id']} cancelled while running")
+                self._recover_finished(job)
+                self._finish(job, STATE_CANCELLED, "Cancelled.")
+                continue
+            except self.retry_on:
+                if self._is_cancelled(job):
+                    self._recover_finished(job)
+                    self._finish(job, STATE_CANCELLED, "Cancelled.")
+                    continue
+                logger.info(f"Ingest job {job['id']} deferred: model queue full")
+                with self._wakeup:
+                    with self._db:
+                        self._db.execute(
+                            "UPDATE jobs SET state = ?, not_before = ?, attempts = attempts - 1 WHERE id = ?",
+                            (STATE_QUEUED, time.time() + INGEST_RETRY_DELAY, job["id"])
+                        )
+                    self._wakeup.notify()
+                self._notify(job, f"Busy right now, '{job['file_name']}' will be retried shortly...", final=False)
+                continue
+            except Exception as e:
+                self._recover_finished(job)
+                if self._is_cancelled(job):
+                    # Typically its file was deleted from under it by the wipe that cancelled it
+                    self._finish(job, STATE_CANCELLED, "Cancelled.")
+                    continue
+                logger.exception(f"Ingest job {job['id']} failed")
+                self._finish(job, STATE_FAILED, f"Error during orchestrator file handling: {e}")
+                continue
+            self._finish(job, STATE_DONE, result)
+
+    def _recover_finished(self, job):
+        try:
+            if self.recover:
+                self.recover(job)
+        except Exception as e:
+            logger.warning(f"Could not clean up ingest job {job['id']}: {e}")
+
+    def _is_cancelled(self, job):
+        with self._lock:
+            return job["id"] in self._cancelled
+
+    def checkpoint(self, job):
+        """Raises JobCancelled if the job was cancelled while running."""
+        if self._is_cancelled(job):
+            raise JobCancelled(f"Ingest job {job['id']} was cancelled")
+
+    def _finish(self, job, state, result):
+        with self._lock, self._db:
+            self._cancelled.discard(job["id"])
+            self._db.execute("UPDATE jobs SET state = ?, result = ?, finished_at = ? WHERE id = ?",
+                             (state, result, time.time(), job["id"]))
+            self._db.execute(
+                f"DELETE FROM jobs WHERE state IN ({', '.join('?' * len(_FINISHED))}) AND id NOT IN "
+                f"(SELECT id FROM jobs WHERE state IN ({', '.join('?' * len(_FINISHED))}) ORDER BY id DESC LIMIT ?)",
+                (*_FINISHED, *_FINISHED, INGEST_JOB_HISTORY)
+            )
+        self._notify(job, result, final=True)
+
+    def _notify(self, job, text, final):
+        if self.notifier is None:
+            return
+        try:
+            self.notifier(job, text, final)
+        except Exception as e:
+            logger.warning(f"Ingest job {job['id']} notification failed: {e}")
+
+    def cancel(self, chat_id=None):
+        """
+        Cancels queued and running jobs (for one chat, or all). Running jobs stop at their
+        next checkpoint and are cleaned up by recover; every cancelled job gets a final
+        "Cancelled." notification. Returns how many were cancelled.
+        """
+        query, params = "SELECT * FROM jobs WHERE state IN (?, ?)", [STATE_QUEUED, STATE_RUNNING]
+        if chat_id is not None:
+            query += " AND chat_id = ?"
+            params.append(chat_id)
+        with self._lock, self._db:
+            jobs = [dict(row) for row in self._db.execute(query, params).fetchall()]
+            queued = [job for job in jobs if job["state"] == STATE_QUEUED]
+            # Running jobs are marked too, so a crash before their checkpoint does not resume them
+            self._db.executemany("UPDATE jobs SET state = ?, result = ?, finished_at = ? WHERE id = ?",
+                                 [(STATE_CANCELLED, "Cancelled.", time.time(), job["id"]) for job in jobs])
+            self._cancelled.update(job["id"] for job in jobs if job["state"] == STATE_RUNNING)
+        for job in queued:
+            self._notify(job, "Cancelled.", final=True)
+        return len(jobs)
+
+    def active_files(self):
+        """Names of the files whose jobs are queued or running."""
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT file_name FROM jobs WHERE state IN (?, ?)", (STATE_QUEUED, STATE_RUNNING)).fetchall()]
+
+    def list_jobs(self, chat_id=None, limit=10):
+        """Newest jobs first, optionally only one chat's."""
+        query, params = "SELECT * FROM jobs", []
+        if chat_id is not None:
+            query += " WHERE chat_id = ?"
+            params.append(chat_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, params).fetchall()]
+
+    def counts(self):
+        """Number of jobs per state."""
+        with self._lock:
+            return {row[0]: row[1] for row in
+                    self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()}
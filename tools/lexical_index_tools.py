@@ -0,0 +1,118 @@
+"""
+Lexical Index Module
+In-process BM25 inverted index over the stored chunks. It lets queries that name
+a file, an ID or an exact phrase match without an embedding, and supplies the
+lexical half of hybrid (BM25 + vector) retrieval.
+"""
+
+import re
+import math
+import threading
+from collections import defaultdict
+
+# Words plus dotted/underscored/dashed compounds, so "notes_v2.txt" and "INV-2041" survive whole
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+_PART_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercased terms; compounds are indexed whole and as their parts."""
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        term = match.group(0)
+        terms.append(term)
+        parts = _PART_PATTERN.findall(term)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over chunk ids, with per-source bookkeeping for deletes."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)   # term -> {doc_id: term frequency}
+        self._doc_terms = {}                 # doc_id -> its distinct terms
+        self._doc_len = {}
+        self._total_len = 0
+        self._by_source = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, doc_id, text, source=None):
+        """Indexes a chunk. The source file name is indexed with it so file names match."""
+        terms = tokenize(text)
+        if source:
+            terms.extend(tokenize(source))
+        counts = defaultdict(int)
+        for term in terms:
+            counts[term] += 1
+
+        with self._lock:
+            if doc_id in self._doc_len:
+                self._remove(doc_id)
+            for term, tf in counts.items():
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = tuple(counts)
+            self._doc_len[doc_id] = len(terms)
+            self._total_len += len(terms)
+            if source:
+                self._by_source[source].add(doc_id)
+
+    def _remove(self, doc_id):
+        # Caller holds self._lock
+        for term in self._doc_terms.pop(doc_id, {}):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+
+    def remove_source(self, source):
+        """Drops every chunk of a source file. Returns how many were removed."""
+        with self._lock:
+            doc_ids = self._by_source.pop(source, set())
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+            return len(doc_ids)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._by_source.clear()
+            self._total_len = 0
+
+    def search(self, query, n_results=10):
+        """Returns up to n_results (doc_id, score) pairs, best first."""
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        with self._lock:
+            doc_count = len(self._doc_len)
+            if not doc_count or not terms:
+                return []
+            avg_len = self._total_len / doc_count
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merges ranked id lists: score(id) = sum of 1 / (k + rank). Returns ids, best first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
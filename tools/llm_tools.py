@@ -1,54 +1,267 @@
 import os
+import time
+import threading
 from dotenv import load_dotenv
-from huggingface_hub import hf_hub_download
-from llama_cpp import Llama
-from tools.gpu_config import GPU_CONFIG
+from tools.gpu_config import get_cached_gpu_config
+from tools.scheduler_tools import InferenceScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from tools.metrics_tools import METRICS
+from tools.model_manager_tools import MODELS, estimate_footprint_mb
+from tools.speculative_tools import (SPECULATIVE_MODE, DRAFT_HF_FILENAME, build_draft_model,
+                                     draft_counters, record_speculation, logits_buffer_mb)
+from tools.llm_worker_tools import LLM_WORKER_PROCESSES
+from tools.autotune_tools import LLM_AUTOTUNE, load_profile, tune_llm, active_profile, set_active_profile
 
 load_dotenv()
 
 HF_REPO_ID = os.getenv("HF_REPO_ID", "Qwen/Qwen2.5-3B-Instruct-GGUF")
 HF_FILENAME = os.getenv("HF_FILENAME", "qwen2.5-3b-instruct-q4_k_m.gguf")
 MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.getcwd(), "models"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 16))
+# Tokens reserved for the reply; also the max_tokens cap of every completion
+CTX_BUDGET_GENERATION = int(os.getenv("CTX_BUDGET_GENERATION", 384))
 
-_llm_instance = None
+# Autotuned settings for this host and model (just a JSON lookup); explicit env values win
+_PROFILE = load_profile(os.path.join(MODEL_DIR, HF_FILENAME)) or {}
+set_active_profile(_PROFILE or None)
+LLM_N_CTX = int(os.getenv("LLM_N_CTX") or _PROFILE.get("n_ctx") or 2048)
+# CPU threads of the in-process chat model (worker processes split the cores instead)
+LLM_THREADS = int(os.getenv("LLM_THREADS") or _PROFILE.get("n_threads") or 8)
+# Prompt tokens evaluated per llama.cpp batch
+LLM_N_BATCH = int(os.getenv("LLM_N_BATCH") or _PROFILE.get("n_batch") or 512)
+
+# Rough chars-per-token used until the GGUF tokenizer is loaded
+_FALLBACK_CHARS_PER_TOKEN = 3
+
+# Footprint hints for the model manager: Qwen 2.5 3B has 36 layers, ~2.2 GB at Q4_K_M;
+# KV cache and compute buffers at n_ctx=2048 add a few hundred MB
+LLM_N_LAYERS = 36
+LLM_OVERHEAD_MB = 300
+# Qwen 2.5 vocabulary size, for the all-positions logits buffer speculative decoding needs
+LLM_N_VOCAB = 151936
+
+# The chat model is only ever touched from this scheduler's worker threads: one, or one
+# per process when LLM_WORKER_PROCESSES is set (each thread then owns a worker process)
+LLM_SCHEDULER = InferenceScheduler("llm", max_queue=LLM_QUEUE_SIZE, workers=max(1, LLM_WORKER_PROCESSES))
+
+def _model_path():
+    # Heavy imports are deferred until the model is actually needed
+    from huggingface_hub import hf_hub_download
+
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    print(f"Ensuring model {HF_FILENAME} is downloaded to {MODEL_DIR}...")
+    return hf_hub_download(
+        repo_id=HF_REPO_ID,
+        filename=HF_FILENAME,
+        local_dir=MODEL_DIR,
+        local_dir_use_symlinks=False
+    )
+
+# Held while autotune() benchmarks; model loads never wait for it
+_tuning_lock = threading.Lock()
+
+def autotune(force=False):
+    """
+    Benchmarks llama.cpp settings for this host and model unless a matching profile is cached
+    (or LLM_AUTOTUNE=off). Only runs from warm-up or `python -m tools.autotune_tools`, never on
+    a user request: it reloads the model a dozen times and takes minutes.
+    """
+    with _tuning_lock:
+        profile = active_profile() or {}
+        n_gpu_layers = get_cached_gpu_config()["n_gpu_layers"]
+        if not force and (LLM_AUTOTUNE == "off" or (profile and profile.get("n_gpu_layers") == n_gpu_layers)):
+            return profile
+        try:
+            profile = tune_llm(_model_path(), n_gpu_layers, reserved_tokens=CTX_BUDGET_GENERATION)
+        except Exception as e:
+            print(f"Autotune failed, keeping defaults: {e}")
+            return profile
+        set_active_profile(profile)
+        if not os.getenv("LLM_N_CTX") and profile["n_ctx"] != LLM_N_CTX:
+            # Prompt budgets were sized at import time
+            print(f"Tuned n_ctx {profile['n_ctx']} takes effect on the next start")
+        return profile
+
+def _tuned_profile(n_gpu_layers):
+    """
+    The tuning profile to load with: the cached or just-tuned one if it matches the GPU setup,
+    else {}. Does not wait for a tuning run in progress; its result applies from the next load.
+    """
+    profile = active_profile() or {}
+    if _tuning_lock.locked() and not profile:
+        print("Autotune still running, loading with defaults; the tuned settings apply from the next load")
+        return {}
+    if profile and profile.get("n_gpu_layers") != n_gpu_layers:
+        print("Autotune profile was made for another GPU layer count, using defaults until warm-up retunes")
+        return {}
+    if not profile and LLM_AUTOTUNE != "off":
+        print("No autotune profile yet, using defaults (warm-up or `python -m tools.autotune_tools` creates one)")
+    return profile
+
+def _load_llm(n_threads=None, worker_index=None):
+    """Loads the chat model; worker processes pass their share of the cores as n_threads and their index."""
+    from llama_cpp import Llama
+    from tools.prompt_cache_tools import build_prompt_cache
+    
+    model_path = _model_path()
+    gpu_config = get_cached_gpu_config()
+    n_gpu_layers = gpu_config["n_gpu_layers"]
+    if n_threads is None:
+        profile = _tuned_profile(n_gpu_layers)
+        n_threads = int(os.getenv("LLM_THREADS") or profile.get("n_threads") or LLM_THREADS)
+        n_threads_batch = int(os.getenv("LLM_THREADS") or profile.get("n_threads_batch") or n_threads)
+        n_batch = int(os.getenv("LLM_N_BATCH") or profile.get("n_batch") or LLM_N_BATCH)
+    else:
+        n_threads_batch, n_batch = n_threads, LLM_N_BATCH
+    mode = "GPU" if gpu_config["use_gpu"] else "CPU"
+    print(f"Model downloaded/found. Initializing local LLaMA model ({mode} mode, {n_gpu_layers} GPU layers, "
+          f"{n_threads} threads, n_batch {n_batch}, n_ctx {LLM_N_CTX})...")
+    
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=LLM_N_CTX,   # Smaller context = faster inference
+        n_threads=n_threads,  # Threads for CPU-bound operations
+        n_threads_batch=n_threads_batch,  # Threads for prompt evaluation
+        n_batch=n_batch,
+        n_gpu_layers=n_gpu_layers,  # Dynamic: -1 (all GPU), 0 (CPU), or partial
+        draft_model=build_draft_model(LLM_N_CTX, MODEL_DIR, n_threads),  # None unless SPECULATIVE_MODE is set
+        verbose=False
+    )
+    
+    # Reuse evaluated prompt prefixes (persona + history) across turns and chats
+    prompt_cache = build_prompt_cache(worker_index)
+    if prompt_cache is not None:
+        if llm.draft_model is not None:
+            print(f"Note: with SPECULATIVE_MODE={SPECULATIVE_MODE} every cached prompt state also stores "
+                  f"~{LLM_N_VOCAB * 4 / (1024 * 1024):.1f} MB of logits per prompt token, so LLM_CACHE_RAM_MB "
+                  f"holds far fewer states")
+        llm.set_cache(prompt_cache)
+    return llm
+
+def _load_llm_pool():
+    from tools.llm_worker_tools import LlamaWorkerPool
+
+    # Download once here so the worker processes do not race on it; they read the saved
+    # autotune profile when they import this module
+    model_path = _model_path()
+    if get_cached_gpu_config()["use_gpu"]:
+        print(f"Warning: each of the {LLM_WORKER_PROCESSES} LLM worker processes offloads its own copy to the GPU")
+    print(f"Starting {LLM_WORKER_PROCESSES} LLM worker processes...")
+    return LlamaWorkerPool(model_path, LLM_WORKER_PROCESSES)
+
+def _llm_footprint():
+    ram_mb, vram_mb = estimate_footprint_mb([os.path.join(MODEL_DIR, HF_FILENAME)], get_cached_gpu_config()["n_gpu_layers"],
+                                            LLM_N_LAYERS, extra_mb=LLM_OVERHEAD_MB, fallback_mb=2200)
+    if SPECULATIVE_MODE == "draft":
+        # The draft model always runs on CPU
+        draft_ram_mb, _ = estimate_footprint_mb([os.path.join(MODEL_DIR, DRAFT_HF_FILENAME)], 0, 1,
+                                                extra_mb=100, fallback_mb=400)
+        ram_mb += draft_ram_mb
+    # Speculative decoding makes llama.cpp keep logits for every position (logits_all)
+    ram_mb += logits_buffer_mb(LLM_N_CTX, LLM_N_VOCAB)
+    if LLM_WORKER_PROCESSES:
+        # Worker processes share the mmap'd weights; KV cache, buffers, the logits buffer and
+        # the prompt state cache are per process
+        from tools.prompt_cache_tools import LLM_CACHE_RAM_MB
+        per_process_mb = LLM_OVERHEAD_MB + max(0, LLM_CACHE_RAM_MB) + logits_buffer_mb(LLM_N_CTX, LLM_N_VOCAB)
+        ram_mb += (LLM_WORKER_PROCESSES - 1) * per_process_mb
+        vram_mb *= LLM_WORKER_PROCESSES
+    return ram_mb, vram_mb
+
+# Pinned: the chat model is never evicted, photos make room by unloading other models
+MODELS.register("chat", _load_llm_pool if LLM_WORKER_PROCESSES else _load_llm,
+                footprint=_llm_footprint, pinned=True)
 
 def get_llm():
-    global _llm_instance
-    if _llm_instance is None:
-        os.makedirs(MODEL_DIR, exist_ok=True)
-        print(f"Ensuring model {HF_FILENAME} is downloaded to {MODEL_DIR}...")
-        model_path = hf_hub_download(
-            repo_id=HF_REPO_ID,
-            filename=HF_FILENAME,
-            local_dir=MODEL_DIR,
-            local_dir_use_symlinks=False
-        )
-        
-        n_gpu_layers = GPU_CONFIG["n_gpu_layers"]
-        mode = "GPU" if GPU_CONFIG["use_gpu"] else "CPU"
-        print(f"Model downloaded/found. Initializing local LLaMA model ({mode} mode, {n_gpu_layers} GPU layers)...")
-        
-        _llm_instance = Llama(
-            model_path=model_path,
-            n_ctx=2048,        # Smaller context = faster inference
-            n_threads=8,       # Threads for CPU-bound operations
-            n_gpu_layers=n_gpu_layers,  # Dynamic: -1 (all GPU), 0 (CPU), or partial
-            verbose=False
-        )
-    return _llm_instance
+    return MODELS.get("chat")
+
+def count_tokens(text):
+    """
+    Counts tokens with the GGUF tokenizer. Tokenizing only reads the model vocab, so it is
+    safe outside the scheduler worker. Before the model is loaded a conservative
+    character-based estimate is used rather than forcing a load on this thread.
+    """
+    if not text:
+        return 0
+    llm = MODELS.peek("chat")
+    if llm is None:
+        return -(-len(text) // _FALLBACK_CHARS_PER_TOKEN)
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
 
-def query_llm(messages, model=None):
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text down to at most max_tokens tokens, keeping the beginning."""
+    if max_tokens <= 0 or not text:
+        return ""
+    llm = MODELS.peek("chat")
+    if llm is None:
+        return text[:max_tokens * _FALLBACK_CHARS_PER_TOKEN]
+    tokens = llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+    if len(tokens) <= max_tokens:
+        return text
+    return llm.detokenize(tokens[:max_tokens]).decode("utf-8", errors="ignore")
+
+def warm_up():
+    """Autotunes on first run, then loads the chat model on its owning scheduler worker, ahead of the first message."""
+    autotune(force=LLM_AUTOTUNE == "force")
+    LLM_SCHEDULER.run(get_llm, priority=PRIORITY_BACKGROUND)
+
+def query_llm(messages, model=None, stream=False, priority=PRIORITY_INTERACTIVE, user_id=None):
     """
     Communicates with the local LLM via llama-cpp-python.
     `messages` should be a list of dicts: {"role": "system|user|assistant", "content": "..."}
+    With stream=True a generator is returned that yields text tokens as they are decoded.
+    Requests are queued on LLM_SCHEDULER; SchedulerBusyError is raised when it is full.
     """
+    if stream:
+        return LLM_SCHEDULER.stream(_stream_llm, messages, priority=priority, user_id=user_id)
+    return LLM_SCHEDULER.run(_complete_llm, messages, priority=priority, user_id=user_id)
+
+def _complete_llm(messages):
+    """Runs a blocking chat completion. Must only be called from the scheduler worker."""
     try:
         llm = get_llm()
         # Create chat completion
+        drafts_before = draft_counters(llm)
+        started = time.perf_counter()
         response = llm.create_chat_completion(
             messages=messages,
+            max_tokens=CTX_BUDGET_GENERATION,
             stream=False
         )
+        seconds = time.perf_counter() - started
+        usage = response.get("usage") or {}
+        completion_tokens = usage.get("completion_tokens", 0)
+        record_speculation(drafts_before, draft_counters(llm), completion_tokens)
+        METRICS.record("llm.completion", seconds, prompt_tokens=usage.get("prompt_tokens", 0),
+                       completion_tokens=completion_tokens,
+                       tokens_per_sec=completion_tokens / seconds if seconds > 0 else 0.0)
         return response['choices'][0]['message']['content'].strip()
     except Exception as e:
         return f"LLM Connection Error: {str(e)}\nFailed to load or query the local model."
+
+def _stream_llm(messages):
+    """Yields completion tokens one delta at a time. Must only be called from the scheduler worker."""
+    try:
+        llm = get_llm()
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        drafts_before = draft_counters(llm)
+        started = time.perf_counter()
+        first_token_at = None
+        generated = 0
+        try:
+            for chunk in llm.create_chat_completion(messages=messages, max_tokens=CTX_BUDGET_GENERATION, stream=True):
+                token = chunk['choices'][0]['delta'].get('content')
+                if token:
+                    if first_token_at is None:
+                        # Time to first token is dominated by prompt evaluation
+                        first_token_at = time.perf_counter()
+                        METRICS.record("llm.prompt_eval", first_token_at - started, prompt_tokens=prompt_tokens)
+                    generated += 1
+                    yield token
+        finally:
+            if first_token_at is not None:
+                seconds = time.perf_counter() - first_token_at
+                record_speculation(drafts_before, draft_counters(llm), generated)
+                METRICS.record("llm.generate", seconds, completion_tokens=generated,
+                               tokens_per_sec=generated / seconds if seconds > 0 else 0.0)
+    except Exception as e:
+        yield f"LLM Connection Error: {str(e)}\nFailed to load or query the local model."
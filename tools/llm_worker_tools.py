@@ -0,0 +1,305 @@
+"""
+LLM Worker Pool Module
+Optional out-of-process chat model for many-core hosts. LLM_WORKER_PROCESSES
+processes each load the same GGUF (llama.cpp mmaps it, so the weights are shared
+through the OS page cache) with their own slice of the CPU threads. Every LLM
+scheduler worker thread owns one process and talks to it over an authenticated
+local connection; processes send heartbeats, and a worker that exits or stops
+heartbeating is killed and restarted without affecting the bot.
+
+Run as `python -m tools.llm_worker_tools` only by LlamaWorkerPool.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Client, wait
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 0 = run the chat model inside the bot process (default)
+LLM_WORKER_PROCESSES = int(os.getenv("LLM_WORKER_PROCESSES", 0))
+# CPU threads per worker process (0 = cpu_count / LLM_WORKER_PROCESSES)
+LLM_WORKER_THREADS = int(os.getenv("LLM_WORKER_THREADS", 0))
+# Seconds without a heartbeat before a worker is considered hung and restarted
+LLM_WORKER_TIMEOUT = float(os.getenv("LLM_WORKER_TIMEOUT", 30))
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATE_STARTING, STATE_READY, STATE_BUSY = "starting", "ready", "busy"
+_HEARTBEAT_INTERVAL = 1.0
+_MAX_RESTART_BACKOFF = 60.0
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised to the caller when its worker process died mid-request."""
+
+
+class _WorkerHandle:
+    """One worker process, its request connection and its heartbeat connection."""
+
+    def __init__(self, index, n_threads):
+        self.index = index
+        self.n_threads = n_threads
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.hb_conn = None
+        self.state = STATE_STARTING
+        self.last_heartbeat = time.monotonic()
+        self.restarts = 0
+        self.requests = 0
+        # Speculative decoding (calls, drafted tokens) as of the last finished request
+        self.draft_counters = None
+        self.backoff = 1.0
+        self.next_restart_at = 0.0
+        self.start()
+
+    def start(self):
+        authkey = os.urandom(16)
+        env = dict(os.environ, LLM_WORKER_AUTHKEY=authkey.hex())
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get("PYTHONPATH")]))
+        # Same cwd as the bot so relative MODEL_DIR / cache paths resolve identically
+        process = subprocess.Popen(
+            [sys.executable, "-m", "tools.llm_worker_tools", "--threads", str(self.n_threads),
+             "--index", str(self.index)],
+            env=env, stdout=subprocess.PIPE, text=True
+        )
+        # The worker prints the port it listens on, then sends all further output to stderr
+        line = process.stdout.readline().strip()
+        if not line.isdigit():
+            process.kill()
+            raise WorkerCrashedError(f"LLM worker {self.index} failed to start")
+        address = ("127.0.0.1", int(line))
+        self.conn = Client(address, authkey=authkey)
+        self.hb_conn = Client(address, authkey=authkey)
+        process.stdout.close()
+        self.process = process
+        self.state = STATE_STARTING
+        self.last_heartbeat = time.monotonic()
+        logger.info(f"Started LLM worker {self.index} (pid {process.pid}, {self.n_threads} threads)")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        for conn in (self.conn, self.hb_conn):
+            if conn:
+                conn.close()
+        self.conn = self.hb_conn = None
+
+    def restart(self):
+        with self.lock:
+            self.stop()
+            self.restarts += 1
+            try:
+                self.start()
+                self.backoff = 1.0
+            except (WorkerCrashedError, OSError) as e:
+                logger.warning(f"Restarting LLM worker {self.index} failed: {e}")
+                self.next_restart_at = time.monotonic() + self.backoff
+                self.backoff = min(_MAX_RESTART_BACKOFF, self.backoff * 2)
+
+    def _recv(self, conn, process):
+        """Next message from the worker; raises WorkerCrashedError if it exits first."""
+        while not conn.poll(0.5):
+            if process.poll() is not None:
+                raise WorkerCrashedError(f"LLM worker {self.index} exited with code {process.returncode}")
+        try:
+            return conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashedError(f"LLM worker {self.index} connection lost: {e}") from e
+
+    def chat(self, messages, stream, kwargs):
+        with self.lock:
+            conn, process = self.conn, self.process
+            self.requests += 1
+        if conn is None:
+            raise WorkerCrashedError(f"LLM worker {self.index} is restarting")
+        try:
+            conn.send(("stream" if stream else "complete", messages, kwargs))
+        except OSError as e:
+            raise WorkerCrashedError(f"LLM worker {self.index} connection lost: {e}") from e
+        if stream:
+            return self._relay(conn, process)
+        kind, payload = self._recv(conn, process)
+        if kind == "error":
+            raise RuntimeError(payload)
+        response, self.draft_counters = payload
+        return response
+
+    def _relay(self, conn, process):
+        finished = False
+        try:
+            while True:
+                kind, payload = self._recv(conn, process)
+                if kind == "chunk":
+                    yield payload
+                    continue
+                finished = True
+                if kind == "error":
+                    raise RuntimeError(payload)
+                self.draft_counters = payload
+                return
+        finally:
+            if not finished:
+                # Consumer walked away: stop the generation and drain what is in flight
+                try:
+                    conn.send("cancel")
+                    kind, payload = self._recv(conn, process)
+                    while kind == "chunk":
+                        kind, payload = self._recv(conn, process)
+                    if kind == "done":
+                        self.draft_counters = payload
+                except (WorkerCrashedError, OSError):
+                    pass
+
+
+class LlamaWorkerPool:
+    """
+    Stands in for a Llama instance: create_chat_completion() runs on the worker process
+    owned by the calling scheduler thread, tokenize()/detokenize() use a local vocab-only
+    copy of the model.
+    """
+
+    def __init__(self, model_path, processes=LLM_WORKER_PROCESSES, threads_per_worker=LLM_WORKER_THREADS):
+        from llama_cpp import Llama
+
+        threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or processes) // processes)
+        self._vocab = Llama(model_path=model_path, vocab_only=True, verbose=False)
+        self._workers = [_WorkerHandle(i, threads_per_worker) for i in range(processes)]
+        self._unclaimed = list(self._workers)
+        self._claim_lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+        threading.Thread(target=self._monitor, name="llm-worker-monitor", daemon=True).start()
+
+    def _worker_for_thread(self):
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            with self._claim_lock:
+                if not self._unclaimed:
+                    raise RuntimeError("More LLM scheduler threads than worker processes")
+                worker = self._local.worker = self._unclaimed.pop(0)
+        return worker
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        return self._worker_for_thread().chat(messages, stream, kwargs)
+
+    def draft_counters(self):
+        """Speculative decoding counters of the calling thread's worker, relayed after each request."""
+        return self._worker_for_thread().draft_counters
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return self._vocab.tokenize(text, add_bos=add_bos, special=special)
+
+    def detokenize(self, tokens):
+        return self._vocab.detokenize(tokens)
+
+    def _monitor(self):
+        """Collects heartbeats and replaces workers that died or stopped responding."""
+        while not self._closed:
+            conns = {w.hb_conn: w for w in self._workers if w.hb_conn is not None}
+            for conn in wait(list(conns), timeout=_HEARTBEAT_INTERVAL):
+                worker = conns[conn]
+                try:
+                    while conn.poll():
+                        worker.state = conn.recv()
+                    worker.last_heartbeat = time.monotonic()
+                except (EOFError, OSError):
+                    pass
+            now = time.monotonic()
+            for worker in self._workers:
+                dead = worker.process is None or worker.process.poll() is not None
+                hung = now - worker.last_heartbeat > LLM_WORKER_TIMEOUT
+                if (dead or hung) and now >= worker.next_restart_at and not self._closed:
+                    logger.warning(f"LLM worker {worker.index} {'exited' if dead else 'stopped heartbeating'}, restarting")
+                    worker.restart()
+
+    def health(self):
+        """Per-worker pid, alive, state, seconds since last heartbeat, restarts and requests."""
+        now = time.monotonic()
+        return [
+            {
+                "worker": w.index,
+                "pid": w.process.pid if w.process else None,
+                "alive": w.process is not None and w.process.poll() is None,
+                "state": w.state,
+                "heartbeat_age": now - w.last_heartbeat,
+                "restarts": w.restarts,
+                "requests": w.requests,
+            }
+            for w in self._workers
+        ]
+
+    def close(self):
+        self._closed = True
+        for worker in self._workers:
+            with worker.lock:
+                worker.stop()
+
+
+def _serve(n_threads, index):
+    """Worker process: loads the chat model and answers completion requests until the bot goes away."""
+    authkey = bytes.fromhex(os.environ.pop("LLM_WORKER_AUTHKEY"))
+    listener = Listener(("127.0.0.1", 0), authkey=authkey)
+    print(listener.address[1], flush=True)
+    # stdout is the port handshake pipe, which the bot closes; everything else goes to stderr
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    conn = listener.accept()
+    hb_conn = listener.accept()
+    listener.close()
+
+    state = [STATE_STARTING]
+
+    def heartbeat():
+        while True:
+            try:
+                hb_conn.send(state[0])
+            except (OSError, EOFError):
+                os._exit(0)  # The bot is gone
+            time.sleep(_HEARTBEAT_INTERVAL)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    from tools.llm_tools import _load_llm
+    from tools.speculative_tools import draft_counters
+    llm = _load_llm(n_threads=n_threads, worker_index=index)
+    state[0] = STATE_READY
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request == "cancel":
+            continue  # Arrived after the stream had already finished
+        kind, messages, kwargs = request
+        state[0] = STATE_BUSY
+        try:
+            if kind == "stream":
+                for chunk in llm.create_chat_completion(messages=messages, stream=True, **kwargs):
+                    if conn.poll() and conn.recv() == "cancel":
+                        break
+                    conn.send(("chunk", chunk))
+                conn.send(("done", draft_counters(llm)))
+            else:
+                response = llm.create_chat_completion(messages=messages, stream=False, **kwargs)
+                conn.send(("result", (response, draft_counters(llm))))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        state[0] = STATE_READY
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM worker process (started by LlamaWorkerPool).")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--index", type=int, default=0)
+    args = parser.parse_args()
+    _serve(args.threads, args.index)
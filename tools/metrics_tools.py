@@ -0,0 +1,242 @@
+"""
+Metrics Module
+Timing spans around pipeline stages (embedding, Chroma, prompt eval, token
+generation, OCR, vision...), aggregated into rolling per-stage histograms.
+Exposed as a text report (the admin /stats command), in Prometheus text format
+on an optional HTTP endpoint, and as one structured JSON log line per request.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Samples kept per series for the rolling percentiles
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 500))
+# Port for the Prometheus text endpoint (0 = disabled)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Log one JSON line per chat/ingest request with its stage timings
+METRICS_LOG_REQUESTS = os.getenv("METRICS_LOG_REQUESTS", "true").lower() == "true"
+
+_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Series:
+    """Rolling window of samples plus lifetime count and sum."""
+
+    __slots__ = ("samples", "count", "total")
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of named series. A stage's duration goes into series `stage`
+    (seconds); numeric span fields such as prompt_tokens go into (stage, field).
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, value, field="seconds"):
+        with self._lock:
+            series = self._series.get((stage, field))
+            if series is None:
+                series = self._series[(stage, field)] = _Series(self.window)
+            series.add(value)
+
+    def record(self, stage, seconds, **fields):
+        """Records a finished stage and its numeric fields, and adds it to the current request trace."""
+        self.observe(stage, seconds)
+        for field, value in fields.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.observe(stage, value, field)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(stage, seconds, fields)
+
+    def snapshot(self):
+        """{(stage, field): {count, sum, mean, p50, p95, p99}} over the rolling window."""
+        with self._lock:
+            items = [(key, list(s.samples), s.count, s.total) for key, s in self._series.items()]
+        result = {}
+        for key, samples, count, total in sorted(items):
+            values = sorted(samples)
+            stats = {"count": count, "sum": total, "mean": sum(values) / len(values) if values else 0.0}
+            for q in _QUANTILES:
+                stats[f"p{int(q * 100)}"] = values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+            result[key] = stats
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+METRICS = MetricsRegistry()
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Times the enclosed block as `stage`. Yields a dict that the block can fill with
+    extra numeric fields (token counts, chunk counts...) recorded alongside the duration.
+    """
+    info = dict(fields)
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        METRICS.record(stage, time.perf_counter() - started, **info)
+
+
+class RequestTrace:
+    """Stage timings of one chat or ingest request, logged as a single JSON line."""
+
+    def __init__(self, kind, **fields):
+        self.kind = kind
+        self.fields = fields
+        self.stages = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds, fields):
+        entry = {"stage": stage, "ms": round(seconds * 1000, 2)}
+        entry.update({k: round(v, 2) if isinstance(v, float) else v for k, v in fields.items()})
+        with self._lock:
+            self.stages.append(entry)
+
+
+# The trace of the request being handled. Scheduler jobs run inside a copy of the
+# submitting thread's context, so model stages on worker threads land in it too.
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+# Requests in flight and perf_counter() of the latest start/finish per kind, so background
+# work can yield to live traffic
+_requests_in_flight = {}
+_last_request_activity = {}
+_activity_lock = threading.Lock()
+
+
+def start_request(kind, **fields):
+    """Starts a request trace and makes it current for this thread/context."""
+    trace = RequestTrace(kind, **fields)
+    _current_trace.set(trace)
+    with _activity_lock:
+        _requests_in_flight[kind] = _requests_in_flight.get(kind, 0) + 1
+        _last_request_activity[kind] = trace.started
+    return trace
+
+
+def seconds_since_request(kind):
+    """Seconds since a request of this kind last started or finished: 0 while one is running, inf if none has."""
+    with _activity_lock:
+        if _requests_in_flight.get(kind):
+            return 0.0
+        last = _last_request_activity.get(kind)
+    return float("inf") if last is None else time.perf_counter() - last
+
+
+def finish_request(trace, **fields):
+    """Records the request's total time and writes its structured log line."""
+    if trace is None:
+        return
+    total = time.perf_counter() - trace.started
+    with _activity_lock:
+        _requests_in_flight[trace.kind] -= 1
+        _last_request_activity[trace.kind] = time.perf_counter()
+    METRICS.observe(f"request.{trace.kind}", total)
+    trace.fields.update(fields)
+    if METRICS_LOG_REQUESTS:
+        with trace._lock:
+            stages = list(trace.stages)
+        logger.info(json.dumps({"event": "request", "kind": trace.kind, "total_ms": round(total * 1000, 2),
+                                **trace.fields, "stages": stages}, default=str))
+
+
+def format_stats():
+    """Human-readable per-stage latency table for the /stats command."""
+    snapshot = METRICS.snapshot()
+    if not snapshot:
+        return "No metrics recorded yet."
+    lines = ["stage: n | p50 / p95 / p99 ms"]
+    for (stage, field), stats in snapshot.items():
+        if field != "seconds":
+            continue
+        lines.append(f"{stage}: {stats['count']} | {stats['p50'] * 1000:.0f} / "
+                     f"{stats['p95'] * 1000:.0f} / {stats['p99'] * 1000:.0f}")
+    extras = [(key, stats) for key, stats in snapshot.items() if key[1] != "seconds"]
+    if extras:
+        lines.append("")
+        lines.append("field: mean (p50 / p95)")
+        for (stage, field), stats in extras:
+            lines.append(f"{stage}.{field}: {stats['mean']:.1f} ({stats['p50']:.1f} / {stats['p95']:.1f})")
+    return "\n".join(lines)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_prometheus():
+    """Every series as a Prometheus summary (quantiles over the window, lifetime _sum/_count)."""
+    by_field = {}
+    for (stage, field), stats in METRICS.snapshot().items():
+        by_field.setdefault(field, []).append((stage, stats))
+
+    lines = []
+    for field, entries in sorted(by_field.items()):
+        name = f"agent_stage_{field}"
+        lines.append(f"# TYPE {name} summary")
+        for stage, stats in entries:
+            for q in _QUANTILES:
+                lines.append(f'{name}{{stage="{_label(stage)}",quantile="{q}"}} {stats[f"p{int(q * 100)}"]}')
+            lines.append(f'{name}_sum{{stage="{_label(stage)}"}} {stats["sum"]}')
+            lines.append(f'{name}_count{{stage="{_label(stage)}"}} {stats["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves render_prometheus() at /metrics from a daemon thread. Returns the server, or None if disabled."""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Prometheus metrics on http://0.0.0.0:{port}/metrics")
+    return server
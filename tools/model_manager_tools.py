@@ -0,0 +1,252 @@
+"""
+Model Residency Module
+Tracks which local models are loaded and roughly what each costs in RAM and
+VRAM. Before a model loads, idle models are unloaded (least recently used first)
+until it fits the configured budget, and a janitor thread unloads models that
+have sat idle longer than MODEL_IDLE_TIMEOUT. Pinned models (the chat model)
+are never evicted; evicted models reload transparently on their next use.
+"""
+
+import gc
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from tools.metrics_tools import METRICS
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 0 = automatic: 75% of physical RAM, and the detected VRAM minus MODEL_VRAM_HEADROOM_MB
+MODEL_RAM_BUDGET_MB = int(os.getenv("MODEL_RAM_BUDGET_MB", 0))
+MODEL_VRAM_BUDGET_MB = int(os.getenv("MODEL_VRAM_BUDGET_MB", 0))
+MODEL_VRAM_HEADROOM_MB = int(os.getenv("MODEL_VRAM_HEADROOM_MB", 512))
+# Seconds an unpinned model may sit unused before it is unloaded (0 = never)
+MODEL_IDLE_TIMEOUT = int(os.getenv("MODEL_IDLE_TIMEOUT", 300))
+
+_MB = 1024 * 1024
+
+
+def physical_ram_mb():
+    """Total physical memory in MB, or None if it cannot be determined."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // _MB
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().total // _MB
+    except ImportError:
+        return None
+
+
+def estimate_footprint_mb(paths, n_gpu_layers, n_layers, extra_mb=0, fallback_mb=0):
+    """
+    (ram_mb, vram_mb) estimate for GGUF weights at `paths` plus `extra_mb` of KV cache
+    and compute buffers, split by the share of the n_layers layers offloaded to the GPU.
+    fallback_mb stands in for the weights until they have been downloaded.
+    """
+    weights_mb = sum(os.path.getsize(p) for p in paths if p and os.path.exists(p)) / _MB
+    total = (weights_mb or fallback_mb) + extra_mb
+    if n_gpu_layers < 0:
+        share = 1.0
+    else:
+        share = min(1.0, n_gpu_layers / n_layers) if n_layers else 0.0
+    return total * (1 - share), total * share
+
+
+class _ModelEntry:
+    def __init__(self, name, loader, footprint, unloader, pinned):
+        self.name = name
+        self.loader = loader
+        self.footprint = footprint
+        self.unloader = unloader
+        self.pinned = pinned
+        self.instance = None
+        self.ram_mb = 0.0
+        self.vram_mb = 0.0
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.load_lock = threading.Lock()
+
+
+class ModelManager:
+    """Loads registered models on demand and keeps their total footprint within budget."""
+
+    def __init__(self, ram_budget_mb=MODEL_RAM_BUDGET_MB, vram_budget_mb=MODEL_VRAM_BUDGET_MB,
+                 idle_timeout=MODEL_IDLE_TIMEOUT):
+        self.ram_budget_mb = ram_budget_mb
+        self.vram_budget_mb = vram_budget_mb
+        self.idle_timeout = idle_timeout
+        self._models = {}
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    def register(self, name, loader, footprint=lambda: (0, 0), unloader=None, pinned=False):
+        """
+        loader() builds the model; footprint() returns its (ram_mb, vram_mb) estimate;
+        unloader(instance) releases it (default: instance.close()).
+        """
+        with self._lock:
+            self._models[name] = _ModelEntry(name, loader, footprint, unloader, pinned)
+
+    def adopt(self, name, instance):
+        """Uses an already-built instance for `name` (e.g. a stub); it is what reloads return too."""
+        with self._lock:
+            entry = self._models[name]
+            entry.loader = lambda: instance
+            entry.footprint = lambda: (0, 0)
+            entry.instance = instance
+            entry.ram_mb = entry.vram_mb = 0.0
+            entry.last_used = time.monotonic()
+
+    def peek(self, name):
+        """The loaded instance, or None. Never loads and does not count as a use."""
+        entry = self._models.get(name)
+        return entry.instance if entry else None
+
+    def get(self, name):
+        """Returns the model, loading it (and making room for it) if needed."""
+        with self.use(name) as instance:
+            return instance
+
+    @contextmanager
+    def use(self, name):
+        """Holds the model loaded for the duration of the block; it cannot be evicted meanwhile."""
+        entry = self._models[name]
+        with self._lock:
+            entry.in_use += 1
+        try:
+            yield self._ensure_loaded(entry)
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def _ensure_loaded(self, entry):
+        with entry.load_lock:
+            if entry.instance is not None:
+                return entry.instance
+            ram_mb, vram_mb = entry.footprint()
+            self._make_room(entry, ram_mb, vram_mb)
+            started = time.perf_counter()
+            instance = entry.loader()
+            seconds = time.perf_counter() - started
+            with self._lock:
+                entry.instance = instance
+                entry.ram_mb, entry.vram_mb = ram_mb, vram_mb
+                entry.loads += 1
+            METRICS.record(f"model.load.{entry.name}", seconds, ram_mb=ram_mb, vram_mb=vram_mb)
+            logger.info(f"Loaded model '{entry.name}' in {seconds:.1f}s (~{ram_mb:.0f} MB RAM, ~{vram_mb:.0f} MB VRAM)")
+            self._start_janitor()
+            return instance
+
+    def _budgets(self):
+        ram = self.ram_budget_mb
+        if not ram:
+            total = physical_ram_mb()
+            ram = total * 0.75 if total else float("inf")
+        vram = self.vram_budget_mb
+        if not vram:
+            from tools.gpu_config import get_cached_gpu_config
+            gpu_info = get_cached_gpu_config().get("gpu_info")
+            vram = gpu_info["vram_mb"] - MODEL_VRAM_HEADROOM_MB if gpu_info else float("inf")
+        return ram, vram
+
+    def _make_room(self, entry, ram_mb, vram_mb):
+        """Unloads idle unpinned models, least recently used first, until `entry` fits."""
+        ram_budget, vram_budget = self._budgets()
+        with self._lock:
+            loaded = [e for e in self._models.values() if e.instance is not None and e is not entry]
+            used_ram = sum(e.ram_mb for e in loaded)
+            used_vram = sum(e.vram_mb for e in loaded)
+            candidates = sorted((e for e in loaded if not e.pinned and e.in_use == 0), key=lambda e: e.last_used)
+            evicted = []
+            while candidates and (used_ram + ram_mb > ram_budget or used_vram + vram_mb > vram_budget):
+                victim = candidates.pop(0)
+                used_ram -= victim.ram_mb
+                used_vram -= victim.vram_mb
+                evicted.append(self._detach(victim))
+            if used_ram + ram_mb > ram_budget or used_vram + vram_mb > vram_budget:
+                logger.warning(f"Loading '{entry.name}' exceeds the model memory budget; nothing left to evict")
+        for victim, instance in evicted:
+            self._release(victim, instance, "memory pressure")
+
+    def _detach(self, entry):
+        # Caller holds self._lock
+        instance, entry.instance = entry.instance, None
+        entry.ram_mb = entry.vram_mb = 0.0
+        return entry, instance
+
+    def _release(self, entry, instance, reason):
+        try:
+            if entry.unloader:
+                entry.unloader(instance)
+            elif hasattr(instance, "close"):
+                instance.close()
+        except Exception as e:
+            logger.warning(f"Error unloading model '{entry.name}': {e}")
+        del instance
+        gc.collect()
+        logger.info(f"Unloaded model '{entry.name}' ({reason})")
+
+    def unload(self, name):
+        """Unloads a model now unless it is in use. Returns True if it was unloaded."""
+        with self._lock:
+            entry = self._models[name]
+            if entry.instance is None or entry.in_use:
+                return False
+            detached = self._detach(entry)
+        self._release(*detached, "requested")
+        return True
+
+    def evict_idle(self, idle_timeout=None):
+        """Unloads unpinned models idle for longer than idle_timeout seconds. Returns their names."""
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        now = time.monotonic()
+        with self._lock:
+            evicted = [self._detach(e) for e in self._models.values()
+                       if e.instance is not None and not e.pinned and not e.in_use
+                       and now - e.last_used > idle_timeout]
+        for entry, instance in evicted:
+            self._release(entry, instance, f"idle > {idle_timeout}s")
+        return [entry.name for entry, _ in evicted]
+
+    def _start_janitor(self):
+        if not self.idle_timeout:
+            return
+        with self._lock:
+            if self._janitor:
+                return
+            interval = max(1, min(60, self.idle_timeout // 2))
+
+            def janitor():
+                while True:
+                    time.sleep(interval)
+                    self.evict_idle()
+
+            self._janitor = threading.Thread(target=janitor, name="model-janitor", daemon=True)
+            self._janitor.start()
+
+    def snapshot(self):
+        """Per-model state for /stats: loaded, pinned, in_use, loads, ram_mb, vram_mb, idle_seconds."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                e.name: {
+                    "loaded": e.instance is not None,
+                    "pinned": e.pinned,
+                    "in_use": e.in_use,
+                    "loads": e.loads,
+                    "ram_mb": e.ram_mb,
+                    "vram_mb": e.vram_mb,
+                    "idle_seconds": now - e.last_used if e.instance is not None else None,
+                }
+                for e in self._models.values()
+            }
+
+
+MODELS = ModelManager()
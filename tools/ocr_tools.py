@@ -1,12 +1,18 @@
 import pytesseract
 from PIL import Image
+from tools.metrics_tools import span
+from tools.image_tools import OCR_DPI
 
-def perform_ocr(file_path):
-    """Extracts text from an image using Tesseract OCR."""
+def perform_ocr(image, dpi=OCR_DPI):
+    """
+    Extracts text from an image using Tesseract OCR.
+    Accepts a file path or an already preprocessed PIL image (see PreparedImage.ocr_image()).
+    """
     try:
-        img = Image.open(file_path)
+        img = image if isinstance(image, Image.Image) else Image.open(image)
         # Note: Tesseract must be installed on the system map
-        text = pytesseract.image_to_string(img)
+        with span("ocr"):
+            text = pytesseract.image_to_string(img, config=f"--dpi {dpi}")
         return text.strip()
     except Exception as e:
         return f"OCR Error: {str(e)}"
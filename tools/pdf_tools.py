@@ -1,15 +1,21 @@
 import PyPDF2
 
+def iter_pdf_pages(file_path):
+    """
+    Yields (page_number, page_count, text) one page at a time so large PDFs
+    never have to be held in memory as a single string. Pages without text are skipped.
+    """
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        page_count = len(reader.pages)
+        for page_number, page in enumerate(reader.pages, start=1):
+            extracted = page.extract_text()
+            if extracted:
+                yield page_number, page_count, extracted
+
 def parse_pdf(file_path):
     """Parses text from a PDF file."""
-    text_content = ""
     try:
-        with open(file_path, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text_content += extracted + "\n"
-        return text_content
+        return "".join(text + "\n" for _, _, text in iter_pdf_pages(file_path))
     except Exception as e:
         return f"Error parsing PDF: {e}"
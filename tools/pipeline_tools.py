@@ -0,0 +1,60 @@
+"""
+Stage Graph Module
+Runs a small dependency graph of pipeline stages on a thread pool: every stage
+starts as soon as the stages it depends on have finished, so independent work
+(e.g. OCR and vision captioning) overlaps instead of running back to back.
+"""
+
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_stage_graph(stages, max_workers=None):
+    """
+    Executes `stages`, a dict of name -> (fn, deps). Each fn is called with a dict
+    holding the results of the stages it depends on.
+
+    Returns (results, timings): result and wall-clock seconds per stage name.
+    The first stage exception is re-raised once running stages have settled.
+    """
+    for name, (_, deps) in stages.items():
+        unknown = [d for d in deps if d not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on unknown stage(s): {', '.join(unknown)}")
+
+    results = {}
+    timings = {}
+    remaining = dict(stages)
+
+    def timed(name, fn, inputs):
+        started = time.perf_counter()
+        try:
+            return fn(inputs)
+        finally:
+            timings[name] = time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1) as pool:
+        running = {}
+        while remaining or running:
+            ready = [n for n, (_, deps) in remaining.items() if all(d in results for d in deps)]
+            for name in ready:
+                fn, deps = remaining.pop(name)
+                inputs = {d: results[d] for d in deps}
+                # Stages run in the caller's context so their metrics join its request trace
+                running[pool.submit(contextvars.copy_context().run, timed, name, fn, inputs)] = name
+
+            if not running:
+                raise ValueError(f"Stage graph has a dependency cycle: {', '.join(remaining)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+
+    return results, timings
+
+
+def format_timings(timings):
+    """Renders stage timings as 'ocr 1.20s, vision 8.40s'."""
+    return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
@@ -0,0 +1,85 @@
+"""
+Prompt State Cache Module
+Two-tier llama.cpp state cache: recent states in RAM, older ones spilled to disk.
+Entries are keyed by token sequence and matched by longest common prefix, so each
+chat session's conversation resumes from its own cached state.
+"""
+
+import os
+import logging
+from dotenv import load_dotenv
+from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 0 disables the prompt cache entirely
+LLM_CACHE_RAM_MB = int(os.getenv("LLM_CACHE_RAM_MB", 1024))
+# Empty keeps the cache RAM-only
+LLM_CACHE_DISK_DIR = os.getenv("LLM_CACHE_DISK_DIR", "")
+LLM_CACHE_DISK_MB = int(os.getenv("LLM_CACHE_DISK_MB", 4096))
+
+
+class TieredPromptCache(LlamaRAMCache):
+    """
+    LRU RAM cache whose evicted states are demoted to a bounded LlamaDiskCache.
+    A disk hit is promoted back into RAM.
+    """
+
+    def __init__(self, ram_bytes, disk_dir=None, disk_bytes=0):
+        super().__init__(capacity_bytes=ram_bytes)
+        self.disk = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk = LlamaDiskCache(cache_dir=disk_dir, capacity_bytes=disk_bytes)
+
+    def __contains__(self, key):
+        return super().__contains__(key) or (self.disk is not None and key in self.disk)
+
+    def __getitem__(self, key):
+        key = tuple(key)
+        ram_key = self._find_longest_prefix_key(key)
+        ram_len = Llama.longest_token_prefix(ram_key, key) if ram_key is not None else 0
+
+        if self.disk is not None:
+            disk_key = self.disk._find_longest_prefix_key(key)
+            if disk_key is not None and Llama.longest_token_prefix(disk_key, key) > ram_len:
+                value = self.disk[disk_key]
+                self[disk_key] = value
+                return value
+
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        key = tuple(key)
+        if key in self.cache_state:
+            del self.cache_state[key]
+        self.cache_state[key] = value
+        while self.cache_size > self.capacity_bytes and len(self.cache_state) > 1:
+            old_key, old_value = self.cache_state.popitem(last=False)
+            if self.disk is not None:
+                self.disk[old_key] = old_value
+
+
+def build_prompt_cache(worker_index=None):
+    """
+    Creates the prompt cache from .env settings, or returns None when disabled.
+    LLM worker processes (worker_index set) each get their own RAM tier and their own
+    subdirectory with an equal share of LLM_CACHE_DISK_MB, so they never evict each other's files.
+    """
+    if LLM_CACHE_RAM_MB <= 0:
+        return None
+    disk_dir, disk_mb = LLM_CACHE_DISK_DIR, LLM_CACHE_DISK_MB
+    if disk_dir and worker_index is not None:
+        from tools.llm_worker_tools import LLM_WORKER_PROCESSES
+        disk_dir = os.path.join(disk_dir, f"worker-{worker_index}")
+        disk_mb = LLM_CACHE_DISK_MB // max(1, LLM_WORKER_PROCESSES)
+    tier = f"RAM {LLM_CACHE_RAM_MB} MB"
+    if disk_dir:
+        tier += f" + disk {disk_mb} MB at {disk_dir}"
+    logger.info(f"Prompt state cache enabled ({tier})")
+    return TieredPromptCache(
+        ram_bytes=LLM_CACHE_RAM_MB * 1024 * 1024,
+        disk_dir=disk_dir or None,
+        disk_bytes=disk_mb * 1024 * 1024
+    )
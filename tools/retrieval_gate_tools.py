@@ -0,0 +1,64 @@
+"""
+Retrieval Gate Module
+Cheap rule-based classifier run before RAG retrieval. Small-talk turns ("hi",
+"lol", "thanks babe", emoji-only messages) skip the embedding, the vector search
+and the injected context chunks entirely.
+"""
+
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set RETRIEVAL_GATE=off to retrieve for every message again
+RETRIEVAL_GATE = os.getenv("RETRIEVAL_GATE", "on").lower().strip() not in ("off", "0", "false", "no")
+
+# Greetings, acknowledgements, laughter and pet names
+SMALL_TALK_WORDS = {
+    "hi", "hii", "hiii", "hey", "heya", "hello", "helo", "yo", "sup", "hola", "howdy",
+    "morning", "evening", "night", "gm", "gn", "goodnight", "bye", "byee", "cya", "later",
+    "ok", "okay", "okk", "k", "kk", "sure", "yes", "yeah", "yep", "yup", "no", "nope", "nah",
+    "thanks", "thank", "thx", "ty", "tysm", "cool", "nice", "great", "awesome", "fine", "alright",
+    "lol", "lmao", "lmfao", "rofl", "haha", "hahaha", "hehe", "hihi", "xd", "omg", "wow", "aww", "awww",
+    "hmm", "hm", "umm", "uh", "oh", "ohh", "ah", "ahh",
+    "love", "miss", "cute", "cutie", "babe", "baby", "boo", "dear", "bestie", "bro", "dude",
+    "good", "bad", "sad", "happy", "tired", "bored", "sleepy", "doing", "going", "up",
+}
+
+# Function words: on their own they carry nothing to search for
+STOP_WORDS = {
+    "i", "im", "me", "my", "you", "u", "ur", "your", "we", "us", "it", "its", "this", "that",
+    "a", "an", "the", "and", "or", "so", "too", "very", "really", "much", "just", "still",
+    "is", "am", "are", "was", "be", "been", "do", "did", "does", "have", "has", "had",
+    "what", "whats", "how", "hows", "who", "why", "when", "where", "wbu", "hbu",
+    "to", "of", "in", "on", "at", "for", "with", "all", "there", "here", "now", "today", "again",
+}
+
+# Longer turns are assumed to carry a real question even if every word is listed above
+MAX_SMALL_TALK_WORDS = 8
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def is_small_talk(text):
+    """True when the message has no word worth searching memory for."""
+    lowered = text.lower()
+    # File names, IDs and numbers are exactly what lexical retrieval is for
+    if re.search(r"\w\.\w{2,4}\b|\d", lowered):
+        return False
+    words = _WORD_PATTERN.findall(lowered)
+    if not words:
+        return True
+    if len(words) > MAX_SMALL_TALK_WORDS:
+        return False
+    # Stretched spellings: "heyyy", "hiiii", "okkk"
+    words = [re.sub(r"(.)\1{2,}", r"\1", w) for w in words]
+    return all(w in SMALL_TALK_WORDS or w in STOP_WORDS for w in words)
+
+
+def needs_retrieval(text):
+    """Gate for the RAG stage: False for small talk (unless the gate is disabled)."""
+    if not RETRIEVAL_GATE:
+        return True
+    return not is_small_talk(text)
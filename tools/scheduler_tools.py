@@ -0,0 +1,135 @@
+"""
+Inference Scheduler Module
+Gives each local model a single owning worker thread fed by a bounded
+priority queue, so llama.cpp instances are never called concurrently.
+"""
+
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+import contextvars
+from concurrent.futures import Future
+from tools.metrics_tools import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first
+PRIORITY_INTERACTIVE = 0   # Live chat replies
+PRIORITY_BACKGROUND = 1    # Captioning, filename generation, warm-up
+
+_STREAM_END = object()
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised when a scheduler's queue is full and the request is rejected."""
+
+
+class InferenceScheduler:
+    """
+    Runs submitted jobs on dedicated worker thread(s) that own one model.
+
+    Ordering is (priority, fairness rank, arrival). The fairness rank works like
+    round-robin: a user's n-th pending job ranks behind every other user's first
+    pending job, so one chat flooding the bot cannot starve the others.
+    """
+
+    def __init__(self, name, max_queue=16, workers=1):
+        self.name = name
+        self.max_queue = max_queue
+        self.workers = workers
+        self._heap = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._user_rank = {}
+        self._round = 0
+        self._threads = []
+
+    def _ensure_workers(self):
+        # Caller holds self._cond
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def pending(self):
+        """Number of jobs waiting for a worker."""
+        with self._cond:
+            return len(self._heap)
+
+    def submit(self, fn, *args, priority=PRIORITY_INTERACTIVE, user_id=None, **kwargs):
+        """Queues fn(*args, **kwargs) and returns a Future. Raises SchedulerBusyError when full."""
+        future = Future()
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                raise SchedulerBusyError(f"{self.name} queue is full ({self.max_queue} pending)")
+            rank = max(self._user_rank.get(user_id, 0), self._round) + 1
+            self._user_rank[user_id] = rank
+            # The job runs in a copy of the caller's context so its metrics join the caller's request trace
+            job = (contextvars.copy_context(), time.perf_counter(), fn, args, kwargs)
+            heapq.heappush(self._heap, (priority, rank, next(self._seq), user_id, job, future))
+            self._ensure_workers()
+            self._cond.notify()
+        return future
+
+    def run(self, fn, *args, priority=PRIORITY_INTERACTIVE, user_id=None, **kwargs):
+        """Submits a job and blocks until the owning worker has finished it."""
+        return self.submit(fn, *args, priority=priority, user_id=user_id, **kwargs).result()
+
+    def stream(self, gen_fn, *args, priority=PRIORITY_INTERACTIVE, user_id=None, **kwargs):
+        """
+        Runs a generator function on the owning worker and relays its items to the caller.
+        The job is queued immediately, so SchedulerBusyError surfaces here rather than on first next().
+        """
+        items = queue.Queue()
+        cancelled = threading.Event()
+
+        def job():
+            try:
+                for item in gen_fn(*args, **kwargs):
+                    if cancelled.is_set():
+                        break
+                    items.put(item)
+            finally:
+                items.put(_STREAM_END)
+
+        future = self.submit(job, priority=priority, user_id=user_id)
+
+        def relay():
+            try:
+                while True:
+                    item = items.get()
+                    if item is _STREAM_END:
+                        break
+                    yield item
+                future.result()
+            finally:
+                # Lets the worker stop early if the consumer walks away
+                cancelled.set()
+
+        return relay()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, rank, _, user_id, job, future = heapq.heappop(self._heap)
+                self._round = max(self._round, rank)
+                if self._user_rank.get(user_id) == rank:
+                    # No more pending work for this user, forget their rank
+                    del self._user_rank[user_id]
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            context, queued_at, fn, args, kwargs = job
+            try:
+                context.run(METRICS.record, f"{self.name}.queue_wait", time.perf_counter() - queued_at)
+                future.set_result(context.run(fn, *args, **kwargs))
+            except BaseException as e:
+                logger.debug(f"{self.name} job failed: {e}")
+                future.set_exception(e)
@@ -0,0 +1,137 @@
+"""
+Conversation Session Module
+Keeps a bounded message history per Telegram chat so prompts never mix
+users, with LRU eviction under a memory cap and optional SQLite persistence.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HISTORY_MESSAGES = int(os.getenv("HISTORY_MESSAGES", 10))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 1000))
+SESSION_MEMORY_MB = float(os.getenv("SESSION_MEMORY_MB", 32))
+# Empty disables persistence; sessions then live only as long as the process
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+
+
+class _Session:
+    """Ring buffer of (role, content) tuples plus its approximate size in bytes."""
+    __slots__ = ("messages", "size")
+
+    def __init__(self, max_messages, messages=()):
+        self.messages = deque(maxlen=max_messages)
+        self.size = 0
+        for role, content in messages:
+            self.append(role, content)
+
+    def append(self, role, content):
+        if len(self.messages) == self.messages.maxlen:
+            _, dropped = self.messages[0]
+            self.size -= len(dropped)
+        self.messages.append((role, content))
+        self.size += len(content)
+
+
+class SessionStore:
+    """
+    Maps chat id -> recent messages. Only the newest `max_messages` are kept per chat,
+    and the least recently used chats are dropped from RAM when `max_sessions` or
+    `memory_mb` is exceeded. With a db_path, evicted chats reload from disk on next use.
+    """
+
+    def __init__(self, max_messages=HISTORY_MESSAGES, max_sessions=SESSION_MAX_SESSIONS,
+                 memory_mb=SESSION_MEMORY_MB, db_path=SESSION_DB_PATH):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.max_bytes = int(memory_mb * 1024 * 1024)
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "chat_id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _get(self, chat_id):
+        # Caller holds self._lock
+        key = str(chat_id)
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+            return session
+
+        stored = []
+        if self._db is not None:
+            row = self._db.execute("SELECT messages FROM sessions WHERE chat_id = ?", (key,)).fetchone()
+            if row:
+                stored = json.loads(row[0])
+        session = _Session(self.max_messages, stored)
+        self._sessions[key] = session
+        self._total_bytes += session.size
+        return session
+
+    def _evict(self):
+        # Caller holds self._lock; the most recent session is never evicted
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes
+        ):
+            _, session = self._sessions.popitem(last=False)
+            self._total_bytes -= session.size
+
+    def _persist(self, chat_id, session):
+        # Caller holds self._lock
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (chat_id, messages, updated_at) VALUES (?, ?, ?)",
+            (str(chat_id), json.dumps(list(session.messages)), time.time())
+        )
+        self._db.commit()
+
+    def get_history(self, chat_id):
+        """Returns the chat's recent messages as role/content dicts, oldest first."""
+        with self._lock:
+            session = self._get(chat_id)
+            messages = [{"role": role, "content": content} for role, content in session.messages]
+            self._evict()
+            return messages
+
+    def last_assistant_message(self, chat_id):
+        """Returns the newest assistant reply in the chat, or an empty string."""
+        with self._lock:
+            session = self._get(chat_id)
+            for role, content in reversed(session.messages):
+                if role == "assistant":
+                    return content
+            return ""
+
+    def append_turn(self, chat_id, user_content, assistant_content):
+        """Records a user message and the reply to it."""
+        with self._lock:
+            session = self._get(chat_id)
+            before = session.size
+            session.append("user", user_content)
+            session.append("assistant", assistant_content)
+            self._total_bytes += session.size - before
+            self._persist(chat_id, session)
+            self._evict()
+
+    def clear_all(self):
+        """Forgets every session, in memory and on disk."""
+        with self._lock:
+            self._sessions.clear()
+            self._total_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions")
+                self._db.commit()
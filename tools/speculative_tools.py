@@ -0,0 +1,129 @@
+"""
+Speculative Decoding Module
+Opt-in draft models for the chat LLM, plugged into llama-cpp-python's
+`draft_model` hook. "prompt_lookup" drafts tokens by matching the last n-gram
+against the prompt (cheap, and RAG answers quote their context a lot); "draft"
+runs a small GGUF from the same tokenizer family. The main model verifies every
+drafted token, so the output is the same as plain decoding, only faster when
+drafts are accepted.
+"""
+
+import os
+from dotenv import load_dotenv
+from tools.metrics_tools import METRICS
+
+load_dotenv()
+
+# off | prompt_lookup | draft
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off").lower().strip()
+# Tokens proposed per draft call
+SPECULATIVE_DRAFT_TOKENS = int(os.getenv("SPECULATIVE_DRAFT_TOKENS", 8))
+# Longest n-gram prompt lookup tries to match
+SPECULATIVE_MAX_NGRAM = int(os.getenv("SPECULATIVE_MAX_NGRAM", 3))
+# Draft GGUF for SPECULATIVE_MODE=draft; must share the chat model's tokenizer
+DRAFT_HF_REPO_ID = os.getenv("DRAFT_HF_REPO_ID", "Qwen/Qwen2.5-0.5B-Instruct-GGUF")
+DRAFT_HF_FILENAME = os.getenv("DRAFT_HF_FILENAME", "qwen2.5-0.5b-instruct-q4_k_m.gguf")
+
+
+class LlamaModelDraft:
+    """Draft model backed by a small Llama: greedily proposes the next num_pred_tokens tokens."""
+
+    def __init__(self, llm, num_pred_tokens=SPECULATIVE_DRAFT_TOKENS):
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+
+        drafted = []
+        # generate() reuses the longest cached prefix, so each call only evaluates new tokens
+        for token in self.llm.generate(input_ids.tolist(), temp=0.0, top_k=1):
+            drafted.append(token)
+            if len(drafted) >= self.num_pred_tokens or token == self.llm.token_eos():
+                break
+        return np.array(drafted, dtype=np.intc)
+
+
+class CountingDraftModel:
+    """
+    Wraps a draft model and counts draft calls and proposed tokens. llama.cpp does one
+    verification pass per draft call and emits accepted + 1 tokens from it, so
+    accepted ~= completion tokens - draft calls.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = 0
+        self.drafted = 0
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = self.inner(input_ids, **kwargs)
+        self.calls += 1
+        self.drafted += len(tokens)
+        return tokens
+
+    def counters(self):
+        return self.calls, self.drafted
+
+
+def build_draft_model(n_ctx, model_dir, n_threads=8):
+    """The draft model for SPECULATIVE_MODE, wrapped in CountingDraftModel, or None when off."""
+    if SPECULATIVE_MODE in ("", "off"):
+        return None
+    if SPECULATIVE_MODE == "prompt_lookup":
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+        inner = LlamaPromptLookupDecoding(max_ngram_size=SPECULATIVE_MAX_NGRAM,
+                                          num_pred_tokens=SPECULATIVE_DRAFT_TOKENS)
+    elif SPECULATIVE_MODE == "draft":
+        from huggingface_hub import hf_hub_download
+        from llama_cpp import Llama
+        print(f"Ensuring draft model {DRAFT_HF_FILENAME} is downloaded to {model_dir}...")
+        draft_path = hf_hub_download(
+            repo_id=DRAFT_HF_REPO_ID,
+            filename=DRAFT_HF_FILENAME,
+            local_dir=model_dir,
+            local_dir_use_symlinks=False
+        )
+        # The draft stays on CPU: speculative decoding is for CPU-bound generation
+        inner = LlamaModelDraft(Llama(model_path=draft_path, n_ctx=n_ctx, n_threads=n_threads,
+                                      n_gpu_layers=0, verbose=False))
+    else:
+        raise ValueError(f"Unknown SPECULATIVE_MODE '{SPECULATIVE_MODE}' (use off, prompt_lookup or draft)")
+    print(f"Speculative decoding enabled ({SPECULATIVE_MODE}, {SPECULATIVE_DRAFT_TOKENS} tokens per draft)")
+    return CountingDraftModel(inner)
+
+
+def logits_buffer_mb(n_ctx, n_vocab):
+    """
+    RAM for the float32 logits of every context position. llama-cpp-python turns on
+    logits_all whenever a draft_model is set (both modes), so the context keeps
+    n_ctx x n_vocab scores instead of one row; ~1.2 GB for Qwen at n_ctx 2048.
+    """
+    if SPECULATIVE_MODE in ("", "off"):
+        return 0
+    return n_ctx * n_vocab * 4 / (1024 * 1024)
+
+
+def draft_counters(llm):
+    """(draft calls, drafted tokens) so far for a Llama built with build_draft_model(), else None."""
+    relayed = getattr(llm, "draft_counters", None)
+    if callable(relayed):
+        # LlamaWorkerPool: the counters of the calling thread's worker process
+        return relayed()
+    draft_model = getattr(llm, "draft_model", None)
+    return draft_model.counters() if isinstance(draft_model, CountingDraftModel) else None
+
+
+def record_speculation(before, after, completion_tokens):
+    """Records drafted/accepted tokens and the acceptance rate of one completion."""
+    if before is None or after is None:
+        return
+    calls = after[0] - before[0]
+    drafted = after[1] - before[1]
+    if calls <= 0:
+        return  # No drafting, or the counters restarted with a new worker process
+    accepted = min(drafted, max(0, completion_tokens - calls))
+    METRICS.observe("llm.speculative", drafted, "drafted_tokens")
+    METRICS.observe("llm.speculative", accepted, "accepted_tokens")
+    if drafted:
+        METRICS.observe("llm.speculative", accepted / drafted, "acceptance_rate")
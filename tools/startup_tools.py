@@ -0,0 +1,89 @@
+"""
+Startup & Warm-up Module
+Tracks readiness of heavy components (GPU detection, vector DB, embedding model,
+chat model) and loads them in a background thread so polling can start at once.
+"""
+
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# "background" (default): start polling immediately and load components in a thread
+# "eager": load everything before polling starts
+# "lazy": load each component only when first used
+WARMUP_MODE = os.getenv("WARMUP_MODE", "background").lower().strip()
+
+
+class StartupTracker:
+    """Records state and load time of each named startup component."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._components = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name, seconds):
+        """Records an already-finished startup phase (e.g. imports)."""
+        with self._lock:
+            self._components[name] = {"state": "ready", "seconds": seconds, "error": None}
+
+    def run(self, name, fn):
+        """Runs fn as component `name`, recording loading/ready/failed and its duration."""
+        with self._lock:
+            self._components[name] = {"state": "loading", "seconds": None, "error": None}
+        started = time.perf_counter()
+        try:
+            fn()
+            state, error = "ready", None
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} failed: {e}")
+            state, error = "failed", str(e)
+        with self._lock:
+            self._components[name] = {"state": state, "seconds": time.perf_counter() - started, "error": error}
+
+    def is_ready(self, name):
+        with self._lock:
+            return self._components.get(name, {}).get("state") == "ready"
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(info) for name, info in self._components.items()}
+
+    def print_report(self, title="STARTUP TIMING REPORT"):
+        """Prints per-component state and load time, in the style of print_gpu_status()."""
+        print("\n" + "=" * 60)
+        print(f"  {title}")
+        print("=" * 60)
+        for name, info in self.snapshot().items():
+            seconds = f"{info['seconds']:.2f}s" if info["seconds"] is not None else "..."
+            line = f"  {name:<18} {info['state']:<8} {seconds}"
+            if info["error"]:
+                line += f"  ({info['error']})"
+            print(line)
+        print(f"  {'total':<18} {'':<8} {time.perf_counter() - self.started_at:.2f}s since start")
+        print("=" * 60 + "\n")
+
+
+STARTUP = StartupTracker()
+
+
+def warm_up(components):
+    """Loads each (name, fn) component in order, recording timings on STARTUP."""
+    for name, fn in components:
+        STARTUP.run(name, fn)
+
+
+def start_background_warmup(components):
+    """Runs warm_up() in a daemon thread and prints the report once everything is loaded."""
+    def worker():
+        warm_up(components)
+        STARTUP.print_report("WARM-UP COMPLETE")
+
+    thread = threading.Thread(target=worker, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -1,7 +1,14 @@
-import chromadb
 import uuid
 import os
+import re
+import json
+import time
+import hashlib
+import threading
 from dotenv import load_dotenv
+from tools.lexical_index_tools import BM25Index, reciprocal_rank_fusion
+from tools.metrics_tools import span, seconds_since_request
+from tools.embedding_tools import EMBEDDING_MODEL_NAME, EMBEDDING_MODEL_ID, get_embedding, get_embeddings, embedding_dimension, unload_model
 
 load_dotenv()
 
@@ -9,56 +16,424 @@ CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "chroma_db")
 # Store DB relative to the main project directory, not inside the tools folder
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), CHROMA_DB_PATH)
 
-try:
-    chroma_client = chromadb.PersistentClient(path=DB_PATH)
-    collection = chroma_client.get_or_create_collection(name="agent_memory")
-except Exception as e:
-    print(f"Error initializing ChromaDB: {e}")
-    collection = None
-
-def store_in_memory(text, embedding, metadata=None):
-    """Store a chunk of text, its embedding, and metadata into the vector DB. (CREATE)"""
-    if not collection or not text.strip() or not embedding:
-        return None
-    
-    doc_id = str(uuid.uuid4())
-    collection.add(
-        embeddings=[embedding],
-        documents=[text],
-        metadatas=[metadata or {}],
-        ids=[doc_id]
+# Lexical fast path: answer from BM25 alone when the best hit scores at least
+# LEXICAL_DECISIVE_SCORE and beats the runner-up by LEXICAL_DECISIVE_RATIO
+LEXICAL_DECISIVE_SCORE = float(os.getenv("LEXICAL_DECISIVE_SCORE", 8.0))
+LEXICAL_DECISIVE_RATIO = float(os.getenv("LEXICAL_DECISIVE_RATIO", 2.0))
+
+# Relevance floor for attaching a chunk to the prompt. Chroma returns squared L2 on
+# normalized embeddings (0 = identical, 2 = orthogonal), so 1.2 ~ cosine similarity 0.4.
+RETRIEVAL_MAX_DISTANCE = float(os.getenv("RETRIEVAL_MAX_DISTANCE", 1.2))
+RETRIEVAL_MIN_LEXICAL_SCORE = float(os.getenv("RETRIEVAL_MIN_LEXICAL_SCORE", 3.0))
+
+# Vectors live in one collection per embedding model, named and tagged with the model and
+# its dimension; ACTIVE_POINTER_FILE (inside DB_PATH) records which one serves queries.
+# When EMBEDDING_MODEL or EMBEDDING_BACKEND changes, stored chunks are re-embedded in the
+# background into a shadow collection and the pointer is switched once it is complete.
+ACTIVE_POINTER_FILE = "active_collection.json"
+LEGACY_COLLECTION = "agent_memory"
+# Re-embedding: chunks per batch, pause between batches, and how long chat must have been
+# quiet before the next batch runs. With REEMBED_AUTO off an admin starts it with /reembed
+REEMBED_AUTO = os.getenv("REEMBED_AUTO", "true").lower().strip() == "true"
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", 64))
+REEMBED_BATCH_DELAY = float(os.getenv("REEMBED_BATCH_DELAY", 0.2))
+REEMBED_QUIET_SECONDS = float(os.getenv("REEMBED_QUIET_SECONDS", 5))
+# Grace period for in-flight queries before the replaced collection is deleted
+_RETIRE_DELAY = 30
+
+chroma_client = None
+collection = None
+# {"name", "model", "dimension"} of the active collection
+active_info = None
+# The collection being filled for EMBEDDING_MODEL_ID while the active one still serves another model
+shadow = None
+shadow_info = None
+# (collection, info) replaced as one object on switch, so a query never pairs one
+# collection with the other's model
+_serving = (None, None)
+_init_attempted = False
+_init_lock = threading.Lock()
+# Serializes writes and deletes with the final catch-up and switch of a re-embed
+_write_lock = threading.RLock()
+_reembed_thread = None
+_reembed_progress = {"copied": 0, "total": 0}
+
+def collection_name(model_name, dimension):
+    """
+    Chroma-safe collection name carrying the model and dimension, e.g.
+    memory_all-MiniLM-L6-v2_fa870ee1_384. The slug alone is ambiguous (org/model vs
+    other-org/model, model@onnx vs model@onnx-int8), so a hash of the full embedding
+    identity keeps every identity in its own collection.
+    """
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", model_name.rsplit("/", 1)[-1]).strip("-_") or "model"
+    digest = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:8]
+    return f"memory_{slug[:40]}_{digest}_{dimension}"
+
+def _read_pointer():
+    try:
+        with open(os.path.join(DB_PATH, ACTIVE_POINTER_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_pointer(active, pending=None):
+    """Atomically replaces the pointer file; `pending` is a shadow collection still being filled."""
+    os.makedirs(DB_PATH, exist_ok=True)
+    path = os.path.join(DB_PATH, ACTIVE_POINTER_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"active": active, "shadow": pending}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _collection_info(model_name):
+    # Knowing the dimension means loading the model, so this only runs when a collection is created
+    dimension = embedding_dimension(model_name)
+    return {"name": collection_name(model_name, dimension), "model": model_name, "dimension": dimension}
+
+def _open_collection(info):
+    return chroma_client.get_or_create_collection(
+        name=info["name"], metadata={"embedding_model": info["model"], "dimension": info["dimension"]}
     )
-    return doc_id
 
-def retrieve_from_memory(query_embedding, n_results=3):
-    """Retrieve top N matching documents for a given query embedding. (READ/RAG)"""
-    if not collection or not query_embedding:
+def _legacy_collection_info():
+    """
+    The single untagged collection from before versioning. Its vectors came from the
+    then-configured model on the torch backend: assumed to be EMBEDDING_MODEL when the
+    dimension matches, otherwise unknown, in which case it is re-embedded like any other
+    model change.
+    """
+    info = _collection_info(EMBEDDING_MODEL_ID)
+    sample = chroma_client.get_collection(name=LEGACY_COLLECTION).get(limit=1, include=["embeddings"])["embeddings"]
+    dimension = len(sample[0]) if sample is not None and len(sample) else info["dimension"]
+    model = EMBEDDING_MODEL_NAME if dimension == info["dimension"] else f"unknown-{dimension}d"
+    return {"name": LEGACY_COLLECTION, "model": model, "dimension": dimension}
+
+def get_collection():
+    """Opens ChromaDB on first use rather than at import. Returns None if it failed to open."""
+    global chroma_client, collection, active_info, shadow, shadow_info, _serving, _init_attempted
+    with _init_lock:
+        if not _init_attempted:
+            _init_attempted = True
+            try:
+                import chromadb
+                chroma_client = chromadb.PersistentClient(path=DB_PATH)
+                pointer = _read_pointer()
+                active_info = pointer.get("active")
+                if active_info is None:
+                    names = [getattr(c, "name", c) for c in chroma_client.list_collections()]
+                    active_info = _legacy_collection_info() if LEGACY_COLLECTION in names \
+                        else _collection_info(EMBEDDING_MODEL_ID)
+                    _write_pointer(active_info)
+                collection = _open_collection(active_info)
+                _serving = (collection, active_info)
+                threading.Thread(target=_rebuild_lexical_index, name="lexical-index", daemon=True).start()
+                if active_info["model"] != EMBEDDING_MODEL_ID:
+                    # Resumes a re-embed interrupted by a restart; chunks already copied are skipped
+                    shadow_info = pointer.get("shadow")
+                    if not shadow_info or shadow_info["model"] != EMBEDDING_MODEL_ID:
+                        shadow_info = _collection_info(EMBEDDING_MODEL_ID)
+                        _write_pointer(active_info, shadow_info)
+                    if shadow_info["name"] == active_info["name"]:
+                        # Re-embedding into the serving collection would delete it at the switch
+                        print(f"Not re-embedding: shadow collection '{shadow_info['name']}' is the active one, "
+                              f"still serving it with {active_info['model']}")
+                        shadow_info = None
+                    else:
+                        shadow = _open_collection(shadow_info)
+                        print(f"Embedding model or backend changed ({active_info['model']} -> {EMBEDDING_MODEL_ID}): "
+                              f"serving '{active_info['name']}' until '{shadow_info['name']}' is re-embedded")
+                        if REEMBED_AUTO:
+                            start_reembed()
+                        else:
+                            print("REEMBED_AUTO is off: an admin starts the re-embed with /reembed")
+            except Exception as e:
+                print(f"Error initializing ChromaDB: {e}")
+                collection = None
+        return collection
+
+def _embed_query(text, info):
+    """Query embedding in the vector space of the collection described by info."""
+    return get_embedding(text, model_name=info["model"])
+
+def index_texts(texts, metadatas=None):
+    """
+    Embeds and stores chunks (BULK CREATE) with the model of the active collection.
+    While a re-embed is running they are also embedded with EMBEDDING_MODEL_ID and
+    written to the shadow collection under the same ids.
+    """
+    if not get_collection():
         return []
-    
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results
-    )
-    
-    # Return matched documents
-    if results and "documents" in results and results["documents"]:
-        return results["documents"][0]
-    return []
+    while True:
+        serving_info = _serving[1]
+        embeddings = get_embeddings(texts, model_name=serving_info["model"]) \
+            if not serving_info["model"].startswith("unknown-") else None
+        shadow_embeddings = get_embeddings(texts) if shadow is not None else None
+        ids = store_many(texts, embeddings, metadatas, shadow_embeddings=shadow_embeddings,
+                         embedding_model=serving_info["model"])
+        if ids is not None:
+            return ids
+        # A re-embed switched collections while this batch was embedding: redo it for the new one
+
+def _wait_for_quiet():
+    """Holds re-embedding back until no chat request has started for REEMBED_QUIET_SECONDS."""
+    while (idle := seconds_since_request("chat")) < REEMBED_QUIET_SECONDS:
+        time.sleep(REEMBED_QUIET_SECONDS - idle)
+
+def _copy_missing(source, target, wait=True):
+    """
+    Re-embeds with EMBEDDING_MODEL_ID every chunk of source that target lacks. Returns how
+    many were copied. wait=False skips the pause for chat traffic, for the final pass that
+    runs with writes held.
+    """
+    done = set(target.get(include=[])["ids"])
+    todo = [doc_id for doc_id in source.get(include=[])["ids"] if doc_id not in done]
+    _reembed_progress.update(total=len(done) + len(todo), copied=len(done))
+    copied = 0
+    for i in range(0, len(todo), REEMBED_BATCH_SIZE):
+        if wait:
+            _wait_for_quiet()
+        page = source.get(ids=todo[i:i + REEMBED_BATCH_SIZE], include=["documents", "metadatas"])
+        if not page["ids"]:
+            continue  # The whole batch was deleted meanwhile
+        with span("reembed.batch", chunks=len(page["ids"])):
+            embeddings = get_embeddings(page["documents"])
+        with _write_lock:
+            # Chunks deleted while the batch was embedding must not come back
+            alive = set(source.get(ids=page["ids"], include=[])["ids"])
+            keep = [j for j, doc_id in enumerate(page["ids"]) if doc_id in alive and embeddings[j]]
+            if keep:
+                target.upsert(ids=[page["ids"][j] for j in keep],
+                              embeddings=[embeddings[j] for j in keep],
+                              documents=[page["documents"][j] for j in keep],
+                              metadatas=[page["metadatas"][j] or {} for j in keep])
+        copied += len(keep)
+        _reembed_progress["copied"] = len(done) + copied
+        if wait:
+            time.sleep(REEMBED_BATCH_DELAY)
+    return copied
+
+def _reembed():
+    """Background job: streams the active collection through EMBEDDING_MODEL_ID into the shadow, then switches."""
+    global collection, active_info, shadow, shadow_info, _serving
+    source, target, old_info, new_info = collection, shadow, active_info, shadow_info
+    started = time.perf_counter()
+    try:
+        while _copy_missing(source, target):
+            pass
+        with _write_lock:
+            if shadow is not target:
+                return  # Memory was wiped meanwhile
+            # Nothing is written while the last stragglers are copied and the pointer flips
+            _copy_missing(source, target, wait=False)
+            _write_pointer(new_info)
+            collection, active_info = target, new_info
+            _serving = (target, new_info)
+            shadow = shadow_info = None
+    except Exception as e:
+        print(f"Re-embedding failed, still serving '{old_info['name']}': {e}")
+        return
+    print(f"Re-embedded {_reembed_progress['total']} chunks with {EMBEDDING_MODEL_ID} in "
+          f"{time.perf_counter() - started:.0f}s, now serving '{new_info['name']}'")
+    unload_model(old_info["model"])
+    # Queries that picked up the old collection just before the switch may still be running
+    time.sleep(_RETIRE_DELAY)
+    try:
+        chroma_client.delete_collection(name=old_info["name"])
+    except Exception as e:
+        print(f"Could not delete retired collection '{old_info['name']}': {e}")
+
+def start_reembed():
+    """Starts the background re-embed into the shadow collection. False if there is none or it is already running."""
+    global _reembed_thread
+    if collection is None or shadow is None or (_reembed_thread and _reembed_thread.is_alive()):
+        return False
+    if shadow_info["name"] == active_info["name"]:
+        print(f"Not re-embedding: shadow collection '{shadow_info['name']}' is the active one")
+        return False
+    _reembed_thread = threading.Thread(target=_reembed, name="reembed", daemon=True)
+    _reembed_thread.start()
+    return True
+
+def collection_status():
+    """The active collection's info and, while a re-embed is pending, the shadow's info and progress."""
+    get_collection()
+    status = {"active": active_info, "shadow": shadow_info}
+    if shadow_info:
+        status["running"] = bool(_reembed_thread and _reembed_thread.is_alive())
+        status.update(_reembed_progress)
+    return status
+
+# BM25 index kept in step with the collection by every write/delete below
+lexical_index = BM25Index()
+# Set once the startup rebuild has indexed every stored chunk; until then the lexical-only
+# fast path is off, since a missing chunk could make a wrong hit look decisive
+_lexical_ready = threading.Event()
+
+def _rebuild_lexical_index(page_size=1000):
+    """
+    Indexes every stored chunk into the BM25 index in the background, so startup does not
+    grow with the corpus. Only the ids are listed up front; documents are read a page at a
+    time from the collection serving at that moment, under the write lock, so chunks
+    deleted or switched over meanwhile are not resurrected.
+    """
+    try:
+        sources = [c for c in (_serving[0], shadow) if c is not None]
+        ids = list(dict.fromkeys(doc_id for c in sources for doc_id in c.get(include=[])["ids"]))
+        for start in range(0, len(ids), page_size):
+            with _write_lock:
+                for source in filter(None, (_serving[0], shadow)):
+                    page = source.get(ids=ids[start:start + page_size], include=["documents", "metadatas"])
+                    for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                        lexical_index.add(doc_id, text or "", (metadata or {}).get("source"))
+        print(f"Lexical index ready: {len(lexical_index)} chunks")
+    except Exception as e:
+        print(f"Lexical index rebuild failed, lexical matching is partial until restart: {e}")
+    finally:
+        _lexical_ready.set()
+
+def store_many(texts, embeddings, metadatas=None, shadow_embeddings=None, embedding_model=None):
+    """
+    Store several chunks in a single collection.add transaction. (BULK CREATE)
+    Entries with blank text or a missing embedding are skipped. Returns the stored ids.
+    shadow_embeddings (same order, from EMBEDDING_MODEL_ID) are written to the shadow
+    collection during a re-embed; embeddings may then be None if the active model is unknown.
+    embedding_model names the model embeddings came from: if the active collection no
+    longer uses it (a re-embed switched meanwhile), nothing is stored and None is returned.
+    """
+    collection = get_collection()
+    if not collection:
+        return []
+    if metadatas is None:
+        metadatas = [{}] * len(texts)
+    if embeddings is None:
+        embeddings = [None] * len(texts)
+    if shadow_embeddings is None:
+        shadow_embeddings = [None] * len(texts)
+
+    docs, embs, metas, ids, shadow_embs = [], [], [], [], []
+    for text, embedding, metadata, shadow_embedding in zip(texts, embeddings, metadatas, shadow_embeddings):
+        if not text.strip() or not (embedding or shadow_embedding):
+            continue
+        docs.append(text)
+        embs.append(embedding)
+        metas.append(metadata or {})
+        ids.append(str(uuid.uuid4()))
+        shadow_embs.append(shadow_embedding)
+
+    if not ids:
+        return []
+    with _write_lock:
+        active, serving_info = _serving
+        if embedding_model is not None and serving_info["model"] != embedding_model:
+            return None
+        rows = [j for j, embedding in enumerate(embs) if embedding]
+        if rows:
+            with span("vectordb.add", chunks=len(rows)):
+                active.add(
+                    embeddings=[embs[j] for j in rows],
+                    documents=[docs[j] for j in rows],
+                    metadatas=[metas[j] for j in rows],
+                    ids=[ids[j] for j in rows]
+                )
+        shadow_rows = [j for j, embedding in enumerate(shadow_embs) if embedding]
+        if shadow is not None and shadow_rows:
+            shadow.add(
+                embeddings=[shadow_embs[j] for j in shadow_rows],
+                documents=[docs[j] for j in shadow_rows],
+                metadatas=[metas[j] for j in shadow_rows],
+                ids=[ids[j] for j in shadow_rows]
+            )
+    for doc_id, text, metadata in zip(ids, docs, metas):
+        lexical_index.add(doc_id, text, metadata.get("source"))
+    return ids
 
 def delete_by_source(source_name):
     """Removes all embedded chunks associated with a specific file source. (DELETE)"""
-    if not collection: return False
-    collection.delete(where={"source": source_name})
+    if not get_collection(): return False
+    with _write_lock:
+        _serving[0].delete(where={"source": source_name})
+        if shadow is not None:
+            shadow.delete(where={"source": source_name})
+    lexical_index.remove_source(source_name)
     return True
 
+def _lexical_is_decisive(hits):
+    if not hits or hits[0][1] < LEXICAL_DECISIVE_SCORE:
+        return False
+    return len(hits) == 1 or hits[0][1] >= LEXICAL_DECISIVE_RATIO * hits[1][1]
+
+def hybrid_retrieve(query_text, embed_fn=None, n_results=3,
+                    max_distance=RETRIEVAL_MAX_DISTANCE, min_lexical_score=RETRIEVAL_MIN_LEXICAL_SCORE):
+    """
+    Hybrid retrieval (READ/RAG): BM25 over the in-process inverted index fused with
+    dense ANN search via reciprocal-rank fusion. When the lexical hit is decisive
+    (an exact file name, ID or phrase) the encoder and ANN search are skipped.
+    embed_fn(text) -> embedding is only called when the dense half is needed; by
+    default the query is embedded with the model of the collection being searched.
+    
+    Only chunks that clear a relevance bar are returned: vector hits within
+    max_distance and BM25 hits scoring at least min_lexical_score. An unrelated
+    query therefore returns [] rather than the N nearest chunks regardless.
+    """
+    if not get_collection() or not query_text or not query_text.strip():
+        return []
+    collection, serving_info = _serving
+    
+    with span("lexical.search") as info:
+        lexical_hits = lexical_index.search(query_text, n_results=n_results * 2)
+        info["hits"] = len(lexical_hits)
+    lexical_ids = [doc_id for doc_id, score in lexical_hits if score >= min_lexical_score]
+    
+    if _lexical_ready.is_set() and _lexical_is_decisive(lexical_hits):
+        ranked_ids = lexical_ids[:n_results]
+        docs = {}
+    else:
+        dense_ids, docs = [], {}
+        if serving_info["model"].startswith("unknown-"):
+            # Vectors from a model that is no longer known: BM25 only until the re-embed switches over
+            results = None
+        else:
+            query_embedding = embed_fn(query_text) if embed_fn else _embed_query(query_text, serving_info)
+            if not query_embedding:
+                return []
+            with span("vectordb.query"):
+                results = collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=n_results,
+                    include=["documents", "distances"]
+                )
+        if results and results.get("ids"):
+            for doc_id, doc, dist in zip(results["ids"][0], results["documents"][0], results["distances"][0]):
+                if dist <= max_distance:
+                    dense_ids.append(doc_id)
+                    docs[doc_id] = doc
+        ranked_ids = reciprocal_rank_fusion([dense_ids, lexical_ids])[:n_results]
+    
+    # Fetch any lexical-only hits that the ANN query did not already return; chunks
+    # uploaded while an unknown-model collection is active exist only in the shadow
+    for source in filter(None, (collection, shadow)):
+        missing = [doc_id for doc_id in ranked_ids if doc_id not in docs]
+        if missing:
+            fetched = source.get(ids=missing, include=["documents"])
+            docs.update(zip(fetched["ids"], fetched["documents"]))
+    return [docs[doc_id] for doc_id in ranked_ids if docs.get(doc_id)]
+
 def wipe_all_memory():
-    """Completely wipes the entire vector memory database. (NUCLEAR DELETE)"""
-    global collection
+    """Completely wipes the entire vector memory database, including any re-embed in progress. (NUCLEAR DELETE)"""
+    global collection, active_info, shadow, shadow_info, _serving
     try:
-        if collection:
-            count = collection.count()
-            chroma_client.delete_collection(name="agent_memory")
-            collection = chroma_client.get_or_create_collection(name="agent_memory")
+        if get_collection():
+            with _write_lock:
+                count = collection.count()
+                for info in filter(None, (active_info, shadow_info)):
+                    chroma_client.delete_collection(name=info["name"])
+                # Start over with a collection for the configured model
+                active_info = _collection_info(EMBEDDING_MODEL_ID)
+                collection = _open_collection(active_info)
+                _serving = (collection, active_info)
+                shadow = shadow_info = None
+                _write_pointer(active_info)
+                lexical_index.clear()
+                _lexical_ready.set()
             return count
         return 0
     except Exception as e:
@@ -1,10 +1,12 @@
 import base64
 import os
-from huggingface_hub import hf_hub_download
-from llama_cpp import Llama
-from llama_cpp.llama_chat_format import Llava15ChatHandler
 from dotenv import load_dotenv
-from tools.gpu_config import GPU_CONFIG
+from tools.gpu_config import get_cached_gpu_config
+from tools.scheduler_tools import InferenceScheduler, PRIORITY_BACKGROUND
+from tools.metrics_tools import span
+from tools.model_manager_tools import MODELS, estimate_footprint_mb
+from tools.image_tools import PreparedImage
+from tools.autotune_tools import active_profile
 
 load_dotenv()
 
@@ -12,65 +14,107 @@ VISION_REPO_ID = os.getenv("VISION_REPO_ID", "mys/ggml_llava-v1.5-7b")
 VISION_MODEL_FILE = os.getenv("VISION_MODEL_FILE", "ggml-model-q4_k.gguf")
 VISION_MMPROJ_FILE = os.getenv("VISION_MMPROJ_FILE", "mmproj-model-f16.gguf")
 MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.getcwd(), "models"))
+VISION_QUEUE_SIZE = int(os.getenv("VISION_QUEUE_SIZE", 4))
 
-_vision_llm = None
+# Footprint hints for the model manager: LLaVA 1.5 7B has 32 layers, ~4.5 GB with the
+# projector; logits_all keeps n_ctx x 32000 float logits (~250 MB) on top of the KV cache
+VISION_N_LAYERS = 32
+VISION_OVERHEAD_MB = 700
+
+# The vision model is only ever touched from this scheduler's worker thread
+VISION_SCHEDULER = InferenceScheduler("vision", max_queue=VISION_QUEUE_SIZE)
+
+def _load_vision_llm():
+    # Heavy imports are deferred until the model is actually needed
+    from huggingface_hub import hf_hub_download
+    from llama_cpp import Llama
+    from llama_cpp.llama_chat_format import Llava15ChatHandler
+    
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    print(f"Ensuring vision models are downloaded to {MODEL_DIR}...")
+    model_path = hf_hub_download(
+        repo_id=VISION_REPO_ID,
+        filename=VISION_MODEL_FILE,
+        local_dir=MODEL_DIR,
+        local_dir_use_symlinks=False
+    )
+    mmproj_path = hf_hub_download(
+        repo_id=VISION_REPO_ID,
+        filename=VISION_MMPROJ_FILE,
+        local_dir=MODEL_DIR,
+        local_dir_use_symlinks=False
+    )
+    
+    gpu_config = get_cached_gpu_config()
+    n_gpu_layers = gpu_config["n_gpu_layers"]
+    mode = "GPU" if gpu_config["use_gpu"] else "CPU"
+    # Thread and batch settings tuned for the chat model on this host carry over
+    profile = active_profile() or {}
+    n_threads = profile.get("n_threads", 8)
+    print(f"Loading local Vision model ({mode} mode, {n_gpu_layers} GPU layers, {n_threads} threads)...")
+    
+    chat_handler = Llava15ChatHandler(clip_model_path=mmproj_path)
+    return Llama(
+        model_path=model_path,
+        chat_handler=chat_handler,
+        n_ctx=2048,
+        n_threads=n_threads,
+        n_threads_batch=profile.get("n_threads_batch", n_threads),
+        n_batch=profile.get("n_batch", 512),
+        n_gpu_layers=n_gpu_layers,  # Dynamic: -1 (all GPU), 0 (CPU), or partial
+        logits_all=True,
+        verbose=False
+    )
+
+def _vision_footprint():
+    paths = [os.path.join(MODEL_DIR, VISION_MODEL_FILE), os.path.join(MODEL_DIR, VISION_MMPROJ_FILE)]
+    return estimate_footprint_mb(paths, get_cached_gpu_config()["n_gpu_layers"], VISION_N_LAYERS,
+                                 extra_mb=VISION_OVERHEAD_MB, fallback_mb=4500)
+
+# Unpinned: unloaded after MODEL_IDLE_TIMEOUT or when another model needs the memory
+MODELS.register("vision", _load_vision_llm, footprint=_vision_footprint)
 
 def get_vision_llm():
-    global _vision_llm
-    if _vision_llm is None:
-        os.makedirs(MODEL_DIR, exist_ok=True)
-        print(f"Ensuring vision models are downloaded to {MODEL_DIR}...")
-        model_path = hf_hub_download(
-            repo_id=VISION_REPO_ID,
-            filename=VISION_MODEL_FILE,
-            local_dir=MODEL_DIR,
-            local_dir_use_symlinks=False
-        )
-        mmproj_path = hf_hub_download(
-            repo_id=VISION_REPO_ID,
-            filename=VISION_MMPROJ_FILE,
-            local_dir=MODEL_DIR,
-            local_dir_use_symlinks=False
-        )
-        
-        n_gpu_layers = GPU_CONFIG["n_gpu_layers"]
-        mode = "GPU" if GPU_CONFIG["use_gpu"] else "CPU"
-        print(f"Loading local Vision model ({mode} mode, {n_gpu_layers} GPU layers)...")
-        
-        chat_handler = Llava15ChatHandler(clip_model_path=mmproj_path)
-        _vision_llm = Llama(
-            model_path=model_path,
-            chat_handler=chat_handler,
-            n_ctx=2048,
-            n_threads=8,
-            n_gpu_layers=n_gpu_layers,  # Dynamic: -1 (all GPU), 0 (CPU), or partial
-            logits_all=True,
-            verbose=False
-        )
-    return _vision_llm
+    return MODELS.get("vision")
 
-def analyze_image(file_path, prompt="Describe this image in detail and identify any objects or text."):
+def analyze_image(image, prompt="Describe this image in detail and identify any objects or text.",
+                  priority=PRIORITY_BACKGROUND, user_id=None):
     """
     Sends the image to a local Vision model via llama-cpp-python to generate captions.
+    `image` is either JPEG bytes already sized for the model (PreparedImage.vision_jpeg())
+    or a file path, which is decoded and downscaled first; full-size photos are never encoded.
+    Queued on VISION_SCHEDULER; SchedulerBusyError is raised when it is full.
     """
     try:
-        with open(file_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            
-        vision_llm = get_vision_llm()
-        
-        messages = [
-            {"role": "system", "content": "You are a helpful visual assistant."},
-            {"role": "user", "content": [
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_string}"}},
-                {"type": "text", "text": prompt}
-            ]}
-        ]
-        
-        response = vision_llm.create_chat_completion(
-            messages=messages,
-            stream=False
-        )
+        if not isinstance(image, bytes):
+            prepared = PreparedImage(image)
+            image = prepared.vision_jpeg()
+            prepared.close()
+        encoded_string = base64.b64encode(image).decode('utf-8')
+    except Exception as e:
+        return f"Vision processing error: {str(e)}"
+    
+    messages = [
+        {"role": "system", "content": "You are a helpful visual assistant."},
+        {"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_string}"}},
+            {"type": "text", "text": prompt}
+        ]}
+    ]
+    return VISION_SCHEDULER.run(_caption_image, messages, priority=priority, user_id=user_id)
+
+def _caption_image(messages):
+    """Runs the vision chat completion. Must only be called from the scheduler worker."""
+    try:
+        # Held for the whole call so an idle-eviction cannot unload it mid-caption
+        with MODELS.use("vision") as vision_llm, span("vision.caption") as info:
+            response = vision_llm.create_chat_completion(
+                messages=messages,
+                stream=False
+            )
+            usage = response.get("usage") or {}
+            info["prompt_tokens"] = usage.get("prompt_tokens", 0)
+            info["completion_tokens"] = usage.get("completion_tokens", 0)
         return response['choices'][0]['message']['content'].strip()
     except Exception as e:
         return f"Vision processing error: {str(e)}"